@@ -1,23 +1,26 @@
 from pathlib import Path
-import tempfile
 import streamlit as st
-from openpyxl import load_workbook, Workbook
 
-# El motor de automatización es ahora la única fuente de verdad para la lógica de negocio
-from scripts.motor_automatizacion import (
-    load_project_ranges,
-    load_project_formats,
-    discover_and_load_blocks,
-    PLANTILLA_PATH,  # Importar la ruta de la plantilla desde el motor
+# Capa de caché de Streamlit: un motor por proceso (configuración, análisis y pool)
+from scripts.cache_streamlit import (
+    obtener_configuracion,
+    obtener_motor,
+)
+from scripts.ingesta import LibroSubido
+from scripts.componentes_streamlit import (
+    boton_descarga,
+    descartar_pregeneracion,
+    descartar_salida,
+    firma_generacion,
+    lanzar_generacion,
+    panel_generacion,
+    pregenerar,
+    vista_previa_secciones,
 )
-# La lógica de generación final todavía se importa directamente, se moverá en un paso posterior
-from scripts.core_secciones import generar_docx_final_en_memoria
-import pandas as pd
-
 
-# Cargar config de rangos y formatos una vez usando el motor
-RANGOS_ESTATICOS = {} # Ya no se carga rangos_hojas.json
-FORMATOS = load_project_formats()
+# Formatos y plantilla compilados una vez por proceso; si cambian en disco se
+# recargan en segundo plano y la siguiente ejecución del script ya los recibe
+CONFIG = obtener_configuracion()
 
 # Orden definido (alineado con unir_documentos.py)
 ORDER = [
@@ -48,1157 +51,155 @@ ORDER = [
     "Nota 16",
 ]
 
-
-
-
 # ===================== GESTIÓN DE ESTADO ===================== #
 
-
-
-
 # Inicializar variables en el estado de la sesión si no existen
-
-
-
-
+# ATENCIÓN: no se guarda el Workbook en sesión, solo el libro subido y el
+# resultado del análisis.
+# 'buf_final' guarda el manejador del documento generado, no sus bytes
+# (ver scripts/almacen_sesiones.py)
 if 'buf_final' not in st.session_state:
-
-
-
-
     st.session_state.buf_final = None
-
-
-
-
 if 'file_name' not in st.session_state:
-
-
-
-
     st.session_state.file_name = None
-
-
-
-
-if 'workbook' not in st.session_state:
-
-
-
-
-    st.session_state.workbook = None
-
-
-
-
+if 'libro' not in st.session_state:
+    st.session_state.libro = None
 if 'rangos_dinamicos' not in st.session_state:
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
     st.session_state.rangos_dinamicos = None
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+# Trabajo de generación en segundo plano y último error/cancelación
+if 'trabajo' not in st.session_state:
+    st.session_state.trabajo = None
+if 'error_generacion' not in st.session_state:
+    st.session_state.error_generacion = None
+if 'trabajo_especulativo' not in st.session_state:
+    st.session_state.trabajo_especulativo = None
 
 # ===================== LÓGICA REACTIVA CENTRAL (INPUT Y PROCESAMIENTO) =====================
 
-
-
-
-
-
-
-
-
 # 1. Input principal: Carga de archivo
-
-
-
-
 # Se mueve al nivel raíz para asegurar que se ejecute antes del layout.
-
-
-
-
 uploaded_file = st.file_uploader(
-
-
-
-
     "Sube tu archivo UNC en Excel",
-
-
-
-
     type=["xlsx", "xlsm"],
-
-
-
-
     help="Sube el archivo Excel para procesar. Se analizarán las hojas y sus contenidos para generar el dictamen.",
-
-
-
-
     key="file_uploader"
-
-
-
-
 )
 
-
-
-
-
-
-
-
-
 # 2. Procesamiento del archivo
-
-
-
-
 # Esta lógica ahora se ejecuta a nivel raíz, garantizando que el estado se
-
-
-
-
 # actualice de forma atómica antes de renderizar la UI.
-
-
-
-
-if uploaded_file is not None and st.session_state.workbook is None:
-
-
-
-
+if uploaded_file is not None and st.session_state.libro is None:
     with st.spinner("Analizando archivo Excel..."):
+        # Los bytes subidos se leen directamente desde memoria; solo los
+        # archivos muy grandes se vuelcan a un temporal (ver scripts/ingesta.py)
+        st.session_state.libro = LibroSubido(uploaded_file.getvalue(), uploaded_file.name)
 
-
-
-
-        # Uso de archivo temporal para compatibilidad con openpyxl
-
-
-
-
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp:
-
-
-
-
-            tmp.write(uploaded_file.getvalue())
-
-
-
-
-            temp_path = tmp.name
-
-
-
-
-        
-
-
-
-
-        # Carga del workbook y descubrimiento de bloques
-
-
-
-
-        st.session_state.workbook = load_workbook(temp_path, data_only=True)
-
-
-
-
+        # Descubrimiento de bloques (cacheado por hash del archivo subido)
         st.session_state.file_name = uploaded_file.name
-
-
-
-
-        st.session_state.rangos_dinamicos = discover_and_load_blocks(
-
-
-
-
-                    st.session_state.workbook, RANGOS_ESTATICOS, FORMATOS
-
-
-
-
-                )
-
-
-
-
+        st.session_state.rangos_dinamicos, _ = obtener_motor().descubrir(
+            st.session_state.libro, config=CONFIG
+        )
         st.session_state.buf_final = None  # Limpiar buffer en cada nueva carga
-
-
-
-
         st.success(f"Archivo '{st.session_state.file_name}' cargado y analizado.")
-
-
-
-
         # Se recomienda un rerun para asegurar que la UI se actualice con el nuevo estado
-
-
-
-
         st.rerun()
 
-
-
-
-
-
-
-
-
-
-
-
-
-
 # ===================== INTERFAZ STREAMLIT (RENDERIZADO) =====================
 
-
-
-
-
-
-
-
-
 st.title("Generador de Dictamen UNC")
 
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
 # --- Layout de dos columnas ---
+col1, col2 = st.columns([1, 2])
 
+# --- COLUMNA IZQUIERDA: CONTROLES ---
+@st.fragment
+def controles_generacion():
+    """
+    Controles de generación y descarga. Es un fragmento: sus widgets solo
+    vuelven a ejecutar esta función, no la previsualización.
+    """
+    st.header("2. Generar y Descargar")
+
+    # El orden ahora se toma directamente de las hojas descubiertas
+    orden_dinamico = list(st.session_state.rangos_dinamicos.keys())
+    firma = firma_generacion(st.session_state.libro.hash, orden_dinamico)
+    parametros_generacion = dict(
+        workbook_path=st.session_state.libro,
+        rangos_dinamicos=st.session_state.rangos_dinamicos,
+        orden_hojas=orden_dinamico,
+        id_incremental=st.session_state.file_name,
+        config=CONFIG,
+    )
+
+    # Modo especulativo (opcional): se genera en segundo plano nada más
+    # analizar, para que el botón de generar responda al instante.
+    if st.toggle("Pregenerar en segundo plano", key="pregenerar", help="Empieza a generar el dictamen en cuanto se analiza el archivo."):
+        if (
+            st.session_state.rangos_dinamicos
+            and st.session_state.trabajo is None
+            and st.session_state.buf_final is None
+            and not st.session_state.error_generacion
+            and obtener_motor().hay_trabajador_libre()
+        ):
+            pregenerar(obtener_motor().generar_final, firma, en_cola=True, **parametros_generacion)
+    else:
+        descartar_pregeneracion()
+
+    generando = st.session_state.trabajo is not None
+    if st.button("Generar DOCX final", type="primary", help="Crea el documento Word con el dictamen completo.", key="generate_button", disabled=generando):
+        # La generación corre en segundo plano; la previsualización sigue disponible.
+        # Si ya hay una pregeneración con las mismas entradas, se reutiliza.
+        lanzar_generacion(obtener_motor().generar_final, firma, en_cola=True, **parametros_generacion)
+        st.session_state.buf_final = None
+        st.session_state.error_generacion = None
+        generando = True
+
+    if generando:
+        panel_generacion()
+    elif st.session_state.error_generacion:
+        st.warning(st.session_state.error_generacion)
+
+    # Desde el almacén de sesiones (memoria o disco, ver `boton_descarga`)
+    boton_descarga()
+
+    st.markdown("---")
+    if st.button("Empezar de Nuevo", help="Limpia la aplicación para procesar un nuevo archivo.", key="reset_button"):
+        # Borrar el temporal (si lo hubo) antes de olvidar el libro
+        if st.session_state.trabajo is not None:
+            st.session_state.trabajo.cancelar()
+        descartar_pregeneracion()
+        descartar_salida()
+        if st.session_state.libro is not None:
+            st.session_state.libro.liberar()
+        for key in list(st.session_state.keys()):
+            del st.session_state[key]
+        st.rerun()
 
 
+with col1:
+    if st.session_state.libro:
+        controles_generacion()
+    else:
+        st.info("Sube un archivo para activar los controles.")
 
+# --- COLUMNA DERECHA: PREVISUALIZACIÓN Y RESULTADOS ---
+with col2:
+    st.header("Detalle y Previsualización")
 
+    if st.session_state.libro is None:
+        st.info("Sube un archivo Excel para comenzar el análisis y la previsualización.")
 
+    elif st.session_state.rangos_dinamicos:
+        # La lista de hojas disponibles ahora se toma directamente de las claves
+        # del diccionario de rangos, respetando el orden del Excel.
+        hojas_disponibles = list(st.session_state.rangos_dinamicos.keys())
 
+        if not hojas_disponibles:
+            st.warning("El archivo fue cargado, pero no se encontraron secciones o bloques de contenido con los criterios actuales.")
+        else:
+            with st.expander("Ver Previsualización de Secciones", expanded=True):
+                # Fragmento: cambiar de hoja solo vuelve a dibujar la previsualización
+                vista_previa_secciones(hojas_disponibles, st.session_state.rangos_dinamicos)
 
-
-col1, col2 = st.columns([1, 2])
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-# --- COLUMNA IZQUIERDA: CONTROLES ---
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-with col1:
-
-
-
-
-
-
-
-
-
-    if st.session_state.workbook:
-
-
-
-
-
-
-
-
-
-        st.header("2. Generar y Descargar")
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-        if st.button("Generar DOCX final", type="primary", help="Crea el documento Word con el dictamen completo.", key="generate_button"):
-
-
-
-
-
-
-
-
-
-            with st.spinner("Generando documento final... Por favor espera."):
-
-
-
-
-
-
-
-
-
-                # El orden ahora se toma directamente de las hojas descubiertas
-
-
-
-
-
-
-
-
-
-                orden_dinamico = list(st.session_state.rangos_dinamicos.keys())
-
-
-
-
-
-
-
-
-
-                st.session_state.buf_final = generar_docx_final_en_memoria(
-
-
-
-
-
-
-
-
-
-                    st.session_state.workbook,
-
-
-
-
-
-
-
-
-
-                    st.session_state.rangos_dinamicos,
-
-
-
-
-
-
-
-
-
-                    PLANTILLA_PATH,
-
-
-
-
-
-
-
-
-
-                    orden=orden_dinamico,
-
-
-
-
-
-
-
-
-
-                    formatos=FORMATOS,
-
-
-
-
-
-
-
-
-
-                )
-
-
-
-
-
-
-
-
-
-            st.success("¡Documento generado con éxito!")
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-        if st.session_state.buf_final:
-
-
-
-
-
-
-
-
-
-            st.download_button(
-
-
-
-
-
-
-
-
-
-                label="Descargar DICTAMEN_FINAL.docx",
-
-
-
-
-
-
-
-
-
-                data=st.session_state.buf_final,
-
-
-
-
-
-
-
-
-
-                file_name="DICTAMEN_FINAL.docx",
-
-
-
-
-
-
-
-
-
-                mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-
-
-
-
-
-
-
-
-
-                help="Haz clic para descargar el documento Word generado.",
-
-
-
-
-
-
-
-
-
-                key="download_button"
-
-
-
-
-
-
-
-
-
-            )
-
-
-
-
-
-
-
-
-
-        else:
-
-
-
-
-
-
-
-
-
-            st.info("Genera el dictamen para habilitar la descarga.")
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-        st.markdown("---")
-
-
-
-
-
-
-
-
-
-        if st.button("Empezar de Nuevo", help="Limpia la aplicación para procesar un nuevo archivo.", key="reset_button"):
-
-
-
-
-
-
-
-
-
-            for key in list(st.session_state.keys()):
-
-
-
-
-
-
-
-
-
-                del st.session_state[key]
-
-
-
-
-
-
-
-
-
-            st.rerun()
-
-
-
-
-
-
-
-
-
-    else:
-
-
-
-
-
-
-
-
-
-        st.info("Sube un archivo para activar los controles.")
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-# --- COLUMNA DERECHA: PREVISUALIZACIÓN Y RESULTADOS ---
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-with col2:
-
-
-
-
-
-
-
-
-
-    st.header("Detalle y Previsualización")
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-    if st.session_state.workbook is None:
-
-
-
-
-
-
-
-
-
-        st.info("Sube un archivo Excel para comenzar el análisis y la previsualización.")
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-    elif st.session_state.rangos_dinamicos:
-
-
-
-
-
-
-
-
-
-        # La lista de hojas disponibles ahora se toma directamente de las claves
-
-
-
-
-
-
-
-
-
-        # del diccionario de rangos, respetando el orden del Excel.
-
-
-
-
-
-
-
-
-
-        hojas_disponibles = list(st.session_state.rangos_dinamicos.keys())
-
-
-
-
-
-
-
-
-
-        
-
-
-
-
-
-
-
-
-
-        if not hojas_disponibles:
-
-
-
-
-
-
-
-
-
-            st.warning("El archivo fue cargado, pero no se encontraron secciones o bloques de contenido con los criterios actuales.")
-
-
-
-
-
-
-
-
-
-        else:
-
-
-
-
-
-
-
-
-
-            with st.expander("Ver Previsualización de Secciones", expanded=True):
-
-
-
-
-
-
-
-
-
-                hoja_sel = st.selectbox(
-
-
-
-
-
-
-
-
-
-                    "Selecciona una sección/hoja para previsualizar:",
-
-
-
-
-
-
-
-
-
-                    hojas_disponibles,
-
-
-
-
-
-
-
-
-
-                    help="Permite ver el contenido detectado en cada sección."
-
-
-
-
-
-
-
-
-
-                )
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-                if hoja_sel:
-
-
-
-
-
-
-
-
-
-                    bloques = st.session_state.rangos_dinamicos.get(hoja_sel, [])
-
-
-
-
-
-
-
-
-
-                    if not bloques:
-
-
-
-
-
-
-
-
-
-                        st.warning("No se encontraron bloques de contenido para esta sección.")
-
-
-
-
-
-
-
-
-
-                    else:
-
-
-
-
-
-
-
-
-
-                        st.subheader(f"Contenido de '{hoja_sel}'")
-
-
-
-
-
-
-
-
-
-                        for i, bloque in enumerate(bloques, 1):
-
-
-
-
-
-
-
-
-
-                            st.markdown(f"**Bloque {i}:** Tipo=`{bloque['tipo']}`")
-
-
-
-
-
-
-
-
-
-                            if isinstance(bloque.get('contenido'), pd.DataFrame):
-
-
-
-
-
-
-
-
-
-                                st.table(bloque['contenido'])
-
-
-
-
-
-
-
-
-
-                            else:
-
-
-
-
-
-
-
-
-
-                                st.text_area(
-
-
-
-
-
-
-
-
-
-                                    f"Contenido del Bloque {i}",
-
-
-
-
-
-
-
-
-
-                                    value=str(bloque.get('contenido', '')),
-
-
-
-
-
-
-
-
-
-                                    height=100,
-
-
-
-
-
-
-
-
-
-                                    disabled=True,
-
-
-
-
-
-
-
-
-
-                                )
-
-
-
-
-
-
-
-
-
-                else:
-
-
-
-
-
-
-
-
-
-                    st.info("Selecciona una hoja para ver su previsualización.")
-
-
-
-
-
-
-
-
-
-    
-
-
-
-
-
-
-
-
-
-    elif st.session_state.workbook and not st.session_state.rangos_dinamicos:
-
-
-
-
-
-
-
-
-
+    elif st.session_state.libro and not st.session_state.rangos_dinamicos:
         st.warning("El archivo fue cargado, pero no se encontraron secciones o bloques de contenido con los criterios actuales.")
-
-
-
-
-
-
-
-
-
-
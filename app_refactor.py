@@ -1,35 +1,52 @@
 from pathlib import Path
-import tempfile
 import streamlit as st
-from openpyxl import load_workbook
-import pandas as pd
-import gc
 
 # El motor de automatización es ahora la única fuente de verdad para la lógica de negocio
 from scripts.motor_automatizacion import (
-    load_project_ranges,
-    load_project_formats,
-    discover_and_load_blocks,
-    ejecutar_generacion_completa, # <- Nueva función endurecida
     ORDER, # <- Constante de orden
 )
+# Capa de caché de Streamlit: un motor por proceso (configuración, análisis y pool)
+from scripts.cache_streamlit import (
+    obtener_configuracion,
+    obtener_motor,
+)
+from scripts.ingesta import LibroSubido
+from scripts.componentes_streamlit import (
+    boton_descarga,
+    descartar_pregeneracion,
+    descartar_salida,
+    firma_generacion,
+    lanzar_generacion,
+    panel_generacion,
+    pregenerar,
+    vista_previa_secciones,
+)
 
-# Cargar config de rangos y formatos una vez
-RANGOS_ESTATICOS = load_project_ranges()
-FORMATOS = load_project_formats()
+# Formatos y plantilla compilados una vez por proceso; si cambian en disco se
+# recargan en segundo plano y la siguiente ejecución del script ya los recibe
+CONFIG = obtener_configuracion()
 
 # ===================== GESTIÓN DE ESTADO ===================== #
 
 # Inicializar variables en el estado de la sesión si no existen
+# 'buf_final' guarda el manejador del documento generado, no sus bytes
+# (ver scripts/almacen_sesiones.py)
 if 'buf_final' not in st.session_state:
     st.session_state.buf_final = None
 if 'file_name' not in st.session_state:
     st.session_state.file_name = None
-# ATENCIÓN: Se reemplaza 'workbook' por 'temp_file_path' para evitar guardar objetos grandes en sesión.
-if 'temp_file_path' not in st.session_state:
-    st.session_state.temp_file_path = None
+# ATENCIÓN: Se guarda el libro subido ('libro'), nunca el Workbook de openpyxl, para evitar objetos grandes en sesión.
+if 'libro' not in st.session_state:
+    st.session_state.libro = None
 if 'rangos_dinamicos' not in st.session_state:
     st.session_state.rangos_dinamicos = None
+# Trabajo de generación en segundo plano y último error/cancelación
+if 'trabajo' not in st.session_state:
+    st.session_state.trabajo = None
+if 'error_generacion' not in st.session_state:
+    st.session_state.error_generacion = None
+if 'trabajo_especulativo' not in st.session_state:
+    st.session_state.trabajo_especulativo = None
 if 'excel_sheet_order' not in st.session_state:
     st.session_state.excel_sheet_order = None
 
@@ -45,30 +62,19 @@ uploaded_file = st.file_uploader(
 
 # 2. Procesamiento del archivo (Fase de Análisis para Previsualización)
 # Se activa si se sube un nuevo archivo.
-if uploaded_file is not None and st.session_state.temp_file_path is None:
+if uploaded_file is not None and st.session_state.libro is None:
     with st.spinner("Analizando archivo Excel..."):
-        # Guardar en archivo temporal y almacenar su RUTA en la sesión
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp:
-            tmp.write(uploaded_file.getvalue())
-            st.session_state.temp_file_path = tmp.name
+        # Los bytes subidos se leen directamente desde memoria; solo los
+        # archivos muy grandes se vuelcan a un temporal (ver scripts/ingesta.py)
+        st.session_state.libro = LibroSubido(uploaded_file.getvalue(), uploaded_file.name)
         
         st.session_state.file_name = uploaded_file.name
         
-        # Comentario: Gestión de memoria para el análisis.
-        # El workbook se carga en una variable local y se libera explícitamente
-        # después de extraer los datos necesarios para la previsualización.
-        wb = None
-        try:
-            wb = load_workbook(st.session_state.temp_file_path, data_only=True)
-            st.session_state.rangos_dinamicos = discover_and_load_blocks(
-                wb, RANGOS_ESTATICOS, FORMATOS
-            )
-            st.session_state.excel_sheet_order = wb.sheetnames # <- Added this line
-        finally:
-            # Paso clave: Liberar el objeto pesado de la memoria
-            if wb:
-                del wb
-                gc.collect()
+        # Comentario: El análisis se cachea por hash del archivo subido; el
+        # workbook solo vive dentro de MotorDictamen.descubrir y nunca llega a la sesión.
+        st.session_state.rangos_dinamicos, st.session_state.excel_sheet_order = obtener_motor().descubrir(
+            st.session_state.libro, config=CONFIG
+        )
 
         st.session_state.buf_final = None  # Limpiar buffer en cada nueva carga
         st.success(f"Archivo '{st.session_state.file_name}' cargado y analizado.")
@@ -80,7 +86,7 @@ st.title("Generador de Dictamen UNC (Refactorizado)")
 
 # Definir la lista de hojas disponibles una vez que se ha cargado el archivo
 hojas_disponibles = []
-if st.session_state.temp_file_path and st.session_state.rangos_dinamicos and st.session_state.excel_sheet_order:
+if st.session_state.libro and st.session_state.rangos_dinamicos and st.session_state.excel_sheet_order:
     detected_sheets_names = st.session_state.rangos_dinamicos.keys()
     hojas_disponibles = [
         sheet_name for sheet_name in st.session_state.excel_sheet_order
@@ -91,42 +97,76 @@ if st.session_state.temp_file_path and st.session_state.rangos_dinamicos and st.
 col1, col2 = st.columns([1, 2])
 
 # --- COLUMNA IZQUIERDA: CONTROLES ---
-with col1:
-    # Controles de acción se muestran si el análisis inicial ya se realizó
-    if st.session_state.temp_file_path:
-        st.header("2. Generar y Descargar")
-
-        if st.button("Generar DOCX final", type="primary", help="Crea el documento Word con el dictamen completo.", key="generate_button"):
-            if not hojas_disponibles:
-                st.error("No hay hojas procesables para generar el documento.")
-            else:
-                with st.spinner("Generando documento final... Por favor espera."):
-                    # Pasar la lista de hojas en el orden correcto a la función de generación
-                    st.session_state.buf_final = ejecutar_generacion_completa(
-                        workbook_path=st.session_state.temp_file_path,
-                        rangos_dinamicos=st.session_state.rangos_dinamicos,
-                        formatos=FORMATOS,
-                        orden_hojas=hojas_disponibles
-                    )
-                st.success("¡Documento generado con éxito!")
-
-        if st.session_state.buf_final:
-            st.download_button(
-                label="Descargar DICTAMEN_FINAL.docx",
-                data=st.session_state.buf_final,
-                file_name="DICTAMEN_FINAL.docx",
-                mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-                help="Haz clic para descargar el documento Word generado.",
-                key="download_button"
-            )
+@st.fragment
+def controles_generacion(hojas_disponibles):
+    """
+    Controles de generación y descarga. Es un fragmento: sus widgets solo
+    vuelven a ejecutar esta función, no la previsualización.
+    """
+    st.header("2. Generar y Descargar")
+
+    firma = firma_generacion(st.session_state.libro.hash, hojas_disponibles)
+    parametros_generacion = dict(
+        workbook_path=st.session_state.libro,
+        rangos_dinamicos=st.session_state.rangos_dinamicos,
+        orden_hojas=hojas_disponibles,
+        # Versiones sucesivas del mismo archivo solo regeneran las hojas modificadas
+        id_incremental=st.session_state.file_name,
+        config=CONFIG,
+    )
+
+    # Comentario: en modo especulativo la generación empieza en cuanto termina
+    # el análisis; si cambia el libro o el orden, ese trabajo se descarta.
+    if st.toggle("Pregenerar en segundo plano", key="pregenerar", help="Empieza a generar el dictamen en cuanto se analiza el archivo."):
+        if (
+            hojas_disponibles
+            and st.session_state.trabajo is None
+            and st.session_state.buf_final is None
+            and not st.session_state.error_generacion
+            and obtener_motor().hay_trabajador_libre()
+        ):
+            pregenerar(obtener_motor().generar_final, firma, en_cola=True, **parametros_generacion)
+    else:
+        descartar_pregeneracion()
+
+    generando = st.session_state.trabajo is not None
+    if st.button("Generar DOCX final", type="primary", help="Crea el documento Word con el dictamen completo.", key="generate_button", disabled=generando):
+        if not hojas_disponibles:
+            st.error("No hay hojas procesables para generar el documento.")
         else:
-            st.info("Genera el dictamen para habilitar la descarga.")
+            # Comentario: la generación corre en un hilo propio; la sesión no
+            # se bloquea y la previsualización sigue disponible mientras tanto.
+            lanzar_generacion(obtener_motor().generar_final, firma, en_cola=True, **parametros_generacion)
+            st.session_state.buf_final = None
+            st.session_state.error_generacion = None
+            generando = True
+
+    if generando:
+        panel_generacion()
+    elif st.session_state.error_generacion:
+        st.warning(st.session_state.error_generacion)
+
+    # Desde el almacén de sesiones (memoria o disco, ver `boton_descarga`)
+    boton_descarga()
+
+    st.markdown("---")
+    if st.button("Empezar de Nuevo", help="Limpia la aplicación para procesar un nuevo archivo.", key="reset_button"):
+        # Borrar el temporal (si lo hubo) antes de olvidar el libro
+        if st.session_state.trabajo is not None:
+            st.session_state.trabajo.cancelar()
+        descartar_pregeneracion()
+        descartar_salida()
+        if st.session_state.libro is not None:
+            st.session_state.libro.liberar()
+        for key in list(st.session_state.keys()):
+            del st.session_state[key]
+        st.rerun()
+
 
-        st.markdown("---")
-        if st.button("Empezar de Nuevo", help="Limpia la aplicación para procesar un nuevo archivo.", key="reset_button"):
-            for key in list(st.session_state.keys()):
-                del st.session_state[key]
-            st.rerun()
+with col1:
+    # Controles de acción se muestran si el análisis inicial ya se realizó
+    if st.session_state.libro:
+        controles_generacion(hojas_disponibles)
     else:
         st.info("Sube un archivo para activar los controles.")
 
@@ -134,36 +174,13 @@ with col1:
 with col2:
     st.header("Detalle y Previsualización")
 
-    if not st.session_state.temp_file_path:
+    if not st.session_state.libro:
         st.info("Sube un archivo Excel para comenzar el análisis y la previsualización.")
 
     elif hojas_disponibles:
         with st.expander("Ver Previsualización de Secciones", expanded=True):
-            hoja_sel = st.selectbox(
-                "Selecciona una sección/hoja para previsualizar:",
-                hojas_disponibles,
-                help="Permite ver el contenido detectado en cada sección."
-            )
-
-            if hoja_sel:
-                bloques = st.session_state.rangos_dinamicos.get(hoja_sel, [])
-                if not bloques:
-                    st.warning("No se encontraron bloques de contenido para esta sección.")
-                else:
-                    st.subheader(f"Contenido de '{hoja_sel}'")
-                    for i, bloque in enumerate(bloques, 1):
-                        st.markdown(f"**Bloque {i}:** Tipo=`{bloque['tipo']}`")
-                        if isinstance(bloque.get('contenido'), pd.DataFrame):
-                            st.table(bloque['contenido'])
-                        else:
-                            st.text_area(
-                                f"Contenido del Bloque {i}",
-                                value=str(bloque.get('contenido', '')),
-                                height=100,
-                                disabled=True,
-                            )
-            else:
-                st.info("Selecciona una hoja para ver su previsualización.")
-                
-    elif st.session_state.temp_file_path:
+            # Fragmento: cambiar de hoja solo vuelve a dibujar la previsualización
+            vista_previa_secciones(hojas_disponibles, st.session_state.rangos_dinamicos)
+
+    elif st.session_state.libro:
         st.warning("El archivo fue cargado, pero no se encontraron secciones o bloques de contenido con los criterios actuales.")
@@ -12,11 +12,47 @@ from tkinter import filedialog, messagebox, ttk
 # --- IMPORTS DEL MOTOR DE AUTOMATIZACIÓN ---
 # El motor es ahora la fuente de verdad para la lógica y las rutas.
 from scripts.motor_automatizacion import (
+    MotorDictamen,
     load_project_ranges,
-    load_project_formats,
-    discover_and_load_blocks,
-    PLANTILLA_PATH,
 )
+from scripts.carga_diferida import es_dataframe
+from scripts.registro_configuracion import Instantanea
+from scripts.trabajos import CANCELADO, COMPLETADO, TrabajoGeneracion
+
+# Cada cuánto consulta la UI el avance del trabajo en segundo plano (ms)
+INTERVALO_SONDEO_MS = 100
+
+
+def _cargar_y_analizar(
+    motor: MotorDictamen, excel_path: Path, rangos_manuales: dict, config: Instantanea, progreso
+):
+    """Carga el libro y detecta sus bloques. Se ejecuta fuera del hilo de la UI."""
+    from scripts.core_secciones import cargar_workbook
+
+    # El libro se carga siempre (la UI lo necesita); el análisis sale de la
+    # caché del motor si este mismo archivo ya se analizó
+    wb = cargar_workbook(excel_path)
+    rangos, _ = motor.descubrir(excel_path, rangos_manuales, wb=wb, progreso=progreso, config=config)
+    return wb, rangos
+
+
+def _generar_seccion(motor: MotorDictamen, hoja: str, progreso, config: Instantanea, **kwargs) -> None:
+    """Genera el DOCX de una sola hoja. Se ejecuta fuera del hilo de la UI."""
+    progreso(0, 1, hoja)
+    motor.generar_seccion(hoja=hoja, config=config, **kwargs)
+
+
+def _generar_dictamen(
+    motor: MotorDictamen, progreso, config: Instantanea, excel_path: Path, wb, rangos: dict, orden: list, destino: Path
+) -> None:
+    """Genera el dictamen completo. Se ejecuta fuera del hilo de la UI."""
+    # Sin caché de salidas: los bloques pueden haberse editado a mano y la
+    # clave de la caché solo depende del libro y la configuración
+    buffer = motor.generar_final(
+        excel_path, rangos, orden_hojas=orden, usar_cache=False, wb=wb, config=config, progreso=progreso
+    )
+    destino.parent.mkdir(parents=True, exist_ok=True)
+    destino.write_bytes(buffer.getvalue())
 
 
 class DictamenDesktopApp:
@@ -24,6 +60,11 @@ class DictamenDesktopApp:
     App de escritorio para generar dictámenes.
     La carga de dependencias pesadas y archivos se hace de forma diferida
     para garantizar que la UI se inicie siempre.
+
+    La carga del Excel y la generación de DOCX se ejecutan en un hilo en
+    segundo plano (`TrabajoGeneracion`); la UI consulta su avance con
+    `root.after` y aplica el resultado en su propio hilo, así que la ventana
+    nunca se queda bloqueada esperando al motor.
     """
 
     def __init__(self, root: tk.Tk) -> None:
@@ -32,7 +73,6 @@ class DictamenDesktopApp:
         self.root.geometry("1200x700")
 
         # --- Dependencias que se cargarán bajo demanda ---
-        self.pd = None
         self.Workbook = None
         self.core_secciones = None  # Se mantiene por ahora para funciones de generación
         self.extractor_inteligente = None # Será eliminado eventualmente
@@ -59,6 +99,11 @@ class DictamenDesktopApp:
         self.workbook = None
         self.hojas_disponibles: list[str] = []
         self.orden_hojas: list[str] = []
+        self.trabajo: TrabajoGeneracion | None = None
+        self._descripcion_trabajo = ""
+        # Sin pool de procesos: cada operación se ejecuta en el hilo del trabajo
+        self.motor = MotorDictamen()
+        self._al_completar_trabajo = None
 
         # --- Carga de configuraciones iniciales (usando el motor) ---
         self._load_initial_configs()
@@ -70,7 +115,9 @@ class DictamenDesktopApp:
         """Carga las configuraciones JSON de forma segura usando el motor."""
         try:
             self.rangos_estaticos = {} # Ya no se carga rangos_hojas.json
-            self.formatos = load_project_formats()
+            # Formatos y plantilla vigentes; si se editan se recargan sin
+            # reiniciar la app (ver scripts/registro_configuracion.py)
+            self.formatos = self.motor.configuracion().formatos
         except Exception as e:
             self.formatos = None
             messagebox.showerror("Error de Configuración", f"No se pudieron cargar los archivos de configuración: {e}")
@@ -91,19 +138,16 @@ class DictamenDesktopApp:
         self.tipos_disponibles = sorted(default_tipos | tipos_from_cfg | tipos_from_rangos_estaticos)
 
 
-    def _discover_and_load_blocks(self) -> dict:
-        """
-        Llama al motor central para analizar las hojas del libro de Excel y cargar
-        los bloques de contenido.
-        """
-        if not self.workbook:
-            return {}
-        
-        # Llama a la función centralizada desde el motor
-        return discover_and_load_blocks(
-            self.workbook, self.rangos_estaticos, self.formatos
-        )
-        
+    def _configuracion_vigente(self) -> Instantanea | None:
+        """Configuración vigente (recargada si se editó el JSON); actualiza `self.formatos`."""
+        try:
+            config = self.motor.configuracion()
+        except Exception as e:
+            messagebox.showerror("Error de Configuración", f"No se pudieron cargar los archivos de configuración: {e}")
+            return None
+        self.formatos = config.formatos
+        return config
+
     def _build_ui(self) -> None:
         # ... (El código de construcción de UI se mantiene, referenciando self.métodos) ...
         self._build_menu()
@@ -182,17 +226,24 @@ class DictamenDesktopApp:
 
         actions_frame = ttk.Frame(right_frame)
         actions_frame.pack(fill=tk.X, pady=5)
+        ttk.Button(actions_frame, text="Vista previa HTML", command=self._preview_section_html).pack(side=tk.LEFT, padx=5)
         ttk.Button(actions_frame, text="Generar DOCX de esta sección", command=self._generate_section_docx).pack(side=tk.LEFT, padx=5)
         ttk.Button(actions_frame, text="Generar dictamen completo", command=self._generate_full_docx).pack(side=tk.LEFT, padx=5)
         ttk.Button(actions_frame, text="Guardar rangos en JSON", command=self._save_rangos_to_file).pack(side=tk.LEFT, padx=5)
 
-        status_bar = ttk.Label(self.root, textvariable=self.status_var, relief=tk.SUNKEN, anchor="w", padding=5)
-        status_bar.pack(side=tk.BOTTOM, fill=tk.X)
+        status_frame = ttk.Frame(self.root)
+        status_frame.pack(side=tk.BOTTOM, fill=tk.X)
+        status_bar = ttk.Label(status_frame, textvariable=self.status_var, relief=tk.SUNKEN, anchor="w", padding=5)
+        status_bar.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.cancel_button = ttk.Button(status_frame, text="Cancelar", command=self._cancel_job, state=tk.DISABLED)
+        self.cancel_button.pack(side=tk.RIGHT, padx=5)
+        self.progress_bar = ttk.Progressbar(status_frame, length=200, maximum=100)
+        self.progress_bar.pack(side=tk.RIGHT, padx=5)
         self._set_status("Listo. Carga un Excel para comenzar.")
 
     def _build_menu(self) -> None:
         menubar = tk.Menu(self.root)
-        menu_archivo = tk.Menu(menubar, tearoff=0)
+        menu_archivo = self.menu_archivo = tk.Menu(menubar, tearoff=0)
         menu_archivo.add_command(label="Abrir Excel...", command=self._browse_excel)
         menu_archivo.add_command(label="Cargar Excel", command=self._load_excel)
         menu_archivo.add_separator()
@@ -208,6 +259,75 @@ class DictamenDesktopApp:
     def _set_status(self, text: str) -> None:
         self.status_var.set(text)
 
+    # ----- trabajos en segundo plano -----
+
+    def _job_controls(self, widget=None) -> list:
+        """Botones que se desactivan mientras hay un trabajo en curso."""
+        widget = widget or self.root
+        controles = []
+        for hijo in widget.winfo_children():
+            if isinstance(hijo, ttk.Button) and hijo is not self.cancel_button:
+                controles.append(hijo)
+            controles.extend(self._job_controls(hijo))
+        return controles
+
+    def _set_controls_enabled(self, enabled: bool) -> None:
+        estado = tk.NORMAL if enabled else tk.DISABLED
+        for boton in self._job_controls():
+            boton.configure(state=estado)
+        for etiqueta in ("Abrir Excel...", "Cargar Excel", "Guardar rangos"):
+            self.menu_archivo.entryconfigure(etiqueta, state=estado)
+        self.cancel_button.configure(state=tk.DISABLED if enabled else tk.NORMAL)
+
+    def _start_job(self, objetivo, descripcion: str, al_completar, **kwargs) -> None:
+        """
+        Lanza `objetivo(**kwargs, progreso=...)` en segundo plano. Al terminar
+        con éxito se llama a `al_completar(resultado)` desde el hilo de la UI.
+        """
+        if self.trabajo is not None and not self.trabajo.terminado:
+            return
+        self._descripcion_trabajo = descripcion
+        self._al_completar_trabajo = al_completar
+        self.trabajo = TrabajoGeneracion(objetivo, **kwargs).iniciar()
+        self._set_controls_enabled(False)
+        self.progress_bar.configure(mode="indeterminate", value=0)
+        self._set_status(f"{descripcion}...")
+        self.root.after(INTERVALO_SONDEO_MS, self._poll_job)
+
+    def _poll_job(self) -> None:
+        trabajo = self.trabajo
+        if trabajo is None:
+            return
+        if not trabajo.terminado:
+            if trabajo.total and not trabajo.cancelacion_pedida:
+                self.progress_bar.configure(mode="determinate", value=trabajo.fraccion * 100)
+                detalle = f": {trabajo.hoja_actual}" if trabajo.hoja_actual else ""
+                self._set_status(
+                    f"{self._descripcion_trabajo} ({trabajo.completadas}/{trabajo.total}){detalle}"
+                )
+            elif not trabajo.total:
+                # Sin total todavía (p. ej. leyendo el libro): barra de actividad
+                self.progress_bar.step(4)
+            self.root.after(INTERVALO_SONDEO_MS, self._poll_job)
+            return
+
+        self.trabajo = None
+        self._set_controls_enabled(True)
+        self.progress_bar.configure(mode="determinate", value=100 if trabajo.estado == COMPLETADO else 0)
+        if trabajo.estado == COMPLETADO:
+            self._al_completar_trabajo(trabajo.resultado)
+        elif trabajo.estado == CANCELADO:
+            self._set_status(f"{self._descripcion_trabajo}: cancelado.")
+        else:
+            messagebox.showerror(f"Error: {self._descripcion_trabajo}", str(trabajo.error))
+            self._set_status(f"{self._descripcion_trabajo}: error.")
+
+    def _cancel_job(self) -> None:
+        if self.trabajo is not None and not self.trabajo.terminado:
+            self.trabajo.cancelar()
+            self.cancel_button.configure(state=tk.DISABLED)
+            self._set_status("Cancelando (termina la hoja en curso)...")
+
     def _browse_excel(self) -> None:
         path = filedialog.askopenfilename(title="Selecciona el archivo Excel", filetypes=[("Archivos Excel", "*.xlsx *.xlsm"), ("Todos los archivos", "*.*")])
         if path:
@@ -219,25 +339,31 @@ class DictamenDesktopApp:
         if not path_str:
             messagebox.showwarning("Atención", "Selecciona primero un archivo de Excel.")
             return
+        config = self._configuracion_vigente()
+        if config is None:
+            return
         
-        try:
-            # --- Importación diferida ---
-            from core_secciones import cargar_workbook
-            self.workbook = cargar_workbook(Path(path_str))
-            
-            self.rangos = self._discover_and_load_blocks()
-            
-            self.hojas_disponibles = list(self.workbook.sheetnames)
-            self.orden_hojas = [s for s in self.hojas_disponibles if s in self.rangos]
-            
-            self._populate_tree()
-            if self.orden_hojas:
-                self._select_sheet_in_tree(self.orden_hojas[0])
-            self._set_status("Excel cargado y analizado correctamente.")
-            messagebox.showinfo("Éxito", "Excel cargado y analizado correctamente.")
-        except Exception as e:
-            messagebox.showerror("Error al cargar Excel", str(e))
-            self._set_status("Error al cargar Excel.")
+        self._start_job(
+            _cargar_y_analizar,
+            "Cargando Excel",
+            self._on_excel_loaded,
+            excel_path=Path(path_str),
+            rangos_manuales=self.rangos_estaticos,
+            motor=self.motor,
+            config=config,
+        )
+
+    def _on_excel_loaded(self, resultado) -> None:
+        self.workbook, self.rangos = resultado
+
+        self.hojas_disponibles = list(self.workbook.sheetnames)
+        self.orden_hojas = [s for s in self.hojas_disponibles if s in self.rangos]
+
+        self._populate_tree()
+        if self.orden_hojas:
+            self._select_sheet_in_tree(self.orden_hojas[0])
+        self._set_status("Excel cargado y analizado correctamente.")
+        messagebox.showinfo("Éxito", "Excel cargado y analizado correctamente.")
 
     def _move_sheet_up(self) -> None:
         selection = self.tree_hojas.selection()
@@ -291,16 +417,12 @@ class DictamenDesktopApp:
         self._populate_blocks_for_sheet(hoja)
 
     def _populate_blocks_for_sheet(self, hoja: str) -> None:
-        if self.pd is None:
-            import pandas as pd
-            self.pd = pd
-
         self.tree_bloques.delete(*self.tree_bloques.get_children())
         bloques = self.rangos.get(hoja, [])
         if not isinstance(bloques, list): return
         for idx, bloque in enumerate(bloques):
             rango_display = bloque.get("rango")
-            if rango_display is None and isinstance(bloque.get("contenido"), self.pd.DataFrame):
+            if rango_display is None and es_dataframe(bloque.get("contenido")):
                 df = bloque.get("contenido")
                 rango_display = f"Tabla ({len(df)} filas)"
             elif rango_display is None:
@@ -412,6 +534,32 @@ class DictamenDesktopApp:
         if hoja in self.tree_hojas.get_children():
             self.tree_hojas.item(hoja, values=(hoja, resumen))
 
+    def _preview_section_html(self) -> None:
+        """Abre en el navegador la sección seleccionada como HTML (sin generar el DOCX)."""
+        selection = self.tree_hojas.selection()
+        if not selection:
+            messagebox.showwarning("Atención", "Selecciona primero una hoja.")
+            return
+
+        # --- Importación diferida ---
+        import tempfile
+        import webbrowser
+        from scripts.vista_html import pagina_html
+
+        hoja = selection[0]
+        bloques = self.rangos.get(hoja, [])
+        try:
+            seccion = self.motor.vista_previa(bloques, wb=self.workbook, sheet_name=hoja)
+            with tempfile.NamedTemporaryFile(
+                "w", encoding="utf-8", suffix=".html", prefix="vista_", delete=False
+            ) as tmp:
+                tmp.write(pagina_html(seccion, hoja))
+            webbrowser.open(Path(tmp.name).as_uri())
+            self._set_status(f"Vista previa de '{hoja}' abierta en el navegador.")
+        except Exception as e:
+            messagebox.showerror("Error en la vista previa", str(e))
+            self._set_status("Error al generar la vista previa HTML.")
+
     def _generate_section_docx(self) -> None:
         if self.workbook is None:
             messagebox.showwarning("Atención", "Carga primero un archivo de Excel.")
@@ -421,39 +569,53 @@ class DictamenDesktopApp:
             messagebox.showwarning("Atención", "Selecciona primero una hoja.")
             return
         
-        # --- Importación diferida ---
-        from core_secciones import generar_docx_seccion_a_archivo
-        
         hoja = selection[0]
-        bloques = self.rangos.get(hoja, [])
+        bloques = list(self.rangos.get(hoja, []))
         save_path = filedialog.asksaveasfilename(title="Guardar sección como DOCX",defaultextension=".docx", initialfile=f"{hoja}.docx", filetypes=[("Documento Word", "*.docx")])
         if not save_path: return
-        try:
-            generar_docx_seccion_a_archivo(wb=self.workbook, sheet_name=hoja, bloques=bloques, plantilla_path=PLANTILLA_PATH, destino=Path(save_path), formatos=self.formatos)
-            messagebox.showinfo("Éxito", f"Sección guardada en:\n{save_path}")
+
+        def al_completar(_resultado) -> None:
             self._set_status(f"Sección '{hoja}' generada correctamente.")
-        except Exception as e:
-            messagebox.showerror("Error al generar sección", str(e))
-            self._set_status("Error al generar sección DOCX.")
+            messagebox.showinfo("Éxito", f"Sección guardada en:\n{save_path}")
+
+        self._start_job(
+            _generar_seccion,
+            f"Generando sección '{hoja}'",
+            al_completar,
+            wb=self.workbook,
+            hoja=hoja,
+            bloques=bloques,
+            destino=Path(save_path),
+            motor=self.motor,
+            config=self.motor.configuracion(),
+        )
 
     def _generate_full_docx(self) -> None:
         if self.workbook is None:
             messagebox.showwarning("Atención", "Carga primero un archivo de Excel.")
             return
 
-        # --- Importación diferida ---
-        from core_secciones import generar_docx_final_a_archivo
-
         save_path = filedialog.asksaveasfilename(title="Guardar dictamen completo como DOCX",defaultextension=".docx", initialfile="DICTAMEN_FINAL.docx", filetypes=[("Documento Word", "*.docx")])
         if not save_path: return
         orden_efectivo = [h for h in self.orden_hojas if h in self.rangos]
-        try:
-            generar_docx_final_a_archivo(wb=self.workbook, rangos=self.rangos, plantilla_path=PLANTILLA_PATH, destino=Path(save_path), orden=orden_efectivo, formatos=self.formatos)
-            messagebox.showinfo("Éxito", f"Dictamen completo guardado en:\n{save_path}")
+
+        def al_completar(_resultado) -> None:
             self._set_status("Dictamen completo generado correctamente.")
-        except Exception as e:
-            messagebox.showerror("Error al generar dictamen completo", str(e))
-            self._set_status("Error al generar dictamen completo.")
+            messagebox.showinfo("Éxito", f"Dictamen completo guardado en:\n{save_path}")
+
+        # Copias: el trabajo no debe ver ediciones de bloques hechas mientras corre
+        self._start_job(
+            _generar_dictamen,
+            "Generando dictamen completo",
+            al_completar,
+            wb=self.workbook,
+            rangos={h: list(b) for h, b in self.rangos.items()},
+            destino=Path(save_path),
+            orden=orden_efectivo,
+            excel_path=Path(self.excel_path_var.get().strip()),
+            motor=self.motor,
+            config=self.motor.configuracion(),
+        )
 
     def _save_rangos_to_file(self) -> None:
         # Filtrar solo bloques manuales para guardar
@@ -483,6 +645,7 @@ def main() -> None:
     print("DEBUG: Clase DictamenDesktopApp instanciada")
     root.mainloop()
     print("DEBUG: root.mainloop() finalizado.")
+    app.motor.cerrar()
 
 if __name__ == "__main__":
     print("DEBUG: El script se está ejecutando como principal (__name__ == '__main__')")
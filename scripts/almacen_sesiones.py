@@ -0,0 +1,225 @@
+from __future__ import annotations
+
+"""
+Almacén de artefactos por sesión (p. ej. el DOCX generado) con un presupuesto
+de memoria global para todo el proceso.
+
+Guardar el documento de cada sesión en `st.session_state` como BytesIO hace
+que la memoria residente crezca con el número de usuarios. Con este almacén:
+
+- Los artefactos usados más recientemente se quedan en memoria mientras el
+  total no supere `presupuesto_bytes`; los más antiguos se vuelcan a disco
+  (escritura atómica) y se sirven desde el archivo.
+- Las sesiones sin actividad durante `inactividad_max_s` se purgan: sus
+  artefactos se eliminan de memoria y de disco.
+
+La sesión solo guarda el `ArtefactoSesion` (un manejador pequeño). Este
+módulo no depende de Streamlit.
+"""
+
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import BinaryIO, Dict, Tuple, Union
+
+# Cada cuánto (segundos) se buscan sesiones inactivas como mucho
+_INTERVALO_PURGA = 60.0
+
+
+def _eliminar_archivo(ruta: Path | None) -> None:
+    if ruta is None:
+        return
+    try:
+        ruta.unlink()
+    except FileNotFoundError:
+        pass
+
+
+class ArtefactoSesion:
+    """
+    Manejador de un artefacto guardado en el almacén.
+
+    Sus bytes pueden estar en memoria o en disco; `abrir()` y `leer()`
+    funcionan igual en ambos casos. Si el almacén lo purgó (sesión inactiva),
+    `disponible` pasa a ser False.
+    """
+
+    def __init__(self, almacen: "AlmacenSesiones", sesion_id: str, nombre: str, datos: bytes) -> None:
+        self._almacen = almacen
+        self.sesion_id = sesion_id
+        self.nombre = nombre
+        self.tamano = len(datos)
+        self._datos: bytes | None = datos
+        self._ruta: Path | None = None
+        self._eliminado = False
+
+    @property
+    def disponible(self) -> bool:
+        return not self._eliminado
+
+    @property
+    def en_disco(self) -> bool:
+        return self._ruta is not None
+
+    def abrir(self) -> BinaryIO:
+        """Archivo binario con el contenido (BytesIO o el archivo volcado)."""
+        with self._almacen._lock:
+            if self._eliminado:
+                raise FileNotFoundError(f"El artefacto '{self.nombre}' ya no está disponible.")
+            self._almacen._usar(self)
+            if self._datos is not None:
+                return io.BytesIO(self._datos)
+            return open(self._ruta, "rb")
+
+    def leer(self) -> bytes:
+        """Contenido completo. Si está en memoria, devuelve los mismos bytes, sin copiarlos."""
+        with self._almacen._lock:
+            datos = self._datos
+            if datos is not None and not self._eliminado:
+                self._almacen._usar(self)
+                return datos
+        with self.abrir() as f:
+            return f.read()
+
+
+class AlmacenSesiones:
+    """Artefactos de todas las sesiones del proceso, con LRU global en memoria."""
+
+    def __init__(
+        self,
+        directorio: Union[str, Path],
+        presupuesto_bytes: int,
+        inactividad_max_s: float,
+    ) -> None:
+        self.directorio = Path(directorio)
+        self.presupuesto_bytes = presupuesto_bytes
+        self.inactividad_max_s = inactividad_max_s
+        self._lock = threading.RLock()
+        # Orden de uso: el primero es el que lleva más tiempo sin usarse
+        self._artefactos: "OrderedDict[Tuple[str, str], ArtefactoSesion]" = OrderedDict()
+        self._ultimo_uso: Dict[str, float] = {}
+        self._en_memoria = 0
+        self._ultima_purga = 0.0
+        self._limpiar_volcados_huerfanos()
+
+    # ----- API pública -----
+
+    def guardar(self, sesion_id: str, nombre: str, datos: bytes) -> ArtefactoSesion:
+        """Guarda (o sustituye) el artefacto `nombre` de la sesión y aplica el presupuesto."""
+        with self._lock:
+            self._eliminar((sesion_id, nombre))
+            artefacto = ArtefactoSesion(self, sesion_id, nombre, bytes(datos))
+            self._artefactos[(sesion_id, nombre)] = artefacto
+            self._en_memoria += artefacto.tamano
+            self._ultimo_uso[sesion_id] = time.monotonic()
+            self._ajustar_presupuesto()
+        self.purgar_inactivas()
+        return artefacto
+
+    def tocar(self, sesion_id: str) -> None:
+        """Marca actividad de la sesión (para que no se considere inactiva)."""
+        with self._lock:
+            if any(s == sesion_id for s, _ in self._artefactos):
+                self._ultimo_uso[sesion_id] = time.monotonic()
+        self.purgar_inactivas()
+
+    def eliminar_sesion(self, sesion_id: str) -> None:
+        """Borra todos los artefactos de una sesión (p. ej. "Empezar de Nuevo")."""
+        with self._lock:
+            for clave in [c for c in self._artefactos if c[0] == sesion_id]:
+                self._eliminar(clave)
+            self._ultimo_uso.pop(sesion_id, None)
+
+    def purgar_inactivas(self, forzar: bool = False) -> None:
+        """Elimina los artefactos de las sesiones inactivas (como mucho una vez por minuto)."""
+        ahora = time.monotonic()
+        with self._lock:
+            if not forzar and ahora - self._ultima_purga < _INTERVALO_PURGA:
+                return
+            self._ultima_purga = ahora
+            limite = ahora - self.inactividad_max_s
+            for sesion_id in [s for s, t in self._ultimo_uso.items() if t < limite]:
+                self.eliminar_sesion(sesion_id)
+
+    def estadisticas(self) -> Dict[str, int]:
+        with self._lock:
+            en_disco = [a for a in self._artefactos.values() if a.en_disco]
+            return {
+                "sesiones": len(self._ultimo_uso),
+                "artefactos": len(self._artefactos),
+                "bytes_en_memoria": self._en_memoria,
+                "artefactos_en_disco": len(en_disco),
+                "bytes_en_disco": sum(a.tamano for a in en_disco),
+            }
+
+    # ----- internos (con el lock tomado) -----
+
+    def _usar(self, artefacto: ArtefactoSesion) -> None:
+        self._artefactos.move_to_end((artefacto.sesion_id, artefacto.nombre))
+        self._ultimo_uso[artefacto.sesion_id] = time.monotonic()
+        if artefacto._ruta is not None:
+            # El mtime de un volcado marca su último uso (ver _limpiar_volcados_huerfanos)
+            try:
+                os.utime(artefacto._ruta)
+            except OSError:
+                pass
+
+    def _ajustar_presupuesto(self) -> None:
+        for artefacto in list(self._artefactos.values()):
+            if self._en_memoria <= self.presupuesto_bytes:
+                break
+            if artefacto._datos is not None:
+                self._volcar(artefacto)
+
+    def _volcar(self, artefacto: ArtefactoSesion) -> None:
+        self.directorio.mkdir(parents=True, exist_ok=True)
+        prefijo = hashlib.sha256(artefacto.sesion_id.encode("utf-8")).hexdigest()[:16]
+        destino = self.directorio / f"{prefijo}-{uuid.uuid4().hex}.bin"
+        fd, tmp_name = tempfile.mkstemp(dir=self.directorio, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                tmp.write(artefacto._datos)
+            os.replace(tmp_name, destino)
+        except BaseException:
+            _eliminar_archivo(Path(tmp_name))
+            raise
+        artefacto._ruta = destino
+        artefacto._datos = None
+        self._en_memoria -= artefacto.tamano
+
+    def _eliminar(self, clave: Tuple[str, str]) -> None:
+        artefacto = self._artefactos.pop(clave, None)
+        if artefacto is None:
+            return
+        if artefacto._datos is not None:
+            self._en_memoria -= artefacto.tamano
+        artefacto._datos = None
+        # Un archivo abierto en `abrir()` sigue siendo legible en POSIX; en
+        # Windows el borrado puede fallar y el archivo queda para la limpieza inicial.
+        try:
+            _eliminar_archivo(artefacto._ruta)
+        except OSError:
+            pass
+        artefacto._eliminado = True
+
+    def _limpiar_volcados_huerfanos(self) -> None:
+        """
+        Borra los volcados sin uso desde hace más de `inactividad_max_s`: los
+        dejó un proceso anterior o ya estarían purgados. Los de otros procesos
+        vivos que compartan el directorio se respetan.
+        """
+        if not self.directorio.is_dir():
+            return
+        limite = time.time() - self.inactividad_max_s
+        for ruta in self.directorio.glob("*.bin"):
+            try:
+                if ruta.stat().st_mtime < limite:
+                    ruta.unlink()
+            except OSError:
+                pass
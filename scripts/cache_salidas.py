@@ -0,0 +1,247 @@
+from __future__ import annotations
+
+"""
+Caché en disco de los DOCX finales, direccionada por contenido.
+
+La clave de cada salida se calcula a partir del hash del libro de Excel, de los
+archivos de configuración/plantilla que intervienen y del orden de hojas. Como
+la generación es determinista (ver `core_secciones.normalizar_paquete_docx`),
+dos peticiones con la misma clave producen exactamente los mismos bytes y la
+segunda puede responderse directamente desde disco.
+
+Este módulo no depende del resto del proyecto, de modo que lo pueden usar la app
+web, la de escritorio y los scripts de `scripts/` compartiendo el mismo
+directorio de caché.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, Tuple, Union
+
+# Se incrementa cuando cambia la forma de generar el documento, para que las
+# entradas antiguas dejen de coincidir sin necesidad de borrar la caché.
+VERSION_CACHE = "1"
+
+_TAM_BLOQUE_LECTURA = 1024 * 1024
+
+# Dependencia de una clave: ruta de un archivo o (nombre, hash de su contenido)
+Dependencia = Union[str, Path, Tuple[str, str]]
+
+# Memo de hashes de archivos: (ruta, mtime_ns, tamaño) -> sha256
+_hashes_archivos: Dict[Tuple[str, int, int], str] = {}
+_hashes_lock = threading.Lock()
+
+
+def hash_bytes(datos: Union[bytes, bytearray, memoryview]) -> str:
+    """Devuelve el SHA-256 hexadecimal de un bloque de bytes."""
+    return hashlib.sha256(datos).hexdigest()
+
+
+def hash_archivo(ruta: Union[str, Path]) -> str:
+    """
+    Devuelve el SHA-256 de un archivo, o "ausente" si no existe.
+
+    El resultado se memoriza por (ruta, mtime, tamaño): la plantilla y los JSON
+    de configuración se consultan en cada generación y no cambian casi nunca.
+    """
+    ruta = Path(ruta)
+    try:
+        st = ruta.stat()
+    except FileNotFoundError:
+        return "ausente"
+
+    memo_key = (str(ruta.resolve()), st.st_mtime_ns, st.st_size)
+    with _hashes_lock:
+        cached = _hashes_archivos.get(memo_key)
+    if cached is not None:
+        return cached
+
+    h = hashlib.sha256()
+    with ruta.open("rb") as f:
+        for bloque in iter(lambda: f.read(_TAM_BLOQUE_LECTURA), b""):
+            h.update(bloque)
+    digest = h.hexdigest()
+
+    with _hashes_lock:
+        _hashes_archivos[memo_key] = digest
+    return digest
+
+
+def clave_salida(
+    hash_workbook: str,
+    orden_hojas: Iterable[str],
+    rutas_dependencias: Iterable[Dependencia],
+) -> str:
+    """
+    Construye la clave de caché de un DOCX final.
+
+    - `hash_workbook`: hash del contenido del libro de Excel.
+    - `orden_hojas`: hojas incluidas, en el orden en que se generan.
+    - `rutas_dependencias`: archivos que influyen en el resultado
+      (formatos_hojas.json, la plantilla, rangos_hojas.json...). Cada uno
+      puede darse como ruta (se hashea el archivo) o como (nombre, hash) si
+      ya se conoce el hash del contenido que se usó; ambas formas dan la
+      misma clave para el mismo contenido.
+    """
+    h = hashlib.sha256()
+    h.update(f"v{VERSION_CACHE}\n".encode("utf-8"))
+    h.update(f"libro:{hash_workbook}\n".encode("utf-8"))
+    for dependencia in rutas_dependencias:
+        if isinstance(dependencia, tuple):
+            nombre, huella = dependencia
+        else:
+            nombre, huella = Path(dependencia).name, hash_archivo(dependencia)
+        h.update(f"dep:{nombre}:{huella}\n".encode("utf-8"))
+    # Separador de unidad (0x1f) para que ["a b"] y ["a", "b"] no colisionen
+    h.update(("orden:" + "\x1f".join(orden_hojas)).encode("utf-8"))
+    return h.hexdigest()
+
+
+def clave_linea(
+    identificador: str,
+    orden_hojas: Iterable[str],
+    rutas_dependencias: Iterable[Dependencia],
+) -> str:
+    """
+    Clave de una "línea" de versiones: mismo origen (p. ej. el nombre del
+    libro), misma configuración y mismo orden, pero cualquier contenido.
+    Es la referencia para el parcheo incremental entre versiones sucesivas.
+    """
+    return clave_salida(f"linea:{identificador}", orden_hojas, rutas_dependencias)
+
+
+class CacheSalidas:
+    """
+    Almacén LRU de DOCX en un directorio.
+
+    Cada salida se guarda como `<clave>.docx`. El mtime del archivo hace de
+    marca de último uso: se actualiza en cada acierto y, al superar
+    `max_bytes`, se eliminan primero los archivos usados hace más tiempo.
+    Las escrituras son atómicas (archivo temporal + `os.replace`), así que
+    varios procesos pueden compartir el directorio sin leer archivos a medias.
+
+    Además, cada línea de versiones (`clave_linea`) apunta a su última salida
+    y al mapa de secciones con que se generó (`linea-<clave>.json`), para que
+    la siguiente versión pueda parchearse en lugar de generarse de cero.
+    """
+
+    def __init__(self, directorio: Union[str, Path], max_bytes: int) -> None:
+        self.directorio = Path(directorio)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # Consultas de este proceso (el directorio puede compartirse con otros)
+        self.aciertos = 0
+        self.fallos = 0
+
+    def _ruta(self, clave: str) -> Path:
+        return self.directorio / f"{clave}.docx"
+
+    def obtener(self, clave: str) -> bytes | None:
+        """Devuelve los bytes cacheados para `clave`, o None si no existen."""
+        datos = self._leer(clave)
+        if datos is None:
+            self.fallos += 1
+        else:
+            self.aciertos += 1
+        return datos
+
+    def _leer(self, clave: str) -> bytes | None:
+        ruta = self._ruta(clave)
+        try:
+            datos = ruta.read_bytes()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(ruta)
+        except OSError:
+            # Otro proceso pudo desalojarla justo ahora; los datos ya se leyeron.
+            pass
+        return datos
+
+    def estadisticas(self) -> Dict[str, int]:
+        """Aciertos y fallos de este proceso, y salidas y bytes en el directorio."""
+        entradas = 0
+        total = 0
+        for ruta in self.directorio.glob("*.docx"):
+            try:
+                total += ruta.stat().st_size
+            except FileNotFoundError:
+                continue
+            entradas += 1
+        return {
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "entradas": entradas,
+            "bytes": total,
+            "max_bytes": self.max_bytes,
+        }
+
+    def guardar(self, clave: str, datos: bytes) -> None:
+        """Guarda `datos` bajo `clave` y aplica el límite de tamaño."""
+        self._escribir_atomico(self._ruta(clave), datos)
+        self._desalojar()
+
+    def obtener_linea(self, clave_linea: str) -> Tuple[bytes, Dict[str, Any]] | None:
+        """
+        Devuelve (bytes, mapa) de la última salida de una línea de versiones,
+        o None si no hay ninguna o su DOCX ya fue desalojado.
+        """
+        ruta = self.directorio / f"linea-{clave_linea}.json"
+        try:
+            registro = json.loads(ruta.read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            return None
+        datos = self._leer(registro.get("clave", ""))
+        if datos is None:
+            return None
+        return datos, registro.get("mapa", {})
+
+    def guardar_linea(self, clave_linea: str, clave: str, mapa: Dict[str, Any]) -> None:
+        """Apunta la línea de versiones a la salida `clave` (ya guardada) y su mapa."""
+        registro = json.dumps({"clave": clave, "mapa": mapa}, ensure_ascii=False)
+        self._escribir_atomico(
+            self.directorio / f"linea-{clave_linea}.json", registro.encode("utf-8")
+        )
+
+    def _escribir_atomico(self, destino: Path, datos: bytes) -> None:
+        self.directorio.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=self.directorio, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                tmp.write(datos)
+            os.replace(tmp_name, destino)
+        except BaseException:
+            try:
+                os.unlink(tmp_name)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def _desalojar(self) -> None:
+        with self._lock:
+            entradas = []
+            total = 0
+            for ruta in self.directorio.glob("*.docx"):
+                try:
+                    st = ruta.stat()
+                except FileNotFoundError:
+                    continue
+                entradas.append((st.st_mtime_ns, st.st_size, ruta))
+                total += st.st_size
+
+            if total <= self.max_bytes:
+                return
+
+            entradas.sort()
+            for _, tam, ruta in entradas:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    ruta.unlink()
+                except FileNotFoundError:
+                    pass
+                total -= tam
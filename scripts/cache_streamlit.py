@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+"""
+Capa de caché de Streamlit compartida por `app.py` y `app_refactor.py`.
+
+- Motor: un único `MotorDictamen` por proceso (ver
+  `scripts.motor_automatizacion`), compartido por todas las sesiones. Tiene
+  la configuración (formatos, plantilla compilada y estilos de la vista
+  HTML, que se recargan en segundo plano si se editan, sin reiniciar el
+  servidor), la caché de análisis por hash del libro subido (si otro usuario,
+  o la misma sesión tras "Empezar de Nuevo", sube el mismo libro, no se
+  vuelve a analizar) y el pool de generación, con concurrencia y cola
+  acotadas para todas las sesiones (ver `scripts.pool_generacion`).
+- Documentos generados de cada sesión: un único `AlmacenSesiones` por proceso
+  con presupuesto de memoria global (ver `scripts.almacen_sesiones`).
+
+Ninguna sesión guarda objetos Workbook: el libro se abre, se analiza y se
+libera dentro de `MotorDictamen.descubrir`.
+"""
+
+from pathlib import Path
+
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from scripts.almacen_sesiones import AlmacenSesiones
+from scripts.motor_automatizacion import MotorDictamen
+from scripts.registro_configuracion import Instantanea
+
+# Documentos generados: memoria máxima para todas las sesiones del proceso
+# (el resto se vuelca a disco) y tiempo tras el que se purga una sesión inactiva.
+ALMACEN_SESIONES_DIR = Path("cache/sesiones")
+PRESUPUESTO_MEMORIA_SESIONES = 128 * 1024 * 1024
+INACTIVIDAD_MAX_SESION_S = 2 * 60 * 60
+
+# Generaciones simultáneas, peticiones en espera y trabajos por proceso
+# trabajador antes de reciclarlo
+TRABAJADORES_GENERACION = 2
+MAX_EN_COLA_GENERACION = 8
+TAREAS_POR_TRABAJADOR = 20
+
+
+@st.cache_resource(show_spinner="Preparando el motor...")
+def obtener_motor() -> MotorDictamen:
+    """Motor compartido por todas las sesiones del proceso."""
+    # Configuración, plantilla y trabajadores quedan en caliente desde la primera visita
+    return MotorDictamen(
+        TRABAJADORES_GENERACION, MAX_EN_COLA_GENERACION, TAREAS_POR_TRABAJADOR
+    ).iniciar()
+
+
+def obtener_configuracion() -> Instantanea:
+    """
+    Formatos y plantilla vigentes, en una sola instantánea. Quien necesite
+    ambos (p. ej. para lanzar una generación) debe tomarlos de la misma.
+    """
+    return obtener_motor().configuracion()
+
+
+@st.cache_resource(show_spinner=False)
+def obtener_almacen() -> AlmacenSesiones:
+    """Almacén de documentos generados, compartido por todas las sesiones del proceso."""
+    return AlmacenSesiones(
+        ALMACEN_SESIONES_DIR, PRESUPUESTO_MEMORIA_SESIONES, INACTIVIDAD_MAX_SESION_S
+    )
+
+
+def id_sesion() -> str:
+    """Identificador de la sesión de Streamlit en curso."""
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else "sin-sesion"
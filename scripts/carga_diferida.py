@@ -0,0 +1,37 @@
+from __future__ import annotations
+
+"""
+Utilidades para no importar dependencias pesadas antes de necesitarlas.
+
+pandas, openpyxl, python-docx y docxcompose tardan cientos de milisegundos
+en importarse. Los módulos del motor los importan dentro de las funciones
+que los usan (o bajo `TYPE_CHECKING` si solo aparecen en anotaciones), de
+modo que abrir la app de escritorio, lanzar un CLI o arrancar Streamlit no
+los paga hasta la primera carga de un libro o generación.
+
+Las comprobaciones de tipo sobre pandas se hacen con `es_dataframe` y
+`es_nulo`: si pandas aún no se importó, ningún valor puede ser un DataFrame
+ni un nulo de pandas, así que no hace falta importarlo para preguntarlo.
+
+`scripts/medir_arranque.py` vigila que siga siendo así.
+"""
+
+import math
+import sys
+from typing import Any
+
+
+def es_dataframe(valor: Any) -> bool:
+    """`isinstance(valor, pd.DataFrame)` sin importar pandas."""
+    pd = sys.modules.get("pandas")
+    return pd is not None and isinstance(valor, pd.DataFrame)
+
+
+def es_nulo(valor: Any) -> bool:
+    """Equivale a `pd.isna(valor)` para un valor escalar, sin importar pandas."""
+    if valor is None:
+        return True
+    pd = sys.modules.get("pandas")
+    if pd is not None:
+        return bool(pd.isna(valor))
+    return isinstance(valor, float) and math.isnan(valor)
@@ -0,0 +1,278 @@
+from __future__ import annotations
+
+"""
+Componentes de interfaz de Streamlit compartidos por `app.py` y `app_refactor.py`.
+
+- `panel_generacion`: muestra el avance del trabajo de generación en segundo
+  plano guardado en `st.session_state.trabajo`. Es un fragmento que se
+  refresca solo cada segundo, así que el resto de la página (la
+  previsualización) no se vuelve a ejecutar mientras el trabajo avanza.
+  Mientras la petición espera en la cola del pool de generación, muestra su
+  posición.
+- `boton_descarga` / `descartar_salida`: descarga del documento guardado en
+  el almacén de sesiones. Streamlit guarda en memoria los datos de cada
+  botón de descarga, así que un documento volcado a disco solo se lee al
+  pedirlo ("Preparar descarga") y se suelta en la siguiente ejecución.
+- `pregenerar` / `lanzar_generacion`: generación especulativa opcional. Tras
+  el análisis se adelanta la generación en segundo plano; al pulsar
+  "Generar DOCX final" se reutiliza ese trabajo si sus entradas (firma) siguen
+  siendo las mismas, y si no se cancela y se lanza uno nuevo.
+- `vista_previa_secciones`: previsualización paginada de los bloques de una
+  hoja, o la sección completa como HTML (`scripts.vista_html`). Es un
+  fragmento: elegir otra hoja solo vuelve a dibujar la previsualización, no
+  el resto de la app.
+"""
+
+from typing import Any, Callable, Dict, Iterable, List
+
+import streamlit as st
+
+from scripts.carga_diferida import es_dataframe
+from scripts.cache_streamlit import (
+    id_sesion,
+    obtener_almacen,
+    obtener_motor,
+)
+from scripts.pool_generacion import ColaLlena
+from scripts.trabajos import CANCELADO, COMPLETADO, ERROR, TrabajoGeneracion
+
+# Intervalo de refresco del panel mientras hay un trabajo en curso (segundos)
+INTERVALO_REFRESCO = 1.0
+
+# Nombre del documento final dentro del almacén de sesiones
+NOMBRE_SALIDA = "dictamen_final"
+
+# Previsualización: bloques por página y alto (px) de las tablas
+BLOQUES_POR_PAGINA = 10
+ALTO_FILA_TABLA = 35
+ALTO_MAX_TABLA = 400
+
+
+def _formatear_segundos(segundos: float) -> str:
+    segundos = int(round(segundos))
+    if segundos < 60:
+        return f"{segundos} s"
+    return f"{segundos // 60} min {segundos % 60:02d} s"
+
+
+def boton_descarga() -> None:
+    """
+    Botón de descarga del documento de la sesión. Si el almacén ya lo purgó,
+    lo indica.
+
+    `st.download_button` guarda sus datos en la memoria del servidor mientras
+    el botón se muestre. Un documento en memoria se le pasa tal cual (son los
+    mismos bytes que cuenta el presupuesto del almacén); uno volcado a disco
+    solo se lee tras pulsar "Preparar descarga", y el botón de descarga dura
+    hasta la siguiente ejecución de la app.
+    """
+    artefacto = st.session_state.get("buf_final")
+    obtener_almacen().tocar(id_sesion())
+    if artefacto is not None and not artefacto.disponible:
+        st.session_state.buf_final = artefacto = None
+        st.warning("El documento generado caducó por inactividad. Vuelve a generarlo.")
+
+    if artefacto is None:
+        st.info("Genera el dictamen para habilitar la descarga.")
+        return
+
+    if artefacto.en_disco and not st.button(
+        "Preparar descarga",
+        help="El documento está guardado en disco; se carga para descargarlo.",
+        key="prepare_download_button",
+    ):
+        return
+
+    st.download_button(
+        label="Descargar DICTAMEN_FINAL.docx",
+        data=artefacto.leer(),
+        file_name="DICTAMEN_FINAL.docx",
+        mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        help="Haz clic para descargar el documento Word generado.",
+        key="download_button"
+    )
+
+
+def descartar_salida() -> None:
+    """Borra del almacén los documentos de la sesión en curso."""
+    obtener_almacen().eliminar_sesion(id_sesion())
+    st.session_state.buf_final = None
+
+
+def firma_generacion(hash_libro: str, orden: Iterable[str]) -> tuple:
+    """Entradas que determinan el documento generado en una sesión."""
+    return hash_libro, tuple(orden)
+
+
+def descartar_pregeneracion() -> None:
+    """Cancela y olvida el trabajo especulativo de la sesión, si lo hay."""
+    especulativo: TrabajoGeneracion | None = st.session_state.get("trabajo_especulativo")
+    if especulativo is not None:
+        especulativo.cancelar()
+        st.session_state.trabajo_especulativo = None
+
+
+def pregenerar(objetivo: Callable[..., Any], firma: tuple, **kwargs: Any) -> None:
+    """
+    Adelanta la generación con `firma` si no hay ya un trabajo para ella.
+
+    Un trabajo especulativo con otra firma (otro libro u otro orden) se
+    cancela. Si el proceso ya tiene ocupado su hueco de especulación, no se
+    hace nada: el usuario generará al pulsar el botón, como siempre.
+    """
+    especulativo: TrabajoGeneracion | None = st.session_state.get("trabajo_especulativo")
+    if especulativo is not None and especulativo.firma == firma:
+        return
+    descartar_pregeneracion()
+    st.session_state.trabajo_especulativo = TrabajoGeneracion.especulativo(
+        objetivo, firma, **kwargs
+    )
+
+
+def lanzar_generacion(objetivo: Callable[..., Any], firma: tuple, **kwargs: Any) -> None:
+    """
+    Deja en `st.session_state.trabajo` el trabajo de generación para `firma`:
+    el especulativo si sigue siendo válido, o uno nuevo.
+    """
+    especulativo: TrabajoGeneracion | None = st.session_state.get("trabajo_especulativo")
+    st.session_state.trabajo_especulativo = None
+    if (
+        especulativo is not None
+        and especulativo.firma == firma
+        and not especulativo.cancelacion_pedida
+        and especulativo.estado not in (CANCELADO, ERROR)
+    ):
+        st.session_state.trabajo = especulativo
+        return
+    if especulativo is not None:
+        especulativo.cancelar()
+    st.session_state.trabajo = TrabajoGeneracion(objetivo, firma=firma, **kwargs).iniciar()
+
+
+@st.fragment(run_every=INTERVALO_REFRESCO)
+def panel_generacion() -> None:
+    """
+    Barra de progreso, tiempo restante y botón de cancelar del trabajo en curso.
+
+    Cuando el trabajo termina, guarda el resultado en el almacén de sesiones y
+    deja su manejador en `st.session_state.buf_final`
+    (o el error en `st.session_state.error_generacion`), olvida el trabajo y
+    relanza la app completa para mostrar la descarga.
+    """
+    trabajo: TrabajoGeneracion | None = st.session_state.get("trabajo")
+    if trabajo is None:
+        return
+
+    if trabajo.terminado:
+        st.session_state.trabajo = None
+        if trabajo.estado == COMPLETADO:
+            # El documento pasa al almacén de sesiones; la sesión solo guarda el manejador
+            st.session_state.buf_final = obtener_almacen().guardar(
+                id_sesion(), NOMBRE_SALIDA, trabajo.resultado.getvalue()
+            )
+            st.session_state.error_generacion = None
+        elif trabajo.estado == CANCELADO:
+            st.session_state.error_generacion = "Generación cancelada."
+        elif isinstance(trabajo.error, ColaLlena):
+            st.session_state.error_generacion = str(trabajo.error)
+        else:
+            st.session_state.error_generacion = f"Error al generar el documento: {trabajo.error}"
+        st.rerun(scope="app")
+
+    if trabajo.posicion_cola:
+        texto = f"En cola: posición {trabajo.posicion_cola}. Empezará cuando haya un hueco libre."
+    elif trabajo.total and trabajo.hoja_actual:
+        texto = f"Sección {trabajo.completadas + 1} de {trabajo.total}: {trabajo.hoja_actual}"
+    elif trabajo.total:
+        texto = "Guardando el documento..."
+    else:
+        texto = "Preparando el libro..."
+    st.progress(trabajo.fraccion, text=texto)
+
+    eta = trabajo.eta_segundos()
+    detalle = f"Transcurrido: {_formatear_segundos(trabajo.transcurrido)}"
+    if eta is not None:
+        detalle += f" · Restante estimado: {_formatear_segundos(eta)}"
+    st.caption(detalle)
+
+    if trabajo.cancelacion_pedida:
+        st.caption("Cancelando...")
+    elif st.button("Cancelar", key="cancel_button", help="Detiene la generación en curso."):
+        trabajo.cancelar()
+
+
+def _resumen_bloque(contenido: Any) -> str:
+    """Tamaño de un bloque, calculado sin renderizarlo."""
+    if es_dataframe(contenido):
+        filas, columnas = contenido.shape
+        return f"{filas} filas × {columnas} columnas"
+    return f"{len(str(contenido or ''))} caracteres"
+
+
+@st.fragment
+def vista_previa_secciones(hojas_disponibles: List[str], rangos: Dict[str, list]) -> None:
+    """
+    Selector de hoja y bloques detectados en ella, paginados.
+
+    De cada bloque se muestra al principio solo su tipo y tamaño; el contenido
+    se envía al navegador únicamente cuando el usuario lo despliega (un
+    `st.expander` enviaría siempre su contenido). Las tablas se muestran con
+    `st.dataframe`, que solo dibuja las filas visibles.
+    """
+    hoja_sel = st.selectbox(
+        "Selecciona una sección/hoja para previsualizar:",
+        hojas_disponibles,
+        help="Permite ver el contenido detectado en cada sección."
+    )
+
+    if not hoja_sel:
+        st.info("Selecciona una hoja para ver su previsualización.")
+        return
+
+    bloques = rangos.get(hoja_sel, [])
+    if not bloques:
+        st.warning("No se encontraron bloques de contenido para esta sección.")
+        return
+
+    st.subheader(f"Contenido de '{hoja_sel}'")
+    if st.toggle("Vista de documento (HTML)", key="vista_html", help="Muestra la sección con el formato aproximado del DOCX, sin generarlo."):
+        st.html(obtener_motor().vista_previa(bloques))
+        return
+
+    tablas = [b['contenido'] for b in bloques if es_dataframe(b.get('contenido'))]
+    st.caption(
+        f"{len(bloques)} bloques · {len(tablas)} tablas · "
+        f"{sum(len(t) for t in tablas)} filas de tabla en total"
+    )
+
+    paginas = max(1, -(-len(bloques) // BLOQUES_POR_PAGINA))
+    pagina = 1
+    if paginas > 1:
+        # Una clave por hoja: al volver a una hoja se conserva su página
+        pagina = st.number_input(
+            f"Página (de {paginas})", min_value=1, max_value=paginas, value=1, step=1,
+            key=f"pagina_vista_previa::{hoja_sel}",
+        )
+    inicio = (pagina - 1) * BLOQUES_POR_PAGINA
+
+    for i, bloque in enumerate(bloques[inicio:inicio + BLOQUES_POR_PAGINA], inicio + 1):
+        contenido = bloque.get('contenido')
+        mostrar = st.toggle(
+            f"**Bloque {i}:** Tipo=`{bloque['tipo']}` · {_resumen_bloque(contenido)}",
+            key=f"bloque_vista_previa::{hoja_sel}::{i}",
+        )
+        if not mostrar:
+            continue
+        if es_dataframe(contenido):
+            st.dataframe(
+                contenido,
+                height=min(ALTO_MAX_TABLA, ALTO_FILA_TABLA * (len(contenido) + 1) + 3),
+                hide_index=True,
+            )
+        else:
+            st.text_area(
+                f"Contenido del Bloque {i}",
+                value=str(contenido or ''),
+                height=100,
+                disabled=True,
+            )
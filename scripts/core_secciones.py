@@ -12,20 +12,37 @@ puede ser usado tanto por la app web como por una futura app de escritorio
 o por scripts de línea de comandos.
 """
 
+import copy
+import hashlib
 import io
 import json
+import os
+import tempfile
+import threading
+import zipfile
 from pathlib import Path
-from typing import Any, Dict, Iterable, List, Tuple, Union
+from typing import IO, TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Tuple, Union
 
-import pandas as pd
-from openpyxl import load_workbook
-from openpyxl.workbook.workbook import Workbook
-from docx import Document
-from docx.document import Document as DocumentType
-from docx.enum.text import WD_ALIGN_PARAGRAPH
-from docx.shared import Cm
+from scripts.carga_diferida import es_dataframe
+from scripts.formatos_compilados import FormatosCompilados
+from scripts.matriz_hoja import leer_valores_rango, matriz_hoja, tramos
 
-from scripts.procesador_bloques import procesar_bloque_por_tipo
+# pandas, openpyxl, python-docx y el renderizado de bloques se importan al
+# usarlos (ver scripts/carga_diferida.py): importar este módulo es inmediato.
+if TYPE_CHECKING:
+    import pandas as pd
+    from openpyxl.workbook.workbook import Workbook
+    from docx.document import Document as DocumentType
+
+
+# Fecha fija para todas las entradas del ZIP: la mínima que admite el formato.
+# Con ella (y un orden de partes estable) el mismo contenido produce siempre
+# los mismos bytes, lo que permite cachear las salidas por contenido.
+FECHA_ZIP_FIJA = (1980, 1, 1, 0, 0, 0)
+
+# Callback de avance de la composición: (secciones completadas, total, hoja en curso).
+# Si lanza una excepción, la generación se interrumpe con ella (así se cancela).
+Progreso = Callable[[int, int, str], None]
 
 
 # ------------------------
@@ -96,23 +113,26 @@ def cargar_rangos(config_path: Union[str, Path]) -> Dict[str, List[Dict[str, str
 
 def cargar_workbook(excel_path: Path) -> Workbook:
     """
-    Carga el libro de Excel en modo solo datos.
+    Carga el libro de Excel en modo solo datos. Cada hoja se lee la primera
+    vez que se usa (ver `scripts.libro_diferido`).
     """
-    if not excel_path.exists():
-        raise FileNotFoundError(f"No se encontró el archivo de Excel: {excel_path}")
+    from scripts.libro_diferido import LibroDiferido
 
-    return load_workbook(excel_path, data_only=True)
+    return LibroDiferido(excel_path)
 
 
 def cargar_formatos(formatos_path: Union[str, Path]) -> Dict[str, Any]:
     """
-    Carga el archivo JSON de formatos de hojas.
+    Carga el archivo JSON de formatos de hojas y lo compila
+    (ver `scripts.formatos_compilados`).
 
     Estructura esperada:
         {
           "mapa_hojas": { "BG": "estado_financiero", ... },
           "perfiles": { "estado_financiero": { ... }, ... }
         }
+
+    Lanza `ValueError` si algún tipo tiene una configuración inválida.
     """
     # Normalize path to a Path object
     if isinstance(formatos_path, str):
@@ -120,13 +140,20 @@ def cargar_formatos(formatos_path: Union[str, Path]) -> Dict[str, Any]:
     if not formatos_path.exists():
         raise FileNotFoundError(f"No se encontró el archivo de formatos: {formatos_path}")
 
-    with formatos_path.open("r", encoding="utf-8") as f:
-        data = json.load(f)
+    return compilar_formatos(formatos_path.read_bytes())
+
+
+def compilar_formatos(datos: bytes) -> FormatosCompilados:
+    """
+    Compila el contenido ya leído de un JSON de formatos (ver `cargar_formatos`).
+    La huella del resultado es el SHA-256 de `datos`.
+    """
+    data = json.loads(datos.decode("utf-8"))
 
     if not isinstance(data, dict):
         raise ValueError("El archivo de formatos debe contener un objeto JSON (dict).")
 
-    return data  # type: ignore[return-value]
+    return FormatosCompilados(data, huella=hashlib.sha256(datos).hexdigest())
 
 
 
@@ -149,6 +176,8 @@ def extraer_seccion_desde_hoja(
       - Filas con números => consideradas parte de una tabla
       - Filas sin números => consideradas texto corrido
     """
+    import pandas as pd
+
     # Soporta múltiples rangos separados por ';', por ejemplo:
     # "A1:Q50;A60:Q120"
     if ";" in rango:
@@ -165,54 +194,39 @@ def extraer_seccion_desde_hoja(
 
         return parrafos_totales, tablas_totales
 
-    if sheet_name not in wb.sheetnames:
-        raise KeyError(f"La hoja '{sheet_name}' no existe en el libro de Excel.")
-
-    hoja = wb[sheet_name]
-    celdas = hoja[rango]
-
+    # Corte de la matriz de la hoja, que se lee una sola vez para todos los
+    # sub-rangos (ver scripts/matriz_hoja.py). Las filas se clasifican con
+    # las máscaras de celdas vacías y numéricas de la hoja, sin recorrer el
+    # rango celda a celda en Python.
+    matriz = matriz_hoja(wb, sheet_name)
+    limites = matriz.limites(rango)
+    valores = matriz.bloque(*limites)
+    vacias, numeros = matriz.mascaras(limites)
+    fila_vacia = vacias.all(axis=1)
+    # Heurística: una fila con algún número es fila de tabla (nunca está vacía)
+    fila_tabla = numeros.any(axis=1)
+
+    # Cada tramo de filas de tabla consecutivas es una tabla: la cierra la
+    # primera fila vacía o de texto
+    tablas: List[pd.DataFrame] = [
+        pd.DataFrame(valores[inicio:fin].tolist()) for inicio, fin in tramos(fila_tabla)
+    ]
+
+    # Fila vacía => separador; fila de texto => párrafo (si tiene texto)
     parrafos: List[str] = []
-    tablas: List[pd.DataFrame] = []
-
-    tabla_actual: List[List[object]] = []
-
-    for row in celdas:
-        valores = [c.value for c in row]
-
-        # Fila completamente vacía => separador / posible fin de tabla
-        if all(v is None for v in valores):
-            if tabla_actual:
-                df = pd.DataFrame(tabla_actual)
-                tablas.append(df)
-                tabla_actual = []
-            parrafos.append("")  # separador
+    es_texto = ~fila_tabla
+    for vacia, fila in zip(fila_vacia[es_texto].tolist(), valores[es_texto].tolist()):
+        if vacia:
+            parrafos.append("")
             continue
-
-        # Heurística: ¿parece fila de tabla?
-        fila_es_tabla = any(isinstance(v, (int, float)) for v in valores if v is not None)
-
-        if fila_es_tabla:
-            tabla_actual.append(valores)
-        else:
-            # Si veníamos acumulando tabla, la cerramos
-            if tabla_actual:
-                df = pd.DataFrame(tabla_actual)
-                tablas.append(df)
-                tabla_actual = []
-
-            texto = " ".join([str(v) for v in valores if v not in (None, "")])
-            if texto.strip():
-                parrafos.append(texto)
-
-    # Tabla pendiente al final
-    if tabla_actual:
-        df = pd.DataFrame(tabla_actual)
-        tablas.append(df)
+        texto = " ".join([str(v) for v in fila if v not in (None, "")])
+        if texto.strip():
+            parrafos.append(texto)
 
     return parrafos, tablas
 
 
-def _create_doc_from_template(plantilla_path: Path) -> DocumentType:
+def _create_doc_from_template(plantilla_path: Union[Path, IO[bytes]]) -> DocumentType:
     """
     Crea un Document basado en la plantilla, pero
     limpiando todo el contenido del cuerpo (párrafos y tablas).
@@ -220,6 +234,8 @@ def _create_doc_from_template(plantilla_path: Path) -> DocumentType:
     De esta forma reutilizamos estilos, encabezados/pies y configuración,
     sin arrastrar el contenido fijo de la plantilla en cada sección.
     """
+    from docx import Document
+
     doc: DocumentType = Document(plantilla_path)
 
     # Eliminar párrafos existentes
@@ -258,71 +274,322 @@ def _cache_model_tables(doc: DocumentType) -> Dict[str, Any]:
     return cache
 
 
+class PlantillaCompilada:
+    """
+    Plantilla de Word leída y preparada una sola vez.
+
+    Guarda las tablas modelo ([[...]]) y una copia serializada de la plantilla
+    con el cuerpo ya vacío. Crear el documento de cada sección consiste en
+    abrir esa copia, mucho más pequeña que la plantilla original, en lugar de
+    volver a leer y limpiar la plantilla completa.
+
+    Es de solo lectura una vez construida, por lo que puede compartirse entre
+    ejecuciones, sesiones de Streamlit e hilos. Al enviarla a otro proceso
+    viajan la ruta, la huella (SHA-256 del DOCX) y los bytes originales: allí
+    se usa `plantilla_compilada`, que la compila una vez por proceso y huella.
+    Así el trabajador usa exactamente la misma plantilla que quien la envió,
+    aunque el archivo haya cambiado en disco entretanto.
+
+    `datos` permite pasar el contenido ya leído (p. ej. desde
+    `scripts.registro_configuracion`) en lugar de leer `plantilla_path`.
+    """
+
+    def __init__(self, plantilla_path: Path, datos: bytes | None = None) -> None:
+        if datos is None:
+            if not plantilla_path.exists():
+                raise FileNotFoundError(f"No se encontró la plantilla de Word: {plantilla_path}")
+            datos = plantilla_path.read_bytes()
+
+        self.path = plantilla_path
+        self.huella = hashlib.sha256(datos).hexdigest()
+        self._datos = datos
+
+        from docx import Document
+
+        template_doc = Document(io.BytesIO(datos))
+        self.model_tables: Dict[str, Any] = _cache_model_tables(template_doc)
+
+        base = _create_doc_from_template(io.BytesIO(datos))
+        buf = io.BytesIO()
+        base.save(buf)
+        self._base_limpia = buf.getvalue()
+
+    def nuevo_documento(self) -> DocumentType:
+        """Devuelve un Document nuevo con los estilos de la plantilla y el cuerpo vacío."""
+        from docx import Document
+
+        return Document(io.BytesIO(self._base_limpia))
+
+    def __reduce__(self):
+        # Las tablas modelo (elementos lxml) no se pueden serializar
+        return (plantilla_compilada, (str(self.path), self.huella, self._datos))
+
+
+# Plantillas compiladas en este proceso: ruta -> (mtime_ns, plantilla); el
+# mtime es -1 si la plantilla se compiló a partir de bytes recibidos
+_plantillas_proceso: Dict[str, Tuple[int, PlantillaCompilada]] = {}
+_plantillas_lock = threading.Lock()
+
+
+def plantilla_compilada(
+    plantilla_path: Union[str, Path],
+    huella: str | None = None,
+    datos: bytes | None = None,
+) -> PlantillaCompilada:
+    """
+    Devuelve la plantilla compilada de `plantilla_path`, reutilizada dentro del
+    proceso mientras el archivo no cambie (lo usan los procesos trabajadores).
+
+    Con `huella` se pide una versión concreta de la plantilla: se reutiliza la
+    del proceso si coincide y, si no, se compila a partir de `datos`.
+    """
+    ruta = Path(plantilla_path)
+    clave = str(ruta.resolve())
+    if huella is not None and datos is not None:
+        with _plantillas_lock:
+            guardada = _plantillas_proceso.get(clave)
+            if guardada is not None and guardada[1].huella == huella:
+                return guardada[1]
+        plantilla = PlantillaCompilada(ruta, datos)
+        with _plantillas_lock:
+            _plantillas_proceso[clave] = (-1, plantilla)
+        return plantilla
+
+    mtime = ruta.stat().st_mtime_ns
+    with _plantillas_lock:
+        guardada = _plantillas_proceso.get(clave)
+        if guardada is not None and guardada[0] == mtime:
+            return guardada[1]
+    plantilla = PlantillaCompilada(ruta)
+    with _plantillas_lock:
+        _plantillas_proceso[clave] = (mtime, plantilla)
+    return plantilla
+
+
+def _resolver_plantilla(plantilla: Union[Path, PlantillaCompilada]) -> PlantillaCompilada:
+    """Acepta una ruta (se compila en el momento) o una plantilla ya compilada."""
+    if isinstance(plantilla, PlantillaCompilada):
+        return plantilla
+    return PlantillaCompilada(Path(plantilla))
+
+
+def _orden_parte_zip(nombre: str) -> Tuple[int, str]:
+    """[Content_Types].xml primero, luego relaciones raíz y el resto alfabético."""
+    if nombre == "[Content_Types].xml":
+        return (0, nombre)
+    if nombre.startswith("_rels/"):
+        return (1, nombre)
+    return (2, nombre)
+
+
+def normalizar_paquete_docx(datos: bytes) -> bytes:
+    """
+    Reescribe un paquete DOCX de forma determinista.
+
+    python-docx sella cada parte con la hora actual, así que dos generaciones
+    idénticas difieren en bytes. Aquí se fijan las fechas, el orden de las
+    partes y los atributos del ZIP; el contenido de cada parte no se toca.
+    """
+    salida = io.BytesIO()
+    with zipfile.ZipFile(io.BytesIO(datos)) as entrada, zipfile.ZipFile(
+        salida, "w", compression=zipfile.ZIP_DEFLATED
+    ) as destino:
+        for info in sorted(entrada.infolist(), key=lambda i: _orden_parte_zip(i.filename)):
+            nueva = zipfile.ZipInfo(info.filename, date_time=FECHA_ZIP_FIJA)
+            nueva.compress_type = zipfile.ZIP_DEFLATED
+            nueva.create_system = 0
+            nueva.external_attr = 0
+            destino.writestr(nueva, entrada.read(info.filename))
+    return salida.getvalue()
+
+
+def _guardar_determinista(doc: DocumentType) -> bytes:
+    """Serializa un Document y normaliza el paquete resultante."""
+    buf = io.BytesIO()
+    doc.save(buf)
+    return normalizar_paquete_docx(buf.getvalue())
+
+
 def generar_docx_seccion_a_archivo(
     wb: Workbook,
     sheet_name: str,
     bloques: List[Dict[str, str]],
-    plantilla_path: Path,
+    plantilla_path: Union[Path, PlantillaCompilada],
     destino: Path,
     formatos: Dict[str, Any] | None = None,
 ) -> None:
     """
     Genera un DOCX de una sola hoja usando la arquitectura basada en bloques.
+
+    `plantilla_path` puede ser la ruta de la plantilla o una `PlantillaCompilada`.
+    El archivo se escribe de forma atómica: `destino` nunca queda a medias.
     """
-    if not plantilla_path.exists():
-        raise FileNotFoundError(f"No se encontró la plantilla de Word: {plantilla_path}")
+    from scripts.procesador_bloques import procesar_bloque_por_tipo
 
-    template_doc = Document(plantilla_path)
-    model_tables = _cache_model_tables(template_doc)
+    plantilla = _resolver_plantilla(plantilla_path)
 
     # Create a new doc for the section, but based on the original template
-    doc = _create_doc_from_template(plantilla_path)
+    doc = plantilla.nuevo_documento()
 
     for bloque in bloques:
-        procesar_bloque_por_tipo(wb, sheet_name, bloque, doc, formatos, model_tables)
+        procesar_bloque_por_tipo(wb, sheet_name, bloque, doc, formatos, plantilla.model_tables)
 
+    datos = _guardar_determinista(doc)
     destino.parent.mkdir(parents=True, exist_ok=True)
-    with destino.open("wb") as f:
-        doc.save(f)
+    fd, tmp_name = tempfile.mkstemp(dir=destino.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as tmp:
+            tmp.write(datos)
+        os.replace(tmp_name, destino)
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def orden_efectivo_hojas(
+    wb: Workbook,
+    rangos: Dict[str, List[Dict[str, str]]],
+    orden: Iterable[str] | None = None,
+) -> List[str]:
+    """Hojas que entran al documento final: las de `orden` con bloques y presentes en el libro."""
+    if orden is None:
+        return [h for h in rangos.keys() if h in wb.sheetnames]
+    return [h for h in orden if h in rangos and h in wb.sheetnames]
 
 
-def generar_docx_final_en_memoria(
+def huella_seccion(
+    wb: Workbook,
+    sheet_name: str,
+    bloques: List[Dict[str, Any]],
+    formatos: Dict[str, Any] | None = None,
+) -> str:
+    """
+    Resume en un hash todo lo que determina el contenido de una sección:
+    el tipo de cada bloque, su configuración en `formatos["tipos"]` y sus
+    datos (el DataFrame/texto detectado o los valores del rango legacy).
+
+    Dos secciones con la misma huella producen el mismo fragmento de Word.
+    """
+    tipos_cfg = (formatos or {}).get("tipos", {}) or {}
+    h = hashlib.sha256()
+    for bloque in bloques:
+        tipo = str(bloque.get("tipo", "")).strip()
+        contenido = bloque.get("contenido")
+        if es_dataframe(contenido):
+            datos: Any = [list(map(str, contenido.columns)), contenido.values.tolist()]
+        elif contenido is not None:
+            datos = str(contenido)
+        elif bloque.get("rango") and sheet_name in wb.sheetnames:
+            datos = leer_valores_rango(wb, sheet_name, bloque["rango"])
+        else:
+            datos = None
+        registro = [tipo, tipos_cfg.get(tipo), bloque.get("rango"), datos]
+        h.update(json.dumps(registro, sort_keys=True, default=str).encode("utf-8"))
+        h.update(b"\x1e")
+    return h.hexdigest()
+
+
+def _firmas_partes(doc: DocumentType) -> Dict[str, str]:
+    """
+    Hash de cada parte del paquete salvo el cuerpo y la numeración, más las
+    relaciones del documento principal. Sirve para detectar si al añadir una
+    sección el Composer tocó algo fuera de `document.xml`.
+    """
+    firmas: Dict[str, str] = {}
+    principal = doc.part
+    numeracion = principal.numbering_part
+    for parte in principal.package.iter_parts():
+        if parte is principal or parte is numeracion:
+            continue
+        firmas[str(parte.partname)] = hashlib.sha1(parte.blob).hexdigest()
+    for rel in principal.rels.values():
+        destino = rel.target_ref if rel.is_external else str(rel.target_part.partname)
+        firmas[f"rel:{rel.rId}"] = f"{rel.reltype}|{destino}"
+    return firmas
+
+
+def _instancias_numeracion(doc: DocumentType) -> Tuple[Dict[str, str], int]:
+    """
+    Devuelve ({numId: firma}, nº de abstractNum) de la numeración del documento.
+    La firma es el XML del <w:num> sin su numId, para comparar definiciones.
+    """
+    from lxml import etree
+    from docx.oxml.ns import qn
+
+    numeracion = doc.part.numbering_part.element
+    instancias: Dict[str, str] = {}
+    for num in numeracion.findall(qn("w:num")):
+        copia = copy.deepcopy(num)
+        num_id = copia.attrib.pop(qn("w:numId"), "")
+        instancias[num_id] = etree.tostring(copia).decode("utf-8")
+    return instancias, len(numeracion.findall(qn("w:abstractNum")))
+
+
+# Elementos cuyos identificadores renumera el Composer en todo el documento;
+# una sección que los contiene no se puede sustituir de forma aislada.
+_XPATH_IDS_GLOBALES = ".//w:bookmarkStart | .//wp:docPr | .//pic:cNvPr"
+
+
+def _componer_documento(
     wb: Workbook,
     rangos: Dict[str, List[Dict[str, str]]],
-    plantilla_path: Path,
+    plantilla_path: Union[Path, PlantillaCompilada],
     orden: Iterable[str] | None = None,
     formatos: Dict[str, Any] | None = None,
-) -> io.BytesIO:
+    solo: Iterable[str] | None = None,
+    registrar_mapa: bool = False,
+    progreso: Progreso | None = None,
+) -> Tuple[DocumentType, Dict[str, Any]]:
     """
-    Genera un DOCX final combinando múltiples secciones en memoria.
-
-    - `rangos`: mapping hoja -> lista de bloques [{rango, tipo}]
-    - `orden`: orden explícito de hojas; si es None, se usa el orden de `rangos`.
+    Compone el documento final y devuelve (documento, mapa).
+
+    - `solo`: si se indica, únicamente se añaden esas hojas, aunque los saltos
+      de página se deciden con su posición en el orden completo.
+    - `registrar_mapa`: registra, por hoja, el rango de hijos de <w:body> que
+      ocupa, su huella y las instancias de numeración que creó; lo usa el
+      parcheo incremental (`scripts.parcheo_incremental`).
+    - `progreso`: se invoca antes de cada sección con (completadas, total, hoja)
+      y una última vez con (total, total, "") al terminar.
     """
     from docxcompose.composer import Composer
+    from scripts.procesador_bloques import procesar_bloque_por_tipo
 
-    if not plantilla_path.exists():
-        raise FileNotFoundError(f"No se encontró la plantilla de Word: {plantilla_path}")
-
-    template_doc = Document(plantilla_path)
-    model_tables = _cache_model_tables(template_doc)
+    plantilla = _resolver_plantilla(plantilla_path)
+    model_tables = plantilla.model_tables
 
     # Create a clean base document for the composer
-    base = _create_doc_from_template(plantilla_path)
+    base = plantilla.nuevo_documento()
     composer = Composer(base)
 
-    # Determinar orden efectivo
-    if orden is None:
-        orden_efectivo = [h for h in rangos.keys() if h in wb.sheetnames]
-    else:
-        orden_efectivo = [h for h in orden if h in rangos and h in wb.sheetnames]
+    orden_efectivo = orden_efectivo_hojas(wb, rangos, orden)
+
+    solo_set = set(solo) if solo is not None else None
+    secciones: List[Dict[str, Any]] = []
+    total = sum(
+        1 for h in orden_efectivo
+        if rangos.get(h) and (solo_set is None or h in solo_set)
+    )
+    completadas = 0
 
     for i, sheet_name in enumerate(orden_efectivo):
         bloques = rangos.get(sheet_name, [])
         if not bloques:
             continue
+        if solo_set is not None and sheet_name not in solo_set:
+            continue
+
+        if progreso is not None:
+            progreso(completadas, total, sheet_name)
 
-        doc_sec = _create_doc_from_template(plantilla_path)
+        if registrar_mapa:
+            inicio = composer.append_index()
+            partes_antes = _firmas_partes(composer.doc)
+            nums_antes, abstractos_antes = _instancias_numeracion(composer.doc)
+
+        doc_sec = plantilla.nuevo_documento()
         for bloque in bloques:
             procesar_bloque_por_tipo(wb, sheet_name, bloque, doc_sec, formatos, model_tables)
 
@@ -334,8 +601,74 @@ def generar_docx_final_en_memoria(
         if i >= 1 and i <= 7 and i < len(orden_efectivo) - 1:
             composer.doc.add_page_break()
 
-    out_buf = io.BytesIO()
-    composer.save(out_buf)
+        if registrar_mapa:
+            fin = composer.append_index()
+            nums_despues, abstractos_despues = _instancias_numeracion(composer.doc)
+            body = composer.doc.element.body
+            con_ids_globales = any(el.xpath(_XPATH_IDS_GLOBALES) for el in body[inicio:fin])
+            secciones.append({
+                "hoja": sheet_name,
+                "huella": huella_seccion(wb, sheet_name, bloques, formatos),
+                "inicio": inicio,
+                "fin": fin,
+                "nums": [
+                    [num_id, firma] for num_id, firma in nums_despues.items()
+                    if num_id not in nums_antes
+                ],
+                "autocontenida": (
+                    not con_ids_globales
+                    and abstractos_despues == abstractos_antes
+                    and _firmas_partes(composer.doc) == partes_antes
+                ),
+            })
+        completadas += 1
+
+    if progreso is not None:
+        progreso(total, total, "")
+
+    mapa = {"orden": orden_efectivo, "secciones": secciones}
+    return composer.doc, mapa
+
+
+def generar_docx_final_con_mapa(
+    wb: Workbook,
+    rangos: Dict[str, List[Dict[str, str]]],
+    plantilla_path: Union[Path, PlantillaCompilada],
+    orden: Iterable[str] | None = None,
+    formatos: Dict[str, Any] | None = None,
+    progreso: Progreso | None = None,
+) -> Tuple[bytes, Dict[str, Any]]:
+    """
+    Igual que `generar_docx_final_en_memoria`, pero devuelve además el mapa
+    de secciones necesario para regenerar después solo las hojas que cambien.
+    """
+    doc, mapa = _componer_documento(
+        wb, rangos, plantilla_path, orden=orden, formatos=formatos,
+        registrar_mapa=True, progreso=progreso,
+    )
+    return _guardar_determinista(doc), mapa
+
+
+def generar_docx_final_en_memoria(
+    wb: Workbook,
+    rangos: Dict[str, List[Dict[str, str]]],
+    plantilla_path: Union[Path, PlantillaCompilada],
+    orden: Iterable[str] | None = None,
+    formatos: Dict[str, Any] | None = None,
+    progreso: Progreso | None = None,
+) -> io.BytesIO:
+    """
+    Genera un DOCX final combinando múltiples secciones en memoria.
+
+    - `rangos`: mapping hoja -> lista de bloques [{rango, tipo}]
+    - `orden`: orden explícito de hojas; si es None, se usa el orden de `rangos`.
+    - `plantilla_path`: ruta de la plantilla o una `PlantillaCompilada` reutilizable.
+    - `progreso`: callback opcional de avance por sección (ver `Progreso`).
+    """
+    doc, _ = _componer_documento(
+        wb, rangos, plantilla_path, orden=orden, formatos=formatos, progreso=progreso
+    )
+    out_buf = io.BytesIO(_guardar_determinista(doc))
     out_buf.seek(0)
     return out_buf
 
@@ -343,15 +676,18 @@ def generar_docx_final_en_memoria(
 def generar_docx_final_a_archivo(
     wb: Workbook,
     rangos: Dict[str, List[Dict[str, str]]],
-    plantilla_path: Path,
+    plantilla_path: Union[Path, PlantillaCompilada],
     destino: Path,
     orden: Iterable[str] | None = None,
     formatos: Dict[str, Any] | None = None,
+    progreso: Progreso | None = None,
 ) -> None:
     """
     Genera y guarda el DOCX final en disco.
     """
-    buffer = generar_docx_final_en_memoria(wb, rangos, plantilla_path, orden=orden, formatos=formatos)
+    buffer = generar_docx_final_en_memoria(
+        wb, rangos, plantilla_path, orden=orden, formatos=formatos, progreso=progreso
+    )
     destino.parent.mkdir(parents=True, exist_ok=True)
     with destino.open("wb") as f:
         f.write(buffer.read())
@@ -1,20 +1,24 @@
 import re
 import json
-import pandas as pd
-from openpyxl import load_workbook
-from openpyxl.utils import get_column_letter
 
-def _celdas_a_dataframe(ws, rango_celdas):
+from scripts.matriz_hoja import matriz_hoja
+
+
+def _celdas_a_dataframe(matriz, rango_celdas):
     """
-    Convierte un rango de celdas de una hoja de cálculo de openpyxl a un DataFrame de pandas.
+    Convierte un rango de celdas de la matriz de una hoja (ver
+    scripts/matriz_hoja.py) a un DataFrame de pandas.
     """
-    datos = []
-    # Divide el rango en celdas de inicio y fin para iterar
+    # pandas se importa con la primera tabla, no al importar el módulo
+    import pandas as pd
+    from openpyxl.utils import get_column_letter
+
+    # Divide el rango en celdas de inicio y fin
     min_col, min_row, max_col, max_row = rango_celdas
-    
-    # Itera sobre las filas y columnas del rango para obtener los datos
-    for fila in ws.iter_rows(min_row=min_row, min_col=min_col, max_row=max_row, max_col=max_col, values_only=True):
-        datos.append(fila)
+
+    # Corte de la matriz de la hoja (filas como listas de Python, para que
+    # pandas infiera el tipo de cada columna igual que con `iter_rows`)
+    datos = matriz.bloque(min_col, min_row, max_col, max_row).tolist()
     
     # Crea un DataFrame. Si hay datos, usa la primera fila como encabezados.
     if not datos:
@@ -33,6 +37,15 @@ def extraer_bloques_desde_hoja(ws, formatos_config):
     Analiza una hoja de cálculo de openpyxl en busca de códigos especiales y extrae
     bloques de contenido (texto y tablas) en el orden en que aparecen.
     """
+    return extraer_bloques_desde_libro(ws.parent, ws.title, formatos_config)
+
+
+def extraer_bloques_desde_libro(wb, sheet_name, formatos_config):
+    """
+    Igual que `extraer_bloques_desde_hoja`, pero a partir del libro y el nombre
+    de la hoja: solo se lee la matriz de valores, sin pedir la hoja al libro
+    (en un `LibroDiferido` no llegan a crearse sus celdas).
+    """
     bloques_con_posicion = []
     # Usar defaultdict(list) para almacenar múltiples posiciones para el mismo ID de tabla
     pos_inicio_tablas = defaultdict(list)
@@ -40,45 +53,49 @@ def extraer_bloques_desde_hoja(ws, formatos_config):
     
     patron_codigo = re.compile(r'\[\[(.*?)\]\]')
 
+    # Se recorre la matriz de valores de la hoja (leída una sola vez por
+    # libro, ver scripts/matriz_hoja.py); fila y columna son 1-based
+    matriz = matriz_hoja(wb, sheet_name)
+
     # Antes de iterar, verificar si la hoja tiene alguna dimensión.
-    # Si no tiene max_row o max_column, es probable que esté vacía.
-    if not ws.max_row or not ws.max_column:
+    if matriz.valores.size == 0:
         return []
 
     # Se vuelve a `iter_rows` por rendimiento, pero con un manejo de errores
     # más robusto para capturar el `KeyError` si ocurre.
     try:
-        for fila in ws.iter_rows():
-            for celda in fila:
-                if isinstance(celda.value, str):
-                    match = patron_codigo.search(celda.value)
+        filas = matriz.valores.tolist()
+        for fila_idx, fila in enumerate(filas, start=1):
+            for col_idx, valor in enumerate(fila, start=1):
+                if isinstance(valor, str):
+                    match = patron_codigo.search(valor)
                     if match:
                         codigo_completo = match.group(1).strip()
                         
                         if codigo_completo.startswith('inicio_'):
                             id_tabla = codigo_completo.replace('inicio_', '')
-                            pos_inicio_tablas[id_tabla].append((celda.row, celda.column + 1))
+                            pos_inicio_tablas[id_tabla].append((fila_idx, col_idx + 1))
                         
                         elif codigo_completo.startswith('fin_'):
                             id_tabla = codigo_completo.replace('fin_', '')
-                            pos_fin_tablas[id_tabla].append((celda.row, celda.column - 1))
+                            pos_fin_tablas[id_tabla].append((fila_idx, col_idx - 1))
 
                         else:
                             id_simple = codigo_completo
                             if id_simple in formatos_config.get('tipos', {}):
                                 # El contenido está en la celda de al lado
-                                contenido_celda = ws.cell(row=celda.row, column=celda.column + 1).value
+                                contenido_celda = fila[col_idx] if col_idx < len(fila) else None
                                 bloques_con_posicion.append({
                                     'tipo': id_simple,
                                     'contenido': contenido_celda or "",
-                                    'fila': celda.row
+                                    'fila': fila_idx
                                 })
     except KeyError as e:
-        print(f"Advertencia: Ocurrió un error de clave al procesar la hoja '{ws.title}'. "
+        print(f"Advertencia: Ocurrió un error de clave al procesar la hoja '{sheet_name}'. "
               f"Esto puede suceder con hojas anómalas. La hoja será omitida. Error: {e}")
         return []
     except Exception as e:
-        print(f"Error inesperado procesando la hoja '{ws.title}': {e}")
+        print(f"Error inesperado procesando la hoja '{sheet_name}': {e}")
         return []
 
     # 2. Consolidar las tablas en la lista de bloques
@@ -104,7 +121,7 @@ def extraer_bloques_desde_hoja(ws, formatos_config):
 
             rango = (pos_inicio[1], pos_inicio[0], pos_fin[1], pos_fin[0])
             
-            df_tabla = _celdas_a_dataframe(ws, rango)
+            df_tabla = _celdas_a_dataframe(matriz, rango)
             
             if not df_tabla.empty:
                 # Añadir el bloque de tabla con su fila de inicio
@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+"""
+Firmas por hoja de un libro .xlsx, calculadas sin openpyxl.
+
+Un .xlsx es un ZIP en el que cada hoja es una parte XML propia
+(`xl/worksheets/sheetN.xml`). Para saber qué hojas cambiaron entre dos
+versiones basta con comparar esas partes y las cadenas compartidas
+(`xl/sharedStrings.xml`) que cada hoja referencia: es mucho más rápido que
+cargar el libro con openpyxl y recorrer sus celdas.
+
+La firma de una hoja cubre su XML (valores, fórmulas con su último valor
+calculado, combinaciones...), el texto de las cadenas compartidas que usa y
+el CRC de `xl/styles.xml` (los formatos numéricos deciden, p. ej., qué celdas
+se leen como fechas). Dos versiones con la misma firma en una hoja dan los
+mismos valores al leerla con `load_workbook(data_only=True)`.
+"""
+
+import hashlib
+import posixpath
+import re
+import zipfile
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Union
+from xml.etree import ElementTree
+
+from scripts.ingesta import LibroSubido
+
+_NS_MAIN = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_NS_REL_DOC = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+_NS_REL_PKG = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+_TIPO_CADENAS = "/sharedStrings"
+_TIPO_ESTILOS = "/styles"
+
+# <c ... t="s" ...><v>12</v>: celda cuyo valor es la cadena compartida 12
+_RE_CADENA_COMPARTIDA = re.compile(rb'<(?:\w+:)?c\b[^>]*?\bt="s"[^>]*>\s*<(?:\w+:)?v>(\d+)</')
+
+
+def _relaciones(zf: zipfile.ZipFile, parte: str) -> Dict[str, tuple[str, str]]:
+    """Relaciones de `parte`: id -> (tipo, ruta de la parte destino dentro del ZIP)."""
+    carpeta, nombre = posixpath.split(parte)
+    ruta_rels = posixpath.join(carpeta, "_rels", f"{nombre}.rels")
+    if ruta_rels not in zf.namelist():
+        return {}
+    relaciones = {}
+    for rel in ElementTree.fromstring(zf.read(ruta_rels)).iter(f"{_NS_REL_PKG}Relationship"):
+        destino = rel.get("Target", "")
+        if destino.startswith("/"):
+            destino = destino.lstrip("/")
+        else:
+            destino = posixpath.normpath(posixpath.join(carpeta, destino))
+        relaciones[rel.get("Id")] = (rel.get("Type", ""), destino)
+    return relaciones
+
+
+def _cadenas_compartidas(zf: zipfile.ZipFile, parte: str | None) -> List[bytes]:
+    if parte is None or parte not in zf.namelist():
+        return []
+    raiz = ElementTree.fromstring(zf.read(parte))
+    return ["".join(si.itertext()).encode("utf-8") for si in raiz.iter(f"{_NS_MAIN}si")]
+
+
+def firmas_hojas(origen: Union[str, Path, LibroSubido, BinaryIO]) -> Dict[str, str]:
+    """
+    Devuelve {nombre de hoja: firma} en el orden del libro.
+
+    Lanza `zipfile.BadZipFile` si el archivo no es un .xlsx completo, lo que
+    permite detectar un libro que aún se está escribiendo.
+    """
+    if isinstance(origen, LibroSubido):
+        with origen.abrir() as archivo:
+            return firmas_hojas(archivo)
+    with zipfile.ZipFile(origen) as zf:
+        rels = _relaciones(zf, "xl/workbook.xml")
+        parte_cadenas = next((d for t, d in rels.values() if t.endswith(_TIPO_CADENAS)), None)
+        parte_estilos = next((d for t, d in rels.values() if t.endswith(_TIPO_ESTILOS)), None)
+        cadenas = _cadenas_compartidas(zf, parte_cadenas)
+        crc_estilos = zf.getinfo(parte_estilos).CRC if parte_estilos in zf.namelist() else 0
+
+        firmas: Dict[str, str] = {}
+        libro = ElementTree.fromstring(zf.read("xl/workbook.xml"))
+        for hoja in libro.iter(f"{_NS_MAIN}sheet"):
+            _, parte = rels.get(hoja.get(f"{_NS_REL_DOC}id"), ("", None))
+            if parte is None or parte not in zf.namelist():
+                continue
+            xml = zf.read(parte)
+            h = hashlib.sha256(xml)
+            h.update(b"\x1e%08x" % crc_estilos)
+            for indice in _RE_CADENA_COMPARTIDA.findall(xml):
+                i = int(indice)
+                h.update(b"\x1f")
+                h.update(cadenas[i] if i < len(cadenas) else b"")
+            firmas[hoja.get("name")] = h.hexdigest()
+    return firmas
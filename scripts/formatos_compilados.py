@@ -0,0 +1,245 @@
+from __future__ import annotations
+
+"""
+Configuración de formatos compilada.
+
+`formatos_hojas.json` describe cada tipo de bloque con un dict ("style",
+"align", "header_rows", "column_number_format"...). Leer esas claves en cada
+bloque, y en las tablas en cada celda, repite el mismo trabajo miles de veces
+por dictamen. `cargar_formatos` compila el JSON una sola vez en
+`FormatosCompilados`: un `FormatoTipo` inmutable por tipo con todo resuelto
+(manejador, alineación, sangría, formato numérico y tamaño de fuente por
+columna...), de modo que el renderizado solo lee atributos. Un valor
+inválido hace fallar la carga del archivo, no una generación a medias.
+
+`FormatosCompilados` sigue siendo el dict original: el código que lee la
+configuración cruda (`formatos.get("tipos")`, huellas de sección, extractor)
+no cambia. Su `huella` es el SHA-256 del archivo del que se leyó, y es lo que
+entra en las claves de caché (ver `motor_automatizacion.clave_generacion`).
+"""
+
+from typing import Any, Dict, Tuple
+
+# Manejadores de los bloques con `rango`, resueltos a partir del nombre del tipo
+MANEJADOR_TABLA = "tabla"
+MANEJADOR_TITULO = "titulo"
+MANEJADOR_VINETAS = "vinetas"
+MANEJADOR_NUM_NOTAS = "num_notas"
+MANEJADOR_TEXTO = "texto"
+
+_ALINEACIONES = ("left", "right", "center", "justify")
+
+
+def _manejador(tipo: str) -> str:
+    if tipo.startswith("tabla_"):
+        return MANEJADOR_TABLA
+    if tipo.startswith("texto_sangria"):
+        return MANEJADOR_TEXTO
+    if tipo.startswith("viñetas") or tipo.startswith("vinyetas"):
+        return MANEJADOR_VINETAS
+    if tipo.startswith("titulo_"):
+        return MANEJADOR_TITULO
+    if tipo == "num_notas":
+        return MANEJADOR_NUM_NOTAS
+    return MANEJADOR_TEXTO
+
+
+def _error(tipo: str, clave: str, valor: Any) -> ValueError:
+    return ValueError(f"Formato del tipo '{tipo}': valor no válido para '{clave}': {valor!r}")
+
+
+def _numero(tipo: str, clave: str, valor: Any) -> float | None:
+    """Convierte a float un tamaño opcional (vacío o 0 = sin indicar)."""
+    if not valor:
+        return None
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        raise _error(tipo, clave, valor) from None
+
+
+def _por_columna(tipo: str, clave: str, valor: Any) -> Tuple[Any, ...]:
+    """
+    Normaliza una opción por columna a una tupla indexada por columna (0-based).
+
+    Como lista, la posición j es la columna j. Como dict, las claves pueden ser
+    0- o 1-based: la columna j toma la clave j y, si no está, la j + 1.
+    """
+    if valor is None:
+        return ()
+    if isinstance(valor, list):
+        return tuple(valor)
+    if not isinstance(valor, dict):
+        raise _error(tipo, clave, valor)
+    por_indice: Dict[int, Any] = {}
+    for k, v in valor.items():
+        try:
+            por_indice[int(k)] = v
+        except (TypeError, ValueError):
+            raise _error(tipo, clave, valor) from None
+    n = max(por_indice, default=-1) + 1
+    return tuple(
+        por_indice[j] if por_indice.get(j) is not None else por_indice.get(j + 1)
+        for j in range(n)
+    )
+
+
+class FormatoTipo:
+    """
+    Configuración compilada de un tipo de bloque. Inmutable.
+
+    `config` conserva el dict original del tipo.
+    """
+
+    __slots__ = (
+        "nombre",
+        "config",
+        "es_tabla",
+        "manejador",
+        "estilo",
+        "estilos",
+        "alineacion_nombre",
+        "alineacion",
+        "sangria_cm",
+        "sangria_primera_linea",
+        "salto_pagina_antes",
+        "modelo_tabla",
+        "estilo_tabla",
+        "filas_encabezado",
+        "recortar_filas_vacias",
+        "fuente",
+        "tamano_fuente",
+        "tamanos_columna",
+        "formato_numerico",
+        "formatos_columna",
+    )
+
+    def __init__(self, nombre: str, config: Dict[str, Any] | None = None) -> None:
+        config = config or {}
+        if not isinstance(config, dict):
+            raise ValueError(f"El formato del tipo '{nombre}' debe ser un objeto JSON (dict).")
+
+        estilo = config.get("style")
+        alineacion = config.get("align")
+        if alineacion is not None and not isinstance(alineacion, str):
+            raise _error(nombre, "align", alineacion)
+        alineacion_nombre = alineacion.lower() if alineacion and alineacion.lower() in _ALINEACIONES else None
+        sangria = config.get("first_line_indent")
+        sangria_cm = float(sangria) if isinstance(sangria, (int, float)) else None
+        try:
+            filas_encabezado = max(int(config.get("header_rows", 1)), 0)
+        except (TypeError, ValueError):
+            raise _error(nombre, "header_rows", config.get("header_rows")) from None
+
+        tamano_fuente = _numero(nombre, "font_size", config.get("font_size"))
+        tamanos_columna = tuple(
+            _numero(nombre, "column_font_size", t) or tamano_fuente
+            for t in _por_columna(nombre, "column_font_size", config.get("column_font_size"))
+        )
+        formato_numerico = config.get("number_format")
+        formatos_columna = tuple(
+            f if f is not None else formato_numerico
+            for f in _por_columna(nombre, "column_number_format", config.get("column_number_format"))
+        )
+
+        # Los valores de python-docx solo se importan si el tipo los usa
+        # (ver scripts/carga_diferida.py)
+        alineacion_docx = None
+        if alineacion_nombre:
+            from docx.enum.text import WD_ALIGN_PARAGRAPH
+
+            alineacion_docx = getattr(WD_ALIGN_PARAGRAPH, alineacion_nombre.upper())
+        sangria_docx = None
+        if sangria_cm is not None:
+            from docx.shared import Cm
+
+            sangria_docx = Cm(sangria_cm)
+
+        valores = {
+            "nombre": nombre,
+            "config": config,
+            "es_tabla": nombre.startswith("tabla_"),
+            "manejador": _manejador(nombre),
+            "estilo": estilo,
+            "estilos": tuple(s.strip() for s in str(estilo or "").split(",") if s.strip()),
+            "alineacion_nombre": alineacion_nombre,
+            "alineacion": alineacion_docx,
+            "sangria_cm": sangria_cm,
+            "sangria_primera_linea": sangria_docx,
+            "salto_pagina_antes": bool(config.get("page_break_before")),
+            "modelo_tabla": config.get("table_model_id") or None,
+            "estilo_tabla": config.get("table_style", "Table Grid"),
+            "filas_encabezado": filas_encabezado,
+            "recortar_filas_vacias": bool(config.get("trim_leading_empty_rows")),
+            "fuente": config.get("font_name") or None,
+            "tamano_fuente": tamano_fuente,
+            "tamanos_columna": tamanos_columna,
+            "formato_numerico": formato_numerico,
+            "formatos_columna": formatos_columna,
+        }
+        for atributo, valor in valores.items():
+            object.__setattr__(self, atributo, valor)
+
+    def __setattr__(self, atributo: str, valor: Any) -> None:
+        raise AttributeError(f"FormatoTipo es inmutable (no se puede asignar '{atributo}').")
+
+    def __delattr__(self, atributo: str) -> None:
+        raise AttributeError(f"FormatoTipo es inmutable (no se puede borrar '{atributo}').")
+
+    def __reduce__(self):
+        # Se recompila al deserializar (p. ej. en un proceso trabajador)
+        return (FormatoTipo, (self.nombre, self.config))
+
+    def __repr__(self) -> str:
+        return f"FormatoTipo({self.nombre!r}, {self.config!r})"
+
+    def formato_columna(self, columna: int) -> Any:
+        """Formato numérico efectivo de una columna (0-based)."""
+        if columna < len(self.formatos_columna):
+            return self.formatos_columna[columna]
+        return self.formato_numerico
+
+    def tamano_columna(self, columna: int) -> float | None:
+        """Tamaño de fuente configurado para una columna (0-based), o None."""
+        if columna < len(self.tamanos_columna):
+            return self.tamanos_columna[columna]
+        return self.tamano_fuente
+
+
+class FormatosCompilados(dict):
+    """
+    El contenido de `formatos_hojas.json` (se usa como el dict original) más
+    un `FormatoTipo` compilado por tipo, accesible con `tipo(nombre)`.
+
+    `huella` es el SHA-256 del JSON de origen (None si se construyó a mano).
+    """
+
+    def __init__(self, datos: Dict[str, Any], huella: str | None = None) -> None:
+        super().__init__(datos)
+        self.huella = huella
+        tipos = self.get("tipos", {}) or {}
+        if not isinstance(tipos, dict):
+            raise ValueError('"tipos" debe ser un objeto JSON (dict).')
+        self._tipos = {nombre: FormatoTipo(nombre, config) for nombre, config in tipos.items()}
+        # Tipos usados en el libro pero sin configuración: formato por defecto
+        self._sin_config: Dict[str, FormatoTipo] = {}
+
+    def tipo(self, nombre: str) -> FormatoTipo:
+        formato = self._tipos.get(nombre) or self._sin_config.get(nombre)
+        if formato is None:
+            formato = self._sin_config[nombre] = FormatoTipo(nombre)
+        return formato
+
+    def __reduce__(self):
+        return (FormatosCompilados, (dict(self), self.huella))
+
+
+def formato_tipo(formatos: Dict[str, Any] | None, tipo: str) -> FormatoTipo:
+    """
+    `FormatoTipo` de `tipo`. Acepta también un dict sin compilar (o None), en
+    cuyo caso compila solo ese tipo.
+    """
+    if isinstance(formatos, FormatosCompilados):
+        return formatos.tipo(tipo)
+    tipos_cfg = (formatos or {}).get("tipos", {}) or {}
+    return FormatoTipo(tipo, tipos_cfg.get(tipo, {}) or {})
@@ -0,0 +1,385 @@
+# -*- coding: utf-8 -*-
+# CLI que genera el dictamen final de muchos libros a la vez
+# (p. ej. todos los fondos al cierre del ejercicio).
+#
+# Uso (desde la raíz del proyecto):
+#
+#     python -m scripts.generar_lote excel/ --salida output/lote
+#     python -m scripts.generar_lote "excel/UNC *.xlsx" --trabajadores 4
+#
+# Cada libro se analiza y se genera en un proceso trabajador. Los
+# trabajadores arrancan con las librerías cargadas y la plantilla ya compilada
+# (ver scripts/pool_generacion.py y scripts/precarga_trabajadores.py) y se
+# reciclan cada pocos libros para no acumular memoria. Si un libro falla, se
+# anota y se sigue con los demás; si un trabajador muere, fallan los libros
+# que estaban en curso y los demás pasan a un pool nuevo. Al final se escribe
+# un resumen con los tiempos y errores de cada archivo.
+#
+# Cada DOCX se llama como su libro, así que dos libros con el mismo nombre
+# (p. ej. excel/2024/UNC.xlsx y excel/2025/UNC.xlsx) deben ir a lotes con
+# distinto --salida.
+#
+# El lote es reanudable: en el directorio de salida se lleva un registro
+# (registro_lote.jsonl, una línea JSON por cambio de estado) con el hash de
+# cada libro. Si el proceso muere a mitad, al repetir el mismo comando se
+# omiten los libros cuya salida está completa y al día (mismo libro, misma
+# configuración y plantilla, DOCX intacto) y solo se reintentan los
+# pendientes o fallidos. `--forzar` ignora el registro.
+
+from __future__ import annotations
+
+import argparse
+import glob
+import json
+import os
+import sys
+import tempfile
+import time
+import traceback
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Any, Dict, List
+
+from scripts.cache_salidas import VERSION_CACHE, hash_archivo, hash_bytes
+from scripts.pool_generacion import (
+    TAREAS_POR_TRABAJADOR,
+    contexto_trabajadores,
+    precargar_trabajador,
+)
+
+SALIDA_DIR = Path("output") / "lote"
+RESUMEN_NOMBRE = "resumen_lote.json"
+REGISTRO_NOMBRE = "registro_lote.jsonl"
+EXTENSIONES = (".xlsx", ".xlsm")
+
+
+def expandir_entradas(entradas: List[str]) -> List[Path]:
+    """
+    Libros a procesar: directorios (sus .xlsx/.xlsm), patrones glob o rutas.
+
+    Lanza ValueError si dos libros distintos tienen el mismo nombre (sin
+    extensión ni distinguir mayúsculas): sus DOCX se sobrescribirían.
+    """
+    libros: List[Path] = []
+    vistos: Dict[Path, Path] = {}
+    por_nombre: Dict[str, Path] = {}
+    for entrada in entradas:
+        ruta = Path(entrada)
+        if ruta.is_dir():
+            candidatos = sorted(p for p in ruta.iterdir() if p.suffix.lower() in EXTENSIONES)
+        elif ruta.is_file():
+            candidatos = [ruta]
+        else:
+            candidatos = sorted(Path(p) for p in glob.glob(entrada, recursive=True))
+        for candidato in candidatos:
+            # "~$libro.xlsx" es el archivo de bloqueo que deja Excel abierto
+            if not candidato.is_file() or candidato.name.startswith("~$"):
+                continue
+            real = candidato.resolve()
+            if real in vistos:
+                continue
+            previo = por_nombre.get(candidato.stem.casefold())
+            if previo is not None:
+                raise ValueError(
+                    f"'{previo}' y '{candidato}' generarían el mismo documento "
+                    f"({destino_para(candidato, Path())}); procésalos en lotes con distinto --salida."
+                )
+            vistos[real] = candidato
+            por_nombre[candidato.stem.casefold()] = candidato
+            libros.append(candidato)
+    return libros
+
+
+def escribir_atomico(destino: Path, datos: bytes) -> None:
+    """Escribe en un temporal del mismo directorio y lo renombra: nunca queda un DOCX a medias."""
+    destino.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=destino.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as tmp:
+            tmp.write(datos)
+        os.replace(tmp_name, destino)
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def huella_configuracion() -> str:
+    """Hash de todo lo que, además del libro, determina la salida."""
+    from scripts.motor_automatizacion import FORMATOS_PATH, PLANTILLA_PATH
+
+    partes = [VERSION_CACHE, hash_archivo(FORMATOS_PATH), hash_archivo(PLANTILLA_PATH)]
+    return hash_bytes(json.dumps(partes).encode("utf-8"))
+
+
+class RegistroLote:
+    """
+    Registro de un lote en JSON lines: cada línea es el último estado conocido
+    de un libro ("pendiente", "ok" o "error"). Se añade una línea por cambio y
+    se vuelca a disco en el momento, así que sobrevive a un corte; una última
+    línea a medias (el proceso murió escribiéndola) se ignora al leer.
+    """
+
+    def __init__(self, ruta: Path) -> None:
+        self.ruta = ruta
+        self._entradas: Dict[str, Dict[str, Any]] = {}
+        if ruta.exists():
+            with ruta.open("r", encoding="utf-8") as f:
+                for linea in f:
+                    try:
+                        entrada = json.loads(linea)
+                    except ValueError:
+                        continue
+                    self._entradas[entrada["libro"]] = entrada
+
+    def ultimo(self, libro: str) -> Dict[str, Any] | None:
+        return self._entradas.get(libro)
+
+    def anotar(self, libro: str, estado: str, **datos: Any) -> None:
+        entrada = {"libro": libro, "estado": estado, "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"), **datos}
+        self._entradas[libro] = entrada
+        self.ruta.parent.mkdir(parents=True, exist_ok=True)
+        with self.ruta.open("a", encoding="utf-8") as f:
+            f.write(json.dumps(entrada, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def al_dia(self, libro: str, hash_libro: str, huella: str) -> bool:
+        """Si la salida registrada de `libro` corresponde a estas entradas y sigue intacta."""
+        entrada = self._entradas.get(libro)
+        if (
+            entrada is None
+            or entrada["estado"] != "ok"
+            or entrada.get("hash") != hash_libro
+            or entrada.get("huella") != huella
+        ):
+            return False
+        return hash_archivo(entrada["salida"]) == entrada.get("hash_salida")
+
+    def compactar(self) -> None:
+        """Reescribe el registro con una sola línea por libro."""
+        lineas = "".join(json.dumps(e, ensure_ascii=False) + "\n" for e in self._entradas.values())
+        escribir_atomico(self.ruta, lineas.encode("utf-8"))
+
+
+def procesar_libro(libro: str, destino: str, usar_cache: bool = True) -> Dict[str, Any]:
+    """
+    Analiza y genera un libro (en el proceso trabajador). Nunca lanza: los
+    errores se devuelven en el resultado para que el lote continúe.
+    """
+    from scripts.core_secciones import plantilla_compilada
+    from scripts.motor_automatizacion import (
+        PLANTILLA_PATH,
+        cargar_libro,
+        discover_and_load_blocks,
+        ejecutar_generacion_completa,
+        load_project_formats,
+    )
+
+    resultado: Dict[str, Any] = {"libro": libro, "salida": destino, "estado": "ok"}
+    tiempos: Dict[str, float] = {}
+    inicio = time.perf_counter()
+    try:
+        formatos = load_project_formats()
+        t = time.perf_counter()
+        wb = cargar_libro(libro)
+        rangos = discover_and_load_blocks(wb, {}, formatos)
+        del wb
+        tiempos["analisis_s"] = time.perf_counter() - t
+        if not rangos:
+            raise ValueError("No se encontraron hojas con bloques [[...]].")
+
+        t = time.perf_counter()
+        buf = ejecutar_generacion_completa(
+            workbook_path=libro,
+            rangos_dinamicos=rangos,
+            formatos=formatos,
+            orden_hojas=list(rangos.keys()),
+            usar_cache=usar_cache,
+            plantilla=plantilla_compilada(PLANTILLA_PATH),
+        )
+        tiempos["generacion_s"] = time.perf_counter() - t
+
+        t = time.perf_counter()
+        datos = buf.getvalue()
+        escribir_atomico(Path(destino), datos)
+        tiempos["escritura_s"] = time.perf_counter() - t
+        resultado["secciones"] = len(rangos)
+        resultado["hash_salida"] = hash_bytes(datos)
+    except Exception as exc:
+        resultado["estado"] = "error"
+        resultado["error"] = f"{type(exc).__name__}: {exc}"
+        resultado["traza"] = traceback.format_exc(limit=5)
+    tiempos["total_s"] = time.perf_counter() - inicio
+    resultado["tiempos"] = {k: round(v, 3) for k, v in tiempos.items()}
+    return resultado
+
+
+def destino_para(libro: Path, salida: Path) -> Path:
+    return salida / f"{libro.stem}.docx"
+
+
+def nuevo_ejecutor(trabajadores: int | None) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(
+        max_workers=trabajadores,
+        mp_context=contexto_trabajadores(),
+        initializer=precargar_trabajador,
+        max_tasks_per_child=TAREAS_POR_TRABAJADOR,
+    )
+
+
+def generar_lote(
+    libros: List[Path],
+    salida: Path,
+    trabajadores: int | None = None,
+    usar_cache: bool = True,
+    forzar: bool = False,
+) -> List[Dict[str, Any]]:
+    """
+    Genera en paralelo los libros que no están al día según el registro del
+    lote y devuelve el resultado de cada uno (en orden de entrada). Los
+    omitidos aparecen con estado "omitido".
+    """
+    registro = RegistroLote(salida / REGISTRO_NOMBRE)
+    huella = huella_configuracion()
+    resultados: Dict[Path, Dict[str, Any]] = {}
+    hashes: Dict[Path, str] = {}
+    pendientes: List[Path] = []
+    for libro in libros:
+        hashes[libro] = hash_archivo(libro)
+        clave = str(libro.resolve())
+        if not forzar and registro.al_dia(clave, hashes[libro], huella):
+            resultados[libro] = {
+                "libro": str(libro), "salida": registro.ultimo(clave)["salida"],
+                "estado": "omitido", "tiempos": {},
+            }
+        else:
+            registro.anotar(clave, "pendiente", hash=hashes[libro], huella=huella)
+            pendientes.append(libro)
+    if resultados:
+        print(f"[INFO] {len(resultados)} libro(s) ya al día según {registro.ruta.name}; se omiten.")
+
+    total = len(libros)
+
+    def anotar(libro: Path, resultado: Dict[str, Any]) -> None:
+        resultados[libro] = resultado
+        registro.anotar(
+            str(libro.resolve()), resultado["estado"],
+            hash=hashes[libro], huella=huella, salida=resultado["salida"],
+            hash_salida=resultado.get("hash_salida"), error=resultado.get("error"),
+        )
+        marca = "[OK]" if resultado["estado"] == "ok" else "[ERROR]"
+        detalle = f"{resultado['tiempos'].get('total_s', 0):.1f} s"
+        if resultado["estado"] != "ok":
+            detalle += f" · {resultado['error']}"
+        print(f"{marca} ({len(resultados)}/{total}) {libro.name}: {detalle}", flush=True)
+
+    # Solo se envían tantos libros como trabajadores: así un libro enviado es
+    # un libro en curso. Si un trabajador muere, ProcessPoolExecutor falla
+    # todos sus trabajos pendientes; con esto solo son los que estaban en
+    # curso, y los que aún no empezaron se envían a un ejecutor nuevo.
+    max_en_curso = trabajadores or os.cpu_count() or 1
+    cola = deque(pendientes)
+    en_curso: Dict[Future, Path] = {}
+    ejecutor: ProcessPoolExecutor | None = None
+    try:
+        while cola or en_curso:
+            while cola and len(en_curso) < max_en_curso:
+                if ejecutor is None:
+                    ejecutor = nuevo_ejecutor(trabajadores)
+                libro = cola[0]
+                try:
+                    futuro = ejecutor.submit(procesar_libro, str(libro), str(destino_para(libro, salida)), usar_cache)
+                except BrokenProcessPool:
+                    # Se rompió antes de recibir el libro: va al ejecutor siguiente
+                    ejecutor.shutdown(wait=False)
+                    ejecutor = None
+                    break
+                en_curso[futuro] = cola.popleft()
+            if not en_curso:
+                continue
+
+            terminados, _ = wait(en_curso, return_when=FIRST_COMPLETED)
+            for futuro in terminados:
+                libro = en_curso.pop(futuro)
+                try:
+                    resultado = futuro.result()
+                except BrokenProcessPool:
+                    # Un trabajador murió (p. ej. sin memoria); no se sabe cuál de los
+                    # libros en curso lo provocó, así que todos ellos quedan como fallidos
+                    resultado = {
+                        "libro": str(libro),
+                        "salida": str(destino_para(libro, salida)),
+                        "estado": "error",
+                        "error": "El proceso trabajador terminó de forma inesperada.",
+                        "tiempos": {},
+                    }
+                    if ejecutor is not None:
+                        ejecutor.shutdown(wait=False)
+                        ejecutor = None
+                anotar(libro, resultado)
+    finally:
+        if ejecutor is not None:
+            ejecutor.shutdown()
+
+    registro.compactar()
+    return [resultados[libro] for libro in libros]
+
+
+def escribir_resumen(resultados: List[Dict[str, Any]], salida: Path, duracion_s: float) -> Path:
+    fallidos = [r for r in resultados if r["estado"] == "error"]
+    omitidos = [r for r in resultados if r["estado"] == "omitido"]
+    resumen = {
+        "libros": len(resultados),
+        "correctos": len(resultados) - len(fallidos) - len(omitidos),
+        "omitidos": len(omitidos),
+        "fallidos": len(fallidos),
+        "duracion_s": round(duracion_s, 3),
+        "resultados": resultados,
+    }
+    ruta = salida / RESUMEN_NOMBRE
+    escribir_atomico(ruta, json.dumps(resumen, ensure_ascii=False, indent=2).encode("utf-8"))
+    return ruta
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Genera el dictamen final de varios libros en paralelo.")
+    parser.add_argument("entradas", nargs="+", help="Directorios, patrones glob o archivos .xlsx/.xlsm.")
+    parser.add_argument("--salida", type=Path, default=SALIDA_DIR, help="Directorio de los DOCX y del resumen.")
+    parser.add_argument("--trabajadores", type=int, default=None, help="Procesos en paralelo (por defecto, uno por CPU).")
+    parser.add_argument("--sin-cache", action="store_true", help="No reutilizar salidas de la caché.")
+    parser.add_argument("--forzar", action="store_true", help="Regenerar también los libros que el registro da por al día.")
+    args = parser.parse_args(argv)
+
+    try:
+        libros = expandir_entradas(args.entradas)
+    except ValueError as exc:
+        print(f"[ERROR] {exc}")
+        return 2
+    if not libros:
+        print("[ERROR] No se encontró ningún libro .xlsx/.xlsm en las entradas indicadas.")
+        return 2
+
+    print(f"[INFO] Procesando {len(libros)} libro(s) en {args.salida}...")
+    inicio = time.perf_counter()
+    resultados = generar_lote(
+        libros, args.salida, args.trabajadores, usar_cache=not args.sin_cache, forzar=args.forzar
+    )
+    duracion = time.perf_counter() - inicio
+    ruta_resumen = escribir_resumen(resultados, args.salida, duracion)
+
+    fallidos = [r for r in resultados if r["estado"] == "error"]
+    omitidos = [r for r in resultados if r["estado"] == "omitido"]
+    print(
+        f"\n[FIN] {len(resultados) - len(fallidos) - len(omitidos)} correctos, {len(omitidos)} omitidos, "
+        f"{len(fallidos)} fallidos en {duracion:.1f} s. Resumen: {ruta_resumen}"
+    )
+    return 1 if fallidos else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
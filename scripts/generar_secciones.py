@@ -1,15 +1,31 @@
 # -*- coding: utf-8 -*-
 # CLI que usa core_secciones para generar
 # un DOCX por cada hoja/rango definido.
+#
+# Uso (desde la raíz del proyecto):
+#
+#     python -m scripts.generar_secciones [--trabajadores N] [--forzar]
+#
+# Las secciones se generan en paralelo en un pool de procesos. El libro y el
+# motor (`MotorDictamen`, con formatos y plantilla compilados) se preparan una
+# sola vez: en Linux/macOS los trabajadores se crean con fork después de
+# prepararlos y los heredan; donde no hay fork (Windows) cada trabajador los
+# prepara una vez al arrancar. Se omiten las
+# secciones cuyo DOCX es más reciente que todas sus entradas (Excel, rangos,
+# formatos y plantilla); `--forzar` las regenera igualmente.
 
+from __future__ import annotations
+
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 
-from core_secciones import (
-    cargar_rangos,
-    cargar_workbook,
-    cargar_formatos,
-    generar_docx_seccion_a_archivo,
-)
+from scripts.core_secciones import cargar_rangos, cargar_workbook
+from scripts.motor_automatizacion import MotorDictamen
+from scripts.registro_configuracion import RegistroConfiguracion
 
 
 # --- RUTAS BASE ---
@@ -21,40 +37,107 @@ EXCEL_PATH = BASE_DIR / "excel" / "UNC Lomas Verdes v01.xlsx"
 PLANTILLA_PATH = BASE_DIR / "plantilla" / "plantilla_base_final.docx"
 OUTPUT_SECCIONES = BASE_DIR / "output" / "secciones"
 
+# Estado de cada proceso trabajador (heredado con fork o cargado en _preparar)
+_wb = None
+_motor: MotorDictamen | None = None
+
 
 def asegurar_directorios() -> None:
     OUTPUT_SECCIONES.mkdir(parents=True, exist_ok=True)
 
 
+def _mtime(ruta: Path) -> float:
+    try:
+        return ruta.stat().st_mtime
+    except FileNotFoundError:
+        return 0.0
+
+
+def seccion_al_dia(destino: Path, mtime_entradas: float) -> bool:
+    """Si el DOCX de la sección existe y es más reciente que todas las entradas."""
+    return _mtime(destino) > mtime_entradas
+
+
+def _preparar(excel_path: Path, formatos_path: Path, plantilla_path: Path) -> None:
+    """Carga el libro y prepara el motor en este proceso, si no los tiene ya."""
+    global _wb, _motor
+    if _motor is None:
+        _motor = MotorDictamen(registro=RegistroConfiguracion(formatos_path, plantilla_path)).iniciar()
+    if _wb is None:
+        _wb = cargar_workbook(excel_path)
+
+
+def _generar_seccion(hoja: str, bloques: list, destino: str) -> float:
+    inicio = time.perf_counter()
+    _motor.generar_seccion(_wb, hoja, bloques, destino)
+    return time.perf_counter() - inicio
+
+
+def _contexto():
+    # Sin hilos en este proceso, fork es seguro y comparte el libro ya cargado
+    metodo = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+    return multiprocessing.get_context(metodo)
+
+
 def main() -> None:
+    parser = argparse.ArgumentParser(description="Genera un DOCX por cada hoja definida en rangos_hojas.json.")
+    parser.add_argument("--trabajadores", type=int, default=None, help="Procesos en paralelo (por defecto, uno por CPU).")
+    parser.add_argument("--forzar", action="store_true", help="Regenerar también las secciones al día.")
+    args = parser.parse_args()
+
     asegurar_directorios()
+    inicio = time.perf_counter()
 
-    wb = cargar_workbook(EXCEL_PATH)
     rangos = cargar_rangos(CONFIG_PATH)
-    try:
-        formatos = cargar_formatos(FORMATOS_PATH)
-    except FileNotFoundError:
-        formatos = None
-
-    for hoja, bloques in rangos.items():
-        if hoja not in wb.sheetnames:
-            print(f"[ADVERTENCIA] La hoja '{hoja}' no existe en el Excel, se omite.")
-            continue
-
-        print(f"[INFO] Procesando hoja '{hoja}' con {len(bloques)} bloque(s)...")
-
-        destino = OUTPUT_SECCIONES / f"{hoja}.docx"
-        generar_docx_seccion_a_archivo(
-            wb=wb,
-            sheet_name=hoja,
-            bloques=bloques,
-            plantilla_path=PLANTILLA_PATH,
-            destino=destino,
-            formatos=formatos,
-        )
-        print(f"[OK] Generado: {destino}")
-
-    print("\n[FIN] Todas las secciones han sido generadas correctamente.")
+
+    mtime_entradas = max(_mtime(p) for p in (EXCEL_PATH, CONFIG_PATH, FORMATOS_PATH, PLANTILLA_PATH))
+    pendientes = {
+        hoja: bloques for hoja, bloques in rangos.items()
+        if args.forzar or not seccion_al_dia(OUTPUT_SECCIONES / f"{hoja}.docx", mtime_entradas)
+    }
+    if len(pendientes) < len(rangos):
+        print(f"[INFO] {len(rangos) - len(pendientes)} sección(es) al día; se omiten.")
+    if not pendientes:
+        print("\n[FIN] No hay secciones que generar.")
+        return
+
+    # Se cargan antes de crear el pool para que los trabajadores los hereden
+    _preparar(EXCEL_PATH, FORMATOS_PATH, PLANTILLA_PATH)
+    for hoja in [h for h in pendientes if h not in _wb.sheetnames]:
+        print(f"[ADVERTENCIA] La hoja '{hoja}' no existe en el Excel, se omite.")
+        del pendientes[hoja]
+    if not pendientes:
+        print("\n[FIN] No hay secciones que generar.")
+        return
+
+    fallidas = 0
+    with ProcessPoolExecutor(
+        max_workers=args.trabajadores or os.cpu_count(),
+        mp_context=_contexto(),
+        initializer=_preparar,
+        initargs=(EXCEL_PATH, FORMATOS_PATH, PLANTILLA_PATH),
+    ) as ejecutor:
+        futuros = {}
+        for hoja, bloques in pendientes.items():
+            print(f"[INFO] Procesando hoja '{hoja}' con {len(bloques)} bloque(s)...")
+            destino = OUTPUT_SECCIONES / f"{hoja}.docx"
+            futuros[ejecutor.submit(_generar_seccion, hoja, bloques, str(destino))] = (hoja, destino)
+
+        for futuro in as_completed(futuros):
+            hoja, destino = futuros[futuro]
+            try:
+                segundos = futuro.result()
+            except Exception as exc:
+                fallidas += 1
+                print(f"[ERROR] Hoja '{hoja}': {type(exc).__name__}: {exc}")
+                continue
+            print(f"[OK] Generado: {destino} ({segundos:.2f} s)")
+
+    duracion = time.perf_counter() - inicio
+    if fallidas:
+        print(f"\n[FIN] {len(pendientes) - fallidas} secciones generadas y {fallidas} con error en {duracion:.1f} s.")
+    else:
+        print(f"\n[FIN] Todas las secciones han sido generadas correctamente en {duracion:.1f} s.")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+"""
+Ingesta de libros de Excel subidos desde las apps web.
+
+El archivo subido ya está en memoria (`uploaded_file.getvalue()`), así que lo
+normal es leerlo directamente desde ahí, sin escribirlo a disco para volver a
+leerlo después. Solo los archivos que superan `UMBRAL_SUBIDA_EN_DISCO` se
+vuelcan a un temporal, para no retener bytes muy grandes en la sesión; ese
+temporal se borra al llamar a `liberar()` ("Empezar de Nuevo") o, como
+muy tarde, cuando el objeto deja de estar referenciado (fin de la sesión) o
+termina el proceso.
+"""
+
+import io
+import os
+import tempfile
+import weakref
+from typing import BinaryIO
+
+from scripts.cache_salidas import hash_bytes
+
+# Tamaño a partir del cual la subida se guarda en un temporal en lugar de en memoria.
+UMBRAL_SUBIDA_EN_DISCO = 50 * 1024 * 1024
+
+
+def _eliminar_archivo(ruta: str) -> None:
+    try:
+        os.unlink(ruta)
+    except FileNotFoundError:
+        pass
+
+
+class LibroSubido:
+    """
+    Origen de un libro subido: sus bytes en memoria o un temporal en disco.
+
+    Expone siempre la misma interfaz (`abrir()`, `hash`, `nombre`), de modo que
+    el motor no necesita saber dónde está el contenido.
+    """
+
+    def __init__(self, datos: bytes, nombre: str, umbral_bytes: int = UMBRAL_SUBIDA_EN_DISCO) -> None:
+        self.nombre = nombre
+        self.hash = hash_bytes(datos)
+        self.tamano = len(datos)
+        self.ruta: str | None = None
+        self._datos: bytes | None = None
+        self._finalizador = None
+
+        if self.tamano > umbral_bytes:
+            fd, ruta = tempfile.mkstemp(suffix=".xlsx", prefix="dictamen_")
+            try:
+                with os.fdopen(fd, "wb") as tmp:
+                    tmp.write(datos)
+            except BaseException:
+                _eliminar_archivo(ruta)
+                raise
+            self.ruta = ruta
+            # Se ejecuta una sola vez: en liberar(), al recolectarse el objeto o al salir
+            self._finalizador = weakref.finalize(self, _eliminar_archivo, ruta)
+        else:
+            self._datos = datos
+
+    @property
+    def en_disco(self) -> bool:
+        return self.ruta is not None
+
+    def abrir(self) -> BinaryIO:
+        """
+        Devuelve un archivo binario listo para `load_workbook`/`zipfile`.
+
+        En memoria se usa un BytesIO sobre los mismos bytes (CPython no los
+        copia mientras no se escriba en el buffer).
+        """
+        if self.ruta is not None:
+            return open(self.ruta, "rb")
+        if self._datos is None:
+            raise ValueError(f"El libro '{self.nombre}' ya fue liberado.")
+        return io.BytesIO(self._datos)
+
+    def __getstate__(self) -> dict:
+        # La copia que recibe otro proceso (p. ej. un trabajador del pool) no
+        # es dueña del temporal: solo lo lee, y lo borra este objeto.
+        estado = self.__dict__.copy()
+        estado["_finalizador"] = None
+        return estado
+
+    def liberar(self) -> None:
+        """Suelta los bytes en memoria y borra el temporal, si lo hay."""
+        self._datos = None
+        if self._finalizador is not None:
+            self._finalizador()
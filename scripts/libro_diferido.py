@@ -0,0 +1,232 @@
+from __future__ import annotations
+
+"""
+Libro de Excel que solo lee las hojas que se usan.
+
+`load_workbook` lee y convierte en objetos `Cell` todas las hojas del
+archivo, aunque el dictamen solo use algunas (las de `ORDER`, las que tienen
+códigos `[[...]]`...). `LibroDiferido` lee al abrirse solo lo que comparten
+todas las hojas: el índice del ZIP, `workbook.xml` (nombres de hojas, fecha
+base), los estilos (para reconocer fechas) y `sharedStrings.xml`. El XML de
+cada hoja se lee la primera vez que se pide:
+
+- `valores_hoja(nombre)` lo vuelca directamente a un array 2-D de valores,
+  sin crear celdas de openpyxl. Es lo que usa la caché de matrices (ver
+  `scripts.matriz_hoja`), de la que salen el análisis automático, los
+  rangos legacy, las huellas de sección y la vista HTML.
+- `libro[nombre]` devuelve un `Worksheet` de openpyxl completo, para el
+  código que necesite las celdas; se conserva hasta `liberar(nombre)`.
+
+Así la memoria pico depende de las hojas que se tocan y no del archivo. Los
+valores son los mismos que con `load_workbook(data_only=True)`: las celdas
+combinadas salvo la superior izquierda quedan vacías, y las celdas que
+openpyxl crearía por un hipervínculo o un comentario también cuentan para
+el tamaño de la hoja.
+
+El objeto se usa como un `Workbook` de solo lectura (`sheetnames`,
+`libro[nombre]`, `nombre in libro`); el resto de atributos (`epoch`,
+estilos...) son los del libro de openpyxl sin hojas que hay detrás. Guarda
+el archivo comprimido en memoria en lugar de mantenerlo abierto (en Windows
+impediría borrarlo o sobrescribirlo). Es seguro usarlo desde varios hilos.
+"""
+
+import io
+import threading
+from pathlib import Path
+from typing import IO, TYPE_CHECKING, Any, Dict, List, Tuple, Union
+
+# openpyxl y NumPy se importan al abrir el primer libro (ver
+# scripts/carga_diferida.py)
+if TYPE_CHECKING:
+    import numpy as np
+    from openpyxl.packaging.relationship import Relationship
+    from openpyxl.workbook.workbook import Workbook
+    from openpyxl.worksheet.worksheet import Worksheet
+
+OrigenLibro = Union[str, Path, bytes, IO[bytes]]
+
+
+class LibroDiferido:
+    """
+    Libro de Excel en modo solo datos (valores calculados en lugar de
+    fórmulas) cuyas hojas se leen al pedirlas. Ver el docstring del módulo.
+    """
+
+    def __init__(self, origen: OrigenLibro) -> None:
+        from zipfile import ZipFile
+
+        from openpyxl.reader.excel import ExcelReader
+        from openpyxl.styles.stylesheet import apply_stylesheet
+
+        if isinstance(origen, (str, Path)):
+            if not Path(origen).exists():
+                raise FileNotFoundError(f"No se encontró el archivo de Excel: {origen}")
+            datos = Path(origen).read_bytes()
+        elif isinstance(origen, bytes):
+            datos = origen
+        else:
+            datos = origen.read()
+
+        lector = ExcelReader(io.BytesIO(datos), data_only=True)
+        lector.read_manifest()
+        lector.read_strings()
+        lector.read_workbook()
+        apply_stylesheet(lector.archive, lector.wb)
+
+        self._archivo: ZipFile = lector.archive
+        self._libro: Workbook = lector.wb
+        self._cadenas: List[str] = lector.shared_strings
+        # Mismo criterio que load_workbook: se omiten las hojas sin XML
+        self._indice: Dict[str, Tuple[Any, Relationship]] = {
+            hoja.name: (hoja, rel)
+            for hoja, rel in lector.parser.find_sheets()
+            if rel.target in lector.valid_files
+        }
+        self._hojas: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    # ----- interfaz de Workbook -----
+
+    @property
+    def sheetnames(self) -> List[str]:
+        return list(self._indice)
+
+    def __contains__(self, nombre: str) -> bool:
+        return nombre in self._indice
+
+    def __getitem__(self, nombre: str) -> Worksheet:
+        with self._lock:
+            hoja = self._hojas.get(nombre)
+            if hoja is None:
+                hoja = self._hojas[nombre] = self._leer_hoja(nombre)
+            return hoja
+
+    def __getattr__(self, atributo: str) -> Any:
+        # Solo se llega aquí si el atributo no es de la fachada: epoch,
+        # estilos... del libro de openpyxl (los usa el lector de hojas)
+        if atributo.startswith("__") or atributo == "_libro":
+            raise AttributeError(atributo)
+        return getattr(self._libro, atributo)
+
+    def __repr__(self) -> str:
+        return f"<LibroDiferido {len(self._indice)} hojas, {len(self._hojas)} leídas>"
+
+    # ----- lectura de hojas -----
+
+    def _entrada(self, nombre: str) -> Tuple[Any, Relationship]:
+        try:
+            return self._indice[nombre]
+        except KeyError:
+            raise KeyError(f"La hoja '{nombre}' no existe en el libro de Excel.") from None
+
+    def _relaciones(self, rel: Relationship):
+        from openpyxl.packaging.relationship import RelationshipList, get_dependents, get_rels_path
+
+        ruta = get_rels_path(rel.target)
+        if ruta in self._archivo.namelist():
+            return get_dependents(self._archivo, ruta)
+        return RelationshipList()
+
+    def _refs_comentarios(self, relaciones) -> List[str]:
+        from openpyxl.comments.comment_sheet import CommentSheet
+        from openpyxl.xml.constants import COMMENTS_NS
+        from openpyxl.xml.functions import fromstring
+
+        refs = []
+        for r in relaciones.find(COMMENTS_NS):
+            hoja_comentarios = CommentSheet.from_tree(fromstring(self._archivo.read(r.target)))
+            refs.extend(ref for ref, _ in hoja_comentarios.comments)
+        return refs
+
+    def _leer_hoja(self, nombre: str):
+        """Hoja completa, como la crea `load_workbook` (sin tablas, dibujos ni tablas dinámicas)."""
+        from openpyxl.chartsheet import Chartsheet
+        from openpyxl.worksheet._reader import WorksheetReader
+        from openpyxl.worksheet.worksheet import Worksheet
+        from openpyxl.xml.functions import fromstring
+
+        hoja, rel = self._entrada(nombre)
+        if "chartsheet" in rel.Type:
+            grafico = Chartsheet.from_tree(fromstring(self._archivo.read(rel.target)))
+            grafico._parent = self
+            grafico.title = nombre
+            return grafico
+
+        ws = Worksheet(self, nombre)
+        ws._rels = self._relaciones(rel)
+        with self._archivo.open(rel.target) as fuente:
+            WorksheetReader(ws, fuente, self._cadenas, True, False).bind_all()
+        for ref in self._refs_comentarios(ws._rels):
+            # load_workbook crea la celda de cada comentario (el comentario en sí no interesa)
+            ws[ref]
+        ws.legacy_drawing = None
+        ws.sheet_state = hoja.state
+        return ws
+
+    def valores_hoja(self, nombre: str) -> np.ndarray:
+        """
+        Valores de la hoja como array 2-D (dtype object; la celda A1 es [0, 0]),
+        leídos del XML sin crear celdas. Igual que
+        `list(libro[nombre].iter_rows(values_only=True))` en un libro de
+        `load_workbook(data_only=True)`.
+        """
+        import numpy as np
+        from openpyxl.utils import range_boundaries
+        from openpyxl.worksheet._reader import WorkSheetParser
+
+        _, rel = self._entrada(nombre)
+        if "chartsheet" in rel.Type:
+            return np.full((0, 0), None, dtype=object)
+
+        with self._lock:
+            with self._archivo.open(rel.target) as fuente:
+                lector = WorkSheetParser(
+                    fuente, self._cadenas, True,
+                    self._libro.epoch, self._libro._date_formats, self._libro._timedelta_formats,
+                )
+                celdas = [(c["row"], c["column"], c["value"]) for _, fila in lector.parse() for c in fila]
+            extras = [enlace.ref for enlace in lector.hyperlinks.hyperlink]
+            extras += self._refs_comentarios(self._relaciones(rel))
+
+        # Celdas que openpyxl añade a la hoja tras leerla: las de hipervínculos y
+        # comentarios (con valor vacío) y las combinadas (vacías salvo la primera)
+        limites_extra = [range_boundaries(ref) for ref in extras]
+        combinadas = [
+            range_boundaries(rango.ref) for rango in (lector.merged_cells.mergeCell if lector.merged_cells else [])
+        ]
+        limites_extra += combinadas
+        if not celdas and not limites_extra:
+            # Sin celdas leídas ni creadas, `iter_rows` no devuelve nada
+            return np.full((0, 0), None, dtype=object)
+
+        filas = max([f for f, _, _ in celdas] + [lim[3] for lim in limites_extra])
+        columnas = max([c for _, c, _ in celdas] + [lim[2] for lim in limites_extra])
+        valores = np.full((filas, columnas), None, dtype=object)
+        if celdas:
+            indices_f = np.fromiter((f - 1 for f, _, _ in celdas), dtype=np.intp, count=len(celdas))
+            indices_c = np.fromiter((c - 1 for _, c, _ in celdas), dtype=np.intp, count=len(celdas))
+            valores[indices_f, indices_c] = np.fromiter((v for _, _, v in celdas), dtype=object, count=len(celdas))
+        for min_col, min_row, max_col, max_row in combinadas:
+            primera = valores[min_row - 1, min_col - 1]
+            valores[min_row - 1 : max_row, min_col - 1 : max_col] = None
+            valores[min_row - 1, min_col - 1] = primera
+        return valores
+
+    def liberar(self, nombre: str | None = None) -> None:
+        """
+        Suelta la hoja `nombre` (o todas) ya leída con `libro[nombre]` y su
+        matriz de valores; si se vuelve a pedir, se lee otra vez del archivo.
+        """
+        from scripts.matriz_hoja import cache_matrices
+
+        with self._lock:
+            nombres = [nombre] if nombre is not None else list(self._indice)
+            for n in nombres:
+                self._hojas.pop(n, None)
+        for n in nombres:
+            cache_matrices().olvidar_hoja(self, n)
+
+    def cerrar(self) -> None:
+        """Suelta todas las hojas y el archivo comprimido. El libro ya no puede usarse."""
+        self.liberar()
+        self._archivo.close()
@@ -0,0 +1,301 @@
+from __future__ import annotations
+
+"""
+Matriz de valores por hoja, compartida por todas las lecturas de rangos.
+
+Leer un rango con `hoja["A1:Q50"]` recorre celda a celda los objetos de
+openpyxl, y el mismo libro se lee así muchas veces: cada bloque legacy con
+`rango` (`procesador_bloques`), cada sub-rango de
+`core_secciones.extraer_seccion_desde_hoja`, la búsqueda de códigos `[[...]]`
+y las tablas del análisis automático (`extractor_inteligente`) y la vista
+HTML.
+
+`matriz_hoja(wb, hoja)` vuelca la hoja una sola vez, con
+`iter_rows(values_only=True)` o, si el libro es un `LibroDiferido`,
+directamente desde su XML, a un array 2-D de NumPy (dtype object, la fila
+1 / columna A es la posición [0, 0]). A partir de ahí leer un rango es cortar
+el array. Las matrices se guardan en una caché por libro con un tope de
+memoria para todo el proceso: al superarlo se descartan las menos usadas, y
+las de un libro se olvidan cuando el libro se libera.
+
+Se asume que el libro no se modifica después de leerlo (el motor nunca
+escribe en él); si se modifica, hay que llamar a `olvidar_libro`.
+"""
+
+import threading
+import weakref
+from collections import OrderedDict, deque
+from typing import TYPE_CHECKING, Any, Dict, List, Tuple
+
+# NumPy y openpyxl se importan al construir la primera matriz (ver
+# scripts/carga_diferida.py)
+if TYPE_CHECKING:
+    import numpy as np
+    from openpyxl.workbook.workbook import Workbook
+    from openpyxl.worksheet.worksheet import Worksheet
+
+# Memoria máxima de las matrices de todo el proceso. Cada celda ocupa un
+# puntero: los valores son los mismos objetos que ya guarda openpyxl.
+MAX_BYTES_MATRICES = 64 * 1024 * 1024
+
+# (columna mínima, fila mínima, columna máxima, fila máxima), 1-based e inclusivos
+Limites = Tuple[int, int, int, int]
+
+
+def _recortar(matriz: np.ndarray, limites: Limites, relleno: Any) -> np.ndarray:
+    """
+    Sub-matriz de los límites dados (1-based, inclusivos). Dentro de la zona
+    con datos es una vista, sin copiar; si se sale, se completa con `relleno`.
+    """
+    import numpy as np
+
+    min_col, min_row, max_col, max_row = limites
+    alto, ancho = max(max_row - min_row + 1, 0), max(max_col - min_col + 1, 0)
+    filas, columnas = matriz.shape
+    if max_row <= filas and max_col <= columnas:
+        return matriz[min_row - 1 : max_row, min_col - 1 : max_col]
+    salida = np.full((alto, ancho), relleno, dtype=matriz.dtype)
+    corte = matriz[min_row - 1 : min(max_row, filas), min_col - 1 : min(max_col, columnas)]
+    salida[: corte.shape[0], : corte.shape[1]] = corte
+    return salida
+
+
+class MatrizHoja:
+    """
+    Valores de una hoja como array 2-D de NumPy. Inmutable.
+
+    Las lecturas fuera de la zona con datos devuelven None, igual que las
+    celdas vacías de openpyxl.
+
+    `mascaras()` clasifica las celdas de toda la hoja (vacías / numéricas)
+    la primera vez que se pide; después, las máscaras de cualquier rango son
+    cortes, igual que sus valores.
+    """
+
+    __slots__ = ("titulo", "valores", "_mascaras")
+
+    def __init__(self, titulo: str, valores: np.ndarray) -> None:
+        valores.flags.writeable = False
+        self.titulo = titulo
+        self.valores = valores
+        self._mascaras: Tuple[np.ndarray, np.ndarray] | None = None
+
+    @classmethod
+    def desde_hoja(cls, ws: Worksheet) -> MatrizHoja:
+        import numpy as np
+
+        filas = list(ws.iter_rows(values_only=True))
+        ancho = max((len(fila) for fila in filas), default=0)
+        valores = np.full((len(filas), ancho), None, dtype=object)
+        for i, fila in enumerate(filas):
+            # Fila a fila: NumPy no debe interpretar ningún valor como secuencia
+            valores[i, : len(fila)] = fila
+        return cls(ws.title, valores)
+
+    @classmethod
+    def desde_libro(cls, wb: Workbook, sheet_name: str) -> MatrizHoja:
+        """
+        Matriz de una hoja del libro. Un `LibroDiferido` (ver
+        `scripts.libro_diferido`) la lee directamente del XML, sin crear celdas.
+        """
+        valores_hoja = getattr(wb, "valores_hoja", None)
+        if valores_hoja is not None:
+            return cls(sheet_name, valores_hoja(sheet_name))
+        return cls.desde_hoja(wb[sheet_name])
+
+    @property
+    def forma(self) -> Tuple[int, int]:
+        return self.valores.shape
+
+    @property
+    def nbytes(self) -> int:
+        """Memoria de los valores más la de las máscaras (un byte por celda cada una)."""
+        return self.valores.nbytes + 2 * self.valores.size
+
+    def limites(self, rango: str) -> Limites:
+        """Límites de `rango` ("A1:Q50", "B3", "A:C", "2:5") en esta hoja."""
+        from openpyxl.utils import range_boundaries
+
+        min_col, min_row, max_col, max_row = range_boundaries(rango.strip().replace("$", ""))
+        filas, columnas = self.valores.shape
+        # Columnas o filas enteras: hasta donde hay datos
+        return (
+            min_col or 1,
+            min_row or 1,
+            max_col or max(columnas, 1),
+            max_row or max(filas, 1),
+        )
+
+    def bloque(self, min_col: int, min_row: int, max_col: int, max_row: int) -> np.ndarray:
+        """Sub-matriz de valores de los límites dados (1-based, inclusivos; ver `_recortar`)."""
+        return _recortar(self.valores, (min_col, min_row, max_col, max_row), None)
+
+    def rango(self, rango: str) -> np.ndarray:
+        """Sub-matriz de un rango de Excel (ver `bloque`)."""
+        return self.bloque(*self.limites(rango))
+
+    def filas(self, rango: str) -> List[List[Any]]:
+        """Valores de un rango como lista de filas, como `[[c.value for c in fila] for fila in hoja[rango]]`."""
+        return self.rango(rango).tolist()
+
+    def mascaras(self, limites: Limites | None = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (celdas vacías, celdas numéricas) como arrays booleanos, de toda la
+        hoja o de `limites`. Numérica es `isinstance(valor, (int, float))`,
+        así que incluye los booleanos.
+        """
+        if self._mascaras is None:
+            # Si dos hilos las calculan a la vez, el resultado es el mismo
+            self._mascaras = _clasificar(self.valores)
+        vacias, numeros = self._mascaras
+        if limites is None:
+            return vacias, numeros
+        return _recortar(vacias, limites, True), _recortar(numeros, limites, False)
+
+
+def _clasificar(valores: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    import numpy as np
+
+    # La comparación con None se hace en C; isinstance solo se llama en las
+    # celdas con valor, que en una hoja de dictamen suelen ser pocas
+    vacias = np.equal(valores, None)
+    numeros = np.zeros(valores.shape, dtype=bool)
+    llenas = ~vacias
+    if llenas.any():
+        tipos = np.empty((), dtype=object)
+        tipos[()] = (int, float)
+        numeros[llenas] = np.frompyfunc(isinstance, 2, 1)(valores[llenas], tipos).astype(bool)
+    vacias.flags.writeable = False
+    numeros.flags.writeable = False
+    return vacias, numeros
+
+
+def tramos(mascara: np.ndarray) -> List[Tuple[int, int]]:
+    """Tramos [inicio, fin) de valores True consecutivos de una máscara 1-D."""
+    import numpy as np
+
+    bordes = np.diff(np.concatenate(([0], mascara.astype(np.int8), [0])))
+    return list(zip(np.flatnonzero(bordes == 1).tolist(), np.flatnonzero(bordes == -1).tolist()))
+
+
+class CacheMatrices:
+    """
+    Matrices de las hojas ya leídas, por libro y nombre de hoja, con un tope
+    de memoria (`max_bytes`) para todas. Es seguro usarla desde varios hilos.
+    """
+
+    def __init__(self, max_bytes: int = MAX_BYTES_MATRICES) -> None:
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._matrices: "OrderedDict[Tuple[int, str], MatrizHoja]" = OrderedDict()
+        self._bytes = 0
+        self._libros: Dict[int, weakref.finalize] = {}
+        # Libros liberados cuyas matrices aún no se han descartado. El
+        # recolector puede liberar un libro en cualquier punto (también con
+        # el lock tomado), así que su finalizador solo lo anota aquí.
+        self._liberados: deque = deque()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def matriz(self, wb: Workbook, sheet_name: str) -> MatrizHoja:
+        if sheet_name not in wb.sheetnames:
+            raise KeyError(f"La hoja '{sheet_name}' no existe en el libro de Excel.")
+        clave = (id(wb), sheet_name)
+        with self._lock:
+            self._descartar_liberados()
+            matriz = self._matrices.get(clave)
+            if matriz is not None:
+                self._matrices.move_to_end(clave)
+                self.aciertos += 1
+                return matriz
+            self.fallos += 1
+
+        # Se construye fuera del lock: otra hoja puede leerse a la vez
+        matriz = MatrizHoja.desde_libro(wb, sheet_name)
+        with self._lock:
+            self._descartar_liberados()
+            if clave in self._matrices:
+                return self._matrices[clave]
+            if id(wb) not in self._libros:
+                # El id de un libro liberado puede reutilizarse: sus matrices se van con él
+                self._libros[id(wb)] = weakref.finalize(wb, self._liberados.append, id(wb))
+            self._matrices[clave] = matriz
+            self._bytes += matriz.nbytes
+            while self._bytes > self.max_bytes and len(self._matrices) > 1:
+                _, descartada = self._matrices.popitem(last=False)
+                self._bytes -= descartada.nbytes
+        return matriz
+
+    def _descartar_liberados(self) -> None:
+        """Descarta las matrices de los libros liberados (con el lock tomado)."""
+        while True:
+            try:
+                id_libro = self._liberados.popleft()
+            except IndexError:
+                return
+            self._olvidar(id_libro)
+
+    def _olvidar(self, id_libro: int) -> None:
+        self._libros.pop(id_libro, None)
+        for clave in [c for c in self._matrices if c[0] == id_libro]:
+            self._bytes -= self._matrices.pop(clave).nbytes
+
+    def olvidar_hoja(self, wb: Workbook, sheet_name: str) -> None:
+        """Descarta la matriz de una hoja de `wb`, si está en la caché."""
+        with self._lock:
+            matriz = self._matrices.pop((id(wb), sheet_name), None)
+            if matriz is not None:
+                self._bytes -= matriz.nbytes
+
+    def olvidar_libro(self, wb: Workbook) -> None:
+        """Descarta las matrices de `wb` (p. ej. si se modificó después de leerlo)."""
+        with self._lock:
+            finalizador = self._libros.get(id(wb))
+            if finalizador is not None:
+                finalizador.detach()
+            self._olvidar(id(wb))
+
+    def estadisticas(self) -> Dict[str, int]:
+        with self._lock:
+            self._descartar_liberados()
+            return {
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "entradas": len(self._matrices),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def limpiar(self) -> None:
+        with self._lock:
+            for finalizador in self._libros.values():
+                finalizador.detach()
+            self._libros.clear()
+            self._liberados.clear()
+            self._matrices.clear()
+            self._bytes = 0
+            self.aciertos = 0
+            self.fallos = 0
+
+
+_cache_matrices = CacheMatrices()
+
+
+def cache_matrices() -> CacheMatrices:
+    """Caché de matrices del proceso."""
+    return _cache_matrices
+
+
+def matriz_hoja(wb: Workbook, sheet_name: str) -> MatrizHoja:
+    """Matriz de valores de una hoja, leída una sola vez por libro."""
+    return _cache_matrices.matriz(wb, sheet_name)
+
+
+def leer_valores_rango(wb: Workbook, sheet_name: str, rango: str) -> List[List[Any]]:
+    """Valores de un rango de una hoja como lista de filas (ver `MatrizHoja.filas`)."""
+    return matriz_hoja(wb, sheet_name).filas(rango)
+
+
+def olvidar_libro(wb: Workbook) -> None:
+    """Descarta las matrices de `wb` de la caché del proceso."""
+    _cache_matrices.olvidar_libro(wb)
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+# Prueba de tiempo de arranque de los puntos de entrada.
+#
+# Uso (desde la raíz del proyecto):
+#
+#     python -m scripts.medir_arranque
+#     python -m scripts.medir_arranque desktop_app --detalle 15
+#
+# Para cada módulo de config/presupuesto_arranque.json lanza un intérprete
+# nuevo con `python -X importtime -c "import <módulo>"` y suma el tiempo de
+# las importaciones que no hace ya el propio arranque de Python. Se toma el
+# mejor de varias repeticiones para no medir ruido del sistema.
+#
+# Falla (código de salida 1) si algún módulo supera su presupuesto en
+# milisegundos o si al importarlo se cargan dependencias pesadas (pandas,
+# openpyxl, python-docx...), que deben importarse al usarse (ver
+# scripts/carga_diferida.py).
+
+from __future__ import annotations
+
+import argparse
+import json
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+PRESUPUESTO_PATH = BASE_DIR / "config" / "presupuesto_arranque.json"
+
+
+def leer_importtime(salida: str) -> List[Tuple[int, str, int]]:
+    """
+    Interpreta la salida de `-X importtime`: lista de (nivel, módulo, µs acumulados)
+    en el orden en que se terminaron de importar.
+    """
+    entradas = []
+    for linea in salida.splitlines():
+        if not linea.startswith("import time:"):
+            continue
+        campos = linea[len("import time:"):].split("|")
+        if len(campos) != 3 or not campos[1].strip().isdigit():
+            continue  # cabecera
+        nombre = campos[2].rstrip()
+        nivel = (len(nombre) - len(nombre.lstrip()) - 1) // 2
+        entradas.append((nivel, nombre.strip(), int(campos[1])))
+    return entradas
+
+
+def _importtime(codigo: str) -> List[Tuple[int, str, int]]:
+    proceso = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", codigo],
+        cwd=BASE_DIR,
+        capture_output=True,
+        text=True,
+    )
+    if proceso.returncode != 0:
+        raise RuntimeError(proceso.stderr.strip().splitlines()[-1])
+    return leer_importtime(proceso.stderr)
+
+
+def medir_modulo(modulo: str, de_arranque: set) -> Tuple[float, List[Tuple[int, str, int]]]:
+    """Milisegundos que cuesta importar `modulo` y las importaciones que hizo."""
+    entradas = [e for e in _importtime(f"import {modulo}") if e[1] not in de_arranque]
+    total_us = sum(us for nivel, _, us in entradas if nivel == 0)
+    return total_us / 1000, entradas
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Comprueba el tiempo de importación de los puntos de entrada.")
+    parser.add_argument("modulos", nargs="*", help="Módulos a medir (por defecto, todos los del presupuesto).")
+    parser.add_argument("--presupuesto", type=Path, default=PRESUPUESTO_PATH, help="JSON con los presupuestos.")
+    parser.add_argument("--repeticiones", type=int, default=None, help="Arranques por módulo (se toma el mejor).")
+    parser.add_argument("--detalle", type=int, default=0, help="Mostrar las N importaciones más costosas.")
+    args = parser.parse_args(argv)
+
+    with args.presupuesto.open("r", encoding="utf-8") as f:
+        config = json.load(f)
+    presupuestos: Dict[str, float] = config["puntos_de_entrada"]
+    pesados = set(config.get("modulos_pesados", []))
+    repeticiones = args.repeticiones or config.get("repeticiones", 3)
+    modulos = args.modulos or list(presupuestos)
+
+    de_arranque = {nombre for _, nombre, _ in _importtime("pass")}
+    fallos = 0
+    for modulo in modulos:
+        try:
+            medidas = [medir_modulo(modulo, de_arranque) for _ in range(repeticiones)]
+        except RuntimeError as exc:
+            fallos += 1
+            print(f"[ERROR] {modulo}: no se pudo importar ({exc}).")
+            continue
+        ms, entradas = min(medidas, key=lambda m: m[0])
+        presupuesto = presupuestos.get(modulo)
+        cargados = sorted({n.split(".")[0] for _, n, _ in entradas} & pesados)
+
+        problemas = []
+        if presupuesto is not None and ms > presupuesto:
+            problemas.append(f"supera el presupuesto de {presupuesto:.0f} ms")
+        if cargados:
+            problemas.append(f"importa {', '.join(cargados)} al arrancar")
+        limite = f" / {presupuesto:.0f} ms" if presupuesto is not None else ""
+        if problemas:
+            fallos += 1
+            print(f"[ERROR] {modulo}: {ms:.0f} ms{limite}; {'; '.join(problemas)}.")
+        else:
+            print(f"[OK] {modulo}: {ms:.0f} ms{limite}")
+
+        if args.detalle or problemas:
+            for _, nombre, us in sorted(entradas, key=lambda e: e[2], reverse=True)[: args.detalle or 5]:
+                print(f"       {us / 1000:8.1f} ms  {nombre}")
+
+    if fallos:
+        print(f"\n[FIN] {fallos} punto(s) de entrada fuera de presupuesto.")
+        return 1
+    print("\n[FIN] Todos los puntos de entrada están dentro del presupuesto.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
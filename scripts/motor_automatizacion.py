@@ -4,13 +4,18 @@ from __future__ import annotations
 from pathlib import Path
 import json
 import sys
+import threading
+from collections import OrderedDict
 from io import BytesIO
-import gc  # Importar el módulo de recolección de basura
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Tuple
 
-# Dependencias de procesamiento
-import pandas as pd
-from openpyxl.workbook import Workbook
-from openpyxl import load_workbook
+# Dependencias de procesamiento: openpyxl, pandas y python-docx se importan al
+# usarlos (ver scripts/carga_diferida.py) para que importar el motor sea inmediato.
+if TYPE_CHECKING:
+    from openpyxl.workbook import Workbook
+    from scripts.pool_generacion import PoolGeneracion
+    from scripts.registro_configuracion import Instantanea, RegistroConfiguracion
+    from scripts.vista_html import EstilosHTML
 
 # --- 1. ÚNICA FUENTE DE VERDAD PARA RUTAS ---
 # Se definen rutas relativas desde la raíz del proyecto. Streamlit Cloud
@@ -18,18 +23,29 @@ from openpyxl import load_workbook
 CONFIG_PATH = Path("config/rangos_hojas.json")
 FORMATOS_PATH = Path("config/formatos_hojas.json")
 PLANTILLA_PATH = Path("plantilla/plantilla_base_final.docx")
+# Caché de DOCX finales compartida con los scripts de línea de comandos.
+CACHE_SALIDAS_DIR = Path("cache/salidas")
+CACHE_SALIDAS_MAX_BYTES = 256 * 1024 * 1024
 
 
 # --- 2. GESTIÓN DE IMPORTS INTERNOS ---
 # Se elimina la manipulación de sys.path. Al ejecutar `streamlit run app.py`
 # desde la raíz, Python maneja los módulos en `scripts/` correctamente.
 from scripts.core_secciones import (
+    PlantillaCompilada,
+    Progreso,
     cargar_rangos,
     cargar_formatos,
     extraer_seccion_desde_hoja,
     generar_docx_final_en_memoria,
+    generar_docx_seccion_a_archivo,
+    generar_docx_final_con_mapa,
 )
-from scripts.extractor_inteligente import extraer_bloques_desde_hoja
+from scripts.extractor_inteligente import extraer_bloques_desde_libro
+from scripts.cache_salidas import CacheSalidas, clave_linea, clave_salida, hash_archivo
+from scripts.parcheo_incremental import actualizar_docx_final
+from scripts.ingesta import LibroSubido
+from scripts.matriz_hoja import cache_matrices
 
 
 # --- 3. CONSTANTES DE LÓGICA DE NEGOCIO ---
@@ -58,56 +74,496 @@ def load_project_formats() -> dict | None:
     except FileNotFoundError:
         return None
 
-def discover_and_load_blocks(wb: Workbook, rangos_manuales: dict, formatos_config: dict | None) -> dict:
+def discover_and_load_blocks(
+    wb: Workbook,
+    rangos_manuales: dict,
+    formatos_config: dict | None,
+    bloques_conocidos: dict | None = None,
+    progreso: Progreso | None = None,
+) -> dict:
     """
     Analiza todas las hojas de un libro de Excel y carga los bloques de contenido
     usando únicamente el método automático basado en códigos [[...]].
+
+    `bloques_conocidos` ({hoja: bloques}, lista vacía si la hoja no tenía
+    bloques) permite saltarse el análisis de hojas que se sabe que no
+    cambiaron (ver `scripts.firmas_libro`): sus bloques se reutilizan tal cual.
+
+    `progreso` se invoca antes de analizar cada hoja con (analizadas, total, hoja);
+    si lanza una excepción, el análisis se interrumpe con ella.
     """
     rangos_descubiertos = {}
-    for sheet_name in wb.sheetnames:
-        sheet_object = wb[sheet_name]
-        
+    total = len(wb.sheetnames)
+    for i, sheet_name in enumerate(wb.sheetnames):
+        if progreso is not None:
+            progreso(i, total, sheet_name)
+
+        if bloques_conocidos is not None and sheet_name in bloques_conocidos:
+            if bloques_conocidos[sheet_name]:
+                rangos_descubiertos[sheet_name] = bloques_conocidos[sheet_name]
+            continue
+
         if not formatos_config:
             formatos_config = {}
 
         # Intentar extracción automática basada en códigos [[...]]
-        bloques_automaticos = extraer_bloques_desde_hoja(sheet_object, formatos_config)
+        bloques_automaticos = extraer_bloques_desde_libro(wb, sheet_name, formatos_config)
         
         # Si se encontraron bloques, se añaden a los resultados.
         # Si no, la hoja simplemente se ignora.
         if bloques_automaticos:
             rangos_descubiertos[sheet_name] = bloques_automaticos
 
+    if progreso is not None:
+        progreso(total, total, "")
     return rangos_descubiertos
 
+_cache_salidas = CacheSalidas(CACHE_SALIDAS_DIR, CACHE_SALIDAS_MAX_BYTES)
+
+
+def cargar_libro(origen: str | Path | LibroSubido) -> Workbook:
+    """
+    Carga un libro en modo solo datos desde una ruta o desde una subida
+    (en memoria o volcada a disco, ver `scripts.ingesta`). Cada hoja se lee
+    la primera vez que se usa (ver `scripts.libro_diferido`).
+    """
+    from scripts.libro_diferido import LibroDiferido
+
+    if isinstance(origen, LibroSubido):
+        with origen.abrir() as f:
+            return LibroDiferido(f)
+    return LibroDiferido(origen)
+
+
+def _hash_origen(origen: str | Path | LibroSubido) -> str:
+    if isinstance(origen, LibroSubido):
+        return origen.hash
+    return hash_archivo(origen)
+
+
+def _dependencias(
+    formatos: dict | None,
+    plantilla: PlantillaCompilada | None,
+    dependencias_extra: Iterable[str | Path] = (),
+) -> list:
+    """
+    Formatos y plantilla como dependencias de una clave de caché. Si ya están
+    compilados se usa su huella (lo que de verdad se va a usar, aunque el
+    archivo haya cambiado después); si no, el archivo en disco.
+
+    `dependencias_extra` son otros archivos que influyen en el resultado
+    (p. ej. rangos_hojas.json cuando los bloques no salen del propio libro).
+    """
+    huella_formatos = getattr(formatos, "huella", None)
+    huella_plantilla = getattr(plantilla, "huella", None)
+    return [
+        *dependencias_extra,
+        (FORMATOS_PATH.name, huella_formatos) if huella_formatos else FORMATOS_PATH,
+        (PLANTILLA_PATH.name, huella_plantilla) if huella_plantilla else PLANTILLA_PATH,
+    ]
+
+
+def clave_generacion(
+    workbook_path: str | Path | LibroSubido,
+    orden_hojas: list[str],
+    formatos: dict | None = None,
+    plantilla: PlantillaCompilada | None = None,
+    dependencias_extra: Iterable[str | Path] = (),
+) -> str:
+    """
+    Clave de caché del DOCX final: hash del libro + formatos + plantilla + orden.
+    """
+    return clave_salida(
+        _hash_origen(workbook_path),
+        orden_hojas,
+        _dependencias(formatos, plantilla, dependencias_extra),
+    )
+
+
+def buscar_en_cache(
+    workbook_path: str | Path | LibroSubido,
+    rangos_dinamicos: dict,
+    orden_hojas: list[str] | None = None,
+    formatos: dict | None = None,
+    plantilla: PlantillaCompilada | None = None,
+    dependencias_extra: Iterable[str | Path] = (),
+) -> BytesIO | None:
+    """
+    Devuelve el DOCX ya generado para estas entradas, o None si no está en la
+    caché de salidas. Es la misma comprobación con la que empieza
+    `ejecutar_generacion_completa`; sirve para no ocupar un trabajador del
+    pool con peticiones que se resuelven al instante.
+    """
+    orden_clave = orden_hojas if orden_hojas is not None else list(rangos_dinamicos.keys())
+    cached = _cache_salidas.obtener(
+        clave_generacion(workbook_path, orden_clave, formatos, plantilla, dependencias_extra)
+    )
+    return BytesIO(cached) if cached is not None else None
+
+
 def ejecutar_generacion_completa(
-    workbook_path: str, rangos_dinamicos: dict, formatos: dict | None, orden_hojas: list[str] | None = None
+    workbook_path: str | Path | LibroSubido,
+    rangos_dinamicos: dict,
+    formatos: dict | None,
+    orden_hojas: list[str] | None = None,
+    usar_cache: bool = True,
+    id_incremental: str | None = None,
+    plantilla: PlantillaCompilada | None = None,
+    progreso: Progreso | None = None,
+    wb: Workbook | None = None,
+    dependencias_extra: Iterable[str | Path] = (),
 ) -> BytesIO:
     """
-    Encapsula la generación del DOCX final, gestionando la memoria de forma explícita.
+    Encapsula la generación del DOCX final.
     Esta función carga el workbook, genera el documento y luego lo libera.
+    `workbook_path` puede ser una ruta o un `LibroSubido` (sin archivo temporal).
+
+    Si `usar_cache` es True, una petición con las mismas entradas (mismo libro,
+    formatos, plantilla y orden) se responde desde la caché de salidas sin
+    volver a cargar el libro.
+
+    `id_incremental` identifica la serie de versiones de un mismo libro (por
+    ejemplo, su nombre de archivo). Si se indica, y la caché conserva la salida
+    anterior de esa serie, solo se regeneran las hojas que cambiaron.
+
+    `plantilla` permite reutilizar una plantilla ya compilada (p. ej. la que
+    comparten las sesiones de Streamlit); por defecto se lee PLANTILLA_PATH.
+
+    `progreso` recibe el avance por sección (ver `core_secciones.Progreso`);
+    una excepción lanzada desde él interrumpe la generación sin tocar la caché.
+
+    `wb` evita volver a leer el libro si quien llama ya lo cargó (p. ej. para
+    el análisis); debe corresponder a `workbook_path`, que sigue dando la clave.
+
+    `dependencias_extra`: archivos que, además de formatos y plantilla, entran
+    en la clave (ver `_dependencias`).
     """
-    wb = None
-    # Comentario: Se usa un bloque try...finally para garantizar que los objetos
-    # pesados (el workbook) se liberen explícitamente, reduciendo la acumulación
-    # de memoria en ejecuciones sucesivas de Streamlit.
-    try:
-        # Se vuelve a cargar el workbook aquí, pero su ciclo de vida está
-        # estrictamente limitado a esta función.
-        wb = load_workbook(workbook_path, data_only=True)
+    plantilla_efectiva = plantilla if plantilla is not None else PLANTILLA_PATH
+    clave = None
+    orden_clave = orden_hojas if orden_hojas is not None else list(rangos_dinamicos.keys())
+    if usar_cache:
+        clave = clave_generacion(workbook_path, orden_clave, formatos, plantilla, dependencias_extra)
+        cached = _cache_salidas.obtener(clave)
+        if cached is not None:
+            return BytesIO(cached)
 
+    # Salvo que lo pase quien llama, el workbook solo vive dentro de esta
+    # llamada. Para aislar de verdad la memoria de cada generación, usar el
+    # pool de procesos (`scripts.pool_generacion`), que recicla sus trabajadores.
+    if wb is None:
+        wb = cargar_libro(workbook_path)
+
+    if id_incremental is None:
         buf = generar_docx_final_en_memoria(
             wb=wb,
             rangos=rangos_dinamicos,
-            plantilla_path=PLANTILLA_PATH,
+            plantilla_path=plantilla_efectiva,
             orden=orden_hojas, # Usar el orden pasado como parámetro
             formatos=formatos,
+            progreso=progreso,
         )
+        if clave is not None:
+            _cache_salidas.guardar(clave, buf.getvalue())
         return buf
-    finally:
-        # Paso clave: Liberación explícita de memoria
-        if wb:
-            del wb
-            # Se fuerza una recolección de basura para limpiar la memoria de inmediato.
-            gc.collect()
 
+    # --- Modo incremental: partir de la última versión de la serie ---
+    linea = clave_linea(id_incremental, orden_clave, _dependencias(formatos, plantilla, dependencias_extra))
+    resultado = None
+    previa = _cache_salidas.obtener_linea(linea)
+    if previa is not None:
+        resultado = actualizar_docx_final(
+            previa[0], previa[1], wb, rangos_dinamicos, plantilla_efectiva,
+            orden=orden_hojas, formatos=formatos, progreso=progreso,
+        )
+    if resultado is None:
+        resultado = generar_docx_final_con_mapa(
+            wb, rangos_dinamicos, plantilla_efectiva, orden=orden_hojas, formatos=formatos,
+            progreso=progreso,
+        )
+    datos, mapa = resultado
+
+    clave = clave or clave_generacion(workbook_path, orden_clave, formatos, plantilla, dependencias_extra)
+    _cache_salidas.guardar(clave, datos)
+    _cache_salidas.guardar_linea(linea, clave, mapa)
+    return BytesIO(datos)
+
+
+# --- 5. MOTOR COMPARTIDO POR LOS FRONTALES ---
+
+# Análisis de libros que conserva un motor (los más antiguos se olvidan)
+MAX_ANALISIS = 32
+
+
+def _copiar_rangos(rangos: Dict[str, list]) -> Dict[str, list]:
+    """Listas de bloques propias para quien llama (los bloques se comparten)."""
+    return {hoja: list(bloques) for hoja, bloques in rangos.items()}
+
+
+def _estilos_html(config: Instantanea) -> EstilosHTML:
+    from scripts.vista_html import EstilosHTML
+
+    return EstilosHTML(config.plantilla.nuevo_documento())
+
+
+class MotorDictamen:
+    """
+    Sesión de larga vida del motor. Cada frontal (apps de Streamlit, app de
+    escritorio, servicio HTTP, CLIs) crea uno al arrancar y lo usa para todas
+    sus operaciones, en lugar de montar por su cuenta configuración,
+    plantilla, cachés y procesos.
+
+    Reúne:
+    - La configuración: formatos y plantilla compilados, que se recargan en
+      caliente si cambian (`configuracion()`, ver
+      `scripts.registro_configuracion`).
+    - La caché de análisis: bloques descubiertos por (hash del libro, huella
+      de los formatos), con las `max_analisis` más recientes.
+    - La caché de matrices: valores de cada hoja leída, de la que salen
+      todas las lecturas de rangos (ver `scripts.matriz_hoja`).
+    - La caché de salidas: DOCX finales en disco y parcheo incremental (ver
+      `ejecutar_generacion_completa`).
+    - El pool de procesos de generación, si `trabajadores` > 0 (ver
+      `scripts.pool_generacion`). Sin pool, se genera en el hilo que llama.
+
+    Operaciones: `descubrir`, `generar_seccion`, `generar_final` y
+    `vista_previa`. Aceptan `config` para trabajar con una instantánea
+    concreta de la configuración; por defecto usan la vigente.
+
+    Ciclo de vida: las operaciones funcionan desde el primer momento;
+    `iniciar()` adelanta el coste de preparar la configuración, la plantilla
+    y el pool, y `cerrar()` los libera. También es un gestor de contexto.
+    Es seguro usarlo desde varios hilos.
+    """
+
+    def __init__(
+        self,
+        trabajadores: int = 0,
+        max_en_cola: int | None = None,
+        tareas_por_trabajador: int | None = None,
+        registro: RegistroConfiguracion | None = None,
+        max_analisis: int = MAX_ANALISIS,
+    ) -> None:
+        from scripts.registro_configuracion import registro_configuracion
+
+        self.trabajadores = trabajadores
+        self.registro = registro or registro_configuracion()
+        self.max_analisis = max_analisis
+        self._opciones_pool = {
+            clave: valor
+            for clave, valor in (("max_en_cola", max_en_cola), ("tareas_por_trabajador", tareas_por_trabajador))
+            if valor is not None
+        }
+        self._lock = threading.Lock()
+        self._pool: PoolGeneracion | None = None
+        self._analisis: "OrderedDict[Tuple[str, str], Tuple[Dict[str, list], List[str]]]" = OrderedDict()
+        self._aciertos_analisis = 0
+        self._fallos_analisis = 0
+
+    # ----- ciclo de vida -----
+
+    def iniciar(self) -> MotorDictamen:
+        """Carga la configuración, compila la plantilla y arranca el pool (si lo hay)."""
+        config = self.configuracion()
+        try:
+            config.plantilla
+        except FileNotFoundError:
+            # Sin plantilla no hay nada que adelantar; cada generación dará su error
+            pass
+        if self.pool is not None:
+            self.pool.calentar()
+        return self
+
+    def cerrar(self) -> None:
+        """
+        Cierra el pool (esperando a las generaciones en curso) y vacía la caché
+        de análisis. El motor puede seguir usándose: el pool se vuelve a crear.
+        """
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.cerrar()
+        self.limpiar_caches()
+
+    def __enter__(self) -> MotorDictamen:
+        return self.iniciar()
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.cerrar()
+
+    @property
+    def pool(self) -> PoolGeneracion | None:
+        """Pool de generación (se crea al primer uso), o None si el motor no usa procesos."""
+        if self.trabajadores <= 0:
+            return None
+        with self._lock:
+            if self._pool is None:
+                from scripts.pool_generacion import PoolGeneracion
+
+                self._pool = PoolGeneracion(self.trabajadores, **self._opciones_pool)
+            return self._pool
+
+    def hay_trabajador_libre(self) -> bool:
+        """Si una generación nueva empezaría sin esperar en la cola del pool."""
+        pool = self.pool
+        return pool.hay_trabajador_libre() if pool is not None else True
+
+    # ----- operaciones -----
+
+    def configuracion(self) -> Instantanea:
+        """Formatos y plantilla vigentes. Quien necesite ambos debe tomarlos de la misma instantánea."""
+        return self.registro.actual()
+
+    def descubrir(
+        self,
+        origen: str | Path | LibroSubido,
+        rangos_manuales: dict | None = None,
+        wb: Workbook | None = None,
+        progreso: Progreso | None = None,
+        config: Instantanea | None = None,
+    ) -> Tuple[Dict[str, list], List[str]]:
+        """
+        Bloques descubiertos en el libro (ver `discover_and_load_blocks`) y
+        nombres de sus hojas en orden.
+
+        Sin `rangos_manuales`, el resultado se cachea por (hash del libro,
+        huella de los formatos): volver a subir o abrir el mismo libro no lo
+        analiza otra vez. Cada llamada recibe sus propias listas de bloques,
+        que puede editar sin tocar la caché. `wb` evita volver a leer un libro
+        ya cargado; debe corresponder a `origen`.
+        """
+        config = config or self.configuracion()
+        clave = None
+        if not rangos_manuales:
+            clave = (_hash_origen(origen), config.huella_formatos)
+            with self._lock:
+                guardado = self._analisis.get(clave)
+                if guardado is not None:
+                    self._analisis.move_to_end(clave)
+                    self._aciertos_analisis += 1
+                else:
+                    self._fallos_analisis += 1
+            if guardado is not None:
+                return _copiar_rangos(guardado[0]), list(guardado[1])
+
+        libro = wb if wb is not None else cargar_libro(origen)
+        try:
+            rangos = discover_and_load_blocks(libro, rangos_manuales or {}, config.formatos, progreso=progreso)
+            hojas = list(libro.sheetnames)
+        finally:
+            del libro
+
+        if clave is not None:
+            with self._lock:
+                self._analisis[clave] = (rangos, hojas)
+                while len(self._analisis) > self.max_analisis:
+                    self._analisis.popitem(last=False)
+        return _copiar_rangos(rangos), list(hojas)
+
+    def generar_seccion(
+        self,
+        wb: Workbook,
+        hoja: str,
+        bloques: list,
+        destino: str | Path,
+        config: Instantanea | None = None,
+    ) -> None:
+        """Genera el DOCX de una sola hoja en `destino` (escritura atómica)."""
+        config = config or self.configuracion()
+        generar_docx_seccion_a_archivo(
+            wb=wb,
+            sheet_name=hoja,
+            bloques=bloques,
+            plantilla_path=config.plantilla,
+            destino=Path(destino),
+            formatos=config.formatos,
+        )
+
+    def generar_final(
+        self,
+        workbook_path: str | Path | LibroSubido,
+        rangos_dinamicos: dict,
+        orden_hojas: list[str] | None = None,
+        id_incremental: str | None = None,
+        usar_cache: bool = True,
+        wb: Workbook | None = None,
+        dependencias_extra: Iterable[str | Path] = (),
+        config: Instantanea | None = None,
+        progreso: Progreso | None = None,
+        posicion: Callable[[int], None] | None = None,
+    ) -> BytesIO:
+        """
+        Genera el DOCX final con la caché de salidas y el parcheo incremental
+        (ver `ejecutar_generacion_completa`).
+
+        Con pool, se genera en un proceso trabajador y `posicion` recibe el
+        puesto en la cola (ver `PoolGeneracion.generar`); si se pasa un `wb`
+        ya cargado, que no puede enviarse a otro proceso, se genera aquí. Sirve
+        como objetivo de un `TrabajoGeneracion`, también con `en_cola=True`.
+        """
+        config = config or self.configuracion()
+        parametros = dict(
+            workbook_path=workbook_path,
+            rangos_dinamicos=rangos_dinamicos,
+            formatos=config.formatos,
+            orden_hojas=orden_hojas,
+            usar_cache=usar_cache,
+            id_incremental=id_incremental,
+            plantilla=config.plantilla,
+            dependencias_extra=tuple(dependencias_extra),
+        )
+        pool = self.pool if wb is None else None
+        if pool is not None:
+            return pool.generar(progreso=progreso, posicion=posicion, **parametros)
+        return ejecutar_generacion_completa(**parametros, progreso=progreso, wb=wb)
+
+    def vista_previa(
+        self,
+        bloques: Iterable[Dict[str, Any]],
+        wb: Workbook | None = None,
+        sheet_name: str | None = None,
+        config: Instantanea | None = None,
+    ) -> str:
+        """HTML de una sección, para previsualizarla sin generar el DOCX (ver `scripts.vista_html`)."""
+        from scripts.vista_html import render_seccion_html
+
+        config = config or self.configuracion()
+        return render_seccion_html(
+            bloques, config.formatos, config.derivado("estilos_html", _estilos_html), wb=wb, sheet_name=sheet_name
+        )
+
+    # ----- estadísticas -----
+
+    def estadisticas(self) -> Dict[str, Any]:
+        """Estado de la configuración, las cachés y el pool (para registros o diagnóstico)."""
+        config = self.configuracion()
+        with self._lock:
+            analisis = {
+                "entradas": len(self._analisis),
+                "max_entradas": self.max_analisis,
+                "aciertos": self._aciertos_analisis,
+                "fallos": self._fallos_analisis,
+            }
+            pool = self._pool
+        return {
+            "configuracion": {
+                "version": config.version,
+                "formatos": config.huella_formatos,
+                "plantilla": config.huella_plantilla,
+            },
+            "analisis": analisis,
+            "matrices": cache_matrices().estadisticas(),
+            "salidas": _cache_salidas.estadisticas(),
+            "pool": pool.estadisticas() if pool is not None else None,
+        }
+
+    def limpiar_caches(self) -> None:
+        """
+        Vacía la caché de análisis y la de matrices de hojas (ver
+        `scripts.matriz_hoja`) y pone a cero sus contadores. La caché de
+        salidas está en disco y puede compartirse con otros procesos: no se toca.
+        """
+        with self._lock:
+            self._analisis.clear()
+            self._aciertos_analisis = 0
+            self._fallos_analisis = 0
+        cache_matrices().limpiar()
@@ -0,0 +1,252 @@
+from __future__ import annotations
+
+"""
+Regeneración incremental del DOCX final.
+
+Cuando solo cambian algunas hojas, no hace falta recomponer todo el dictamen:
+a partir del paquete anterior y de su mapa de secciones (ver
+`core_secciones.generar_docx_final_con_mapa`) se vuelven a generar únicamente
+las hojas cuya huella cambió y se sustituyen sus rangos dentro de
+`word/document.xml`. El resto de partes del ZIP (estilos, numeración,
+encabezados, imágenes...) se copian byte a byte, sin descomprimir ni volver a
+comprimir.
+
+Si el cambio no se puede aplicar de forma aislada (otro orden de hojas, una
+sección que modificó partes compartidas, numeraciones distintas...), las
+funciones devuelven None y quien llama debe hacer la generación completa.
+"""
+
+import copy
+import io
+import struct
+import zipfile
+import zlib
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Tuple, Union
+
+from scripts.core_secciones import (
+    PlantillaCompilada,
+    Progreso,
+    _componer_documento,
+    huella_seccion,
+    orden_efectivo_hojas,
+)
+
+if TYPE_CHECKING:
+    from openpyxl.workbook.workbook import Workbook
+
+PARTE_DOCUMENTO = "word/document.xml"
+
+# Formatos de registro ZIP (mismos que usa el módulo zipfile)
+_FMT_CABECERA_LOCAL = "<4s2B4HL2L2H"
+_FMT_DIRECTORIO_CENTRAL = "<4s4B4HL2L5H2L"
+_FMT_FIN_DIRECTORIO = "<4s4H2LH"
+_TAM_CABECERA_LOCAL = struct.calcsize(_FMT_CABECERA_LOCAL)
+_FLAG_DESCRIPTOR_DATOS = 0x08
+_FLAG_UTF8 = 0x800
+_LIMITE_ZIP32 = 0xFFFFFFFF
+
+
+# ------------------------
+# ZIP: copia cruda de partes
+# ------------------------
+
+def _fecha_dos(date_time: Tuple[int, ...]) -> Tuple[int, int]:
+    dosdate = (date_time[0] - 1980) << 9 | date_time[1] << 5 | date_time[2]
+    dostime = date_time[3] << 11 | date_time[4] << 5 | (date_time[5] // 2)
+    return dostime, dosdate
+
+
+def _nombre_codificado(info: zipfile.ZipInfo) -> bytes:
+    if info.flag_bits & _FLAG_UTF8:
+        return info.filename.encode("utf-8")
+    return info.filename.encode("ascii")
+
+
+def _comprimir(info: zipfile.ZipInfo, contenido: bytes) -> bytes:
+    if info.compress_type == zipfile.ZIP_STORED:
+        return contenido
+    if info.compress_type == zipfile.ZIP_DEFLATED:
+        compresor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        return compresor.compress(contenido) + compresor.flush()
+    raise ValueError(f"Método de compresión no soportado: {info.compress_type}")
+
+
+def reemplazar_parte_zip(paquete: bytes, nombre_parte: str, contenido: bytes) -> bytes:
+    """
+    Devuelve una copia de `paquete` en la que solo cambia `nombre_parte`.
+
+    Las demás entradas se copian tal cual (cabecera local + datos comprimidos),
+    respetando orden, fechas y atributos del original. Solo se comprime de nuevo
+    la parte sustituida.
+    """
+    vista = memoryview(paquete)
+    with zipfile.ZipFile(io.BytesIO(paquete)) as zf:
+        infos = zf.infolist()
+
+    if nombre_parte not in {i.filename for i in infos}:
+        raise KeyError(f"El paquete no contiene la parte '{nombre_parte}'.")
+
+    salida = io.BytesIO()
+    registros: List[Tuple[zipfile.ZipInfo, int, int, int, int]] = []
+
+    for info in infos:
+        if info.flag_bits & _FLAG_DESCRIPTOR_DATOS:
+            raise ValueError("Paquetes con descriptor de datos no soportados.")
+
+        cabecera = struct.unpack(
+            _FMT_CABECERA_LOCAL,
+            vista[info.header_offset:info.header_offset + _TAM_CABECERA_LOCAL],
+        )
+        len_nombre, len_extra = cabecera[10], cabecera[11]
+        inicio_datos = info.header_offset + _TAM_CABECERA_LOCAL + len_nombre + len_extra
+        desplazamiento = salida.tell()
+
+        if info.filename == nombre_parte:
+            crudo = _comprimir(info, contenido)
+            crc, tam_comp, tam = zlib.crc32(contenido), len(crudo), len(contenido)
+            if max(tam_comp, tam, desplazamiento) > _LIMITE_ZIP32:
+                raise ValueError("Paquetes ZIP64 no soportados.")
+            salida.write(struct.pack(
+                _FMT_CABECERA_LOCAL, *cabecera[:7], crc, tam_comp, tam, len_nombre, len_extra
+            ))
+            salida.write(vista[info.header_offset + _TAM_CABECERA_LOCAL:inicio_datos])
+            salida.write(crudo)
+        else:
+            crc, tam_comp, tam = info.CRC, info.compress_size, info.file_size
+            salida.write(vista[info.header_offset:inicio_datos + tam_comp])
+
+        registros.append((info, crc, tam_comp, tam, desplazamiento))
+
+    inicio_central = salida.tell()
+    for info, crc, tam_comp, tam, desplazamiento in registros:
+        dostime, dosdate = _fecha_dos(info.date_time)
+        nombre = _nombre_codificado(info)
+        salida.write(struct.pack(
+            _FMT_DIRECTORIO_CENTRAL, b"PK\x01\x02",
+            info.create_version, info.create_system, info.extract_version, info.reserved,
+            info.flag_bits, info.compress_type, dostime, dosdate,
+            crc, tam_comp, tam,
+            len(nombre), len(info.extra), len(info.comment),
+            0, info.internal_attr, info.external_attr, desplazamiento,
+        ))
+        salida.write(nombre + info.extra + info.comment)
+    tam_central = salida.tell() - inicio_central
+
+    salida.write(struct.pack(
+        _FMT_FIN_DIRECTORIO, b"PK\x05\x06", 0, 0,
+        len(registros), len(registros), tam_central, inicio_central, 0,
+    ))
+    return salida.getvalue()
+
+
+# ------------------------
+# Sustitución de secciones
+# ------------------------
+
+def _remapear_numeracion(elementos: Iterable[Any], equivalencias: Dict[str, str]) -> None:
+    """Cambia los numId de las instancias creadas en el parche por las del paquete anterior."""
+    if not equivalencias:
+        return
+    from docx.oxml.ns import qn
+
+    for elemento in elementos:
+        for num_id in elemento.iter(qn("w:numId")):
+            val = num_id.get(qn("w:val"))
+            if val in equivalencias:
+                num_id.set(qn("w:val"), equivalencias[val])
+
+
+def actualizar_docx_final(
+    previo: bytes,
+    mapa_previo: Dict[str, Any],
+    wb: Workbook,
+    rangos: Dict[str, List[Dict[str, str]]],
+    plantilla_path: Union[Path, PlantillaCompilada],
+    orden: Iterable[str] | None = None,
+    formatos: Dict[str, Any] | None = None,
+    progreso: Progreso | None = None,
+) -> Tuple[bytes, Dict[str, Any]] | None:
+    """
+    Regenera solo las hojas que cambiaron respecto a `previo`.
+
+    Devuelve (bytes, mapa) con el mismo contenido que daría una generación
+    completa, o None si el parcheo no es aplicable. `progreso` cuenta solo
+    las hojas que se regeneran.
+    """
+    from docx.opc.oxml import serialize_part_xml
+    from docx.oxml import parse_xml
+    from docx.oxml.ns import qn
+
+    orden_efectivo = orden_efectivo_hojas(wb, rangos, orden)
+    if mapa_previo.get("orden") != orden_efectivo:
+        return None
+
+    hojas = [h for h in orden_efectivo if rangos.get(h)]
+    secciones_previas: List[Dict[str, Any]] = mapa_previo.get("secciones", [])
+    if [s["hoja"] for s in secciones_previas] != hojas:
+        return None
+
+    huellas = {h: huella_seccion(wb, h, rangos[h], formatos) for h in hojas}
+    cambiadas = [s for s in secciones_previas if s["huella"] != huellas[s["hoja"]]]
+    if not cambiadas:
+        return previo, mapa_previo
+    if not all(s["autocontenida"] for s in cambiadas):
+        return None
+
+    doc_parche, mapa_parche = _componer_documento(
+        wb, rangos, plantilla_path, orden=orden, formatos=formatos,
+        solo=[s["hoja"] for s in cambiadas], registrar_mapa=True, progreso=progreso,
+    )
+    nuevas = {s["hoja"]: s for s in mapa_parche["secciones"]}
+
+    with zipfile.ZipFile(io.BytesIO(previo)) as zf:
+        if PARTE_DOCUMENTO not in zf.namelist():
+            return None
+        raiz = parse_xml(zf.read(PARTE_DOCUMENTO))
+    body = raiz.find(qn("w:body"))
+    body_parche = doc_parche.element.body
+
+    if body is None or len(body) - 1 != secciones_previas[-1]["fin"]:
+        # El cuerpo no corresponde al mapa (o falta el sectPr final)
+        return None
+
+    # Sustituir de atrás hacia delante para no desplazar los rangos pendientes
+    for previa in sorted(cambiadas, key=lambda s: s["inicio"], reverse=True):
+        nueva = nuevas[previa["hoja"]]
+        firmas_previas = [firma for _, firma in previa["nums"]]
+        firmas_nuevas = [firma for _, firma in nueva["nums"]]
+        if not nueva["autocontenida"] or firmas_nuevas != firmas_previas:
+            return None
+
+        fragmento = [copy.deepcopy(el) for el in body_parche[nueva["inicio"]:nueva["fin"]]]
+        _remapear_numeracion(
+            fragmento,
+            {n_id: p_id for (n_id, _), (p_id, _) in zip(nueva["nums"], previa["nums"])},
+        )
+
+        for el in list(body[previa["inicio"]:previa["fin"]]):
+            body.remove(el)
+        for desplazamiento, el in enumerate(fragmento):
+            body.insert(previa["inicio"] + desplazamiento, el)
+
+    # Recalcular los rangos del mapa con los nuevos tamaños
+    secciones: List[Dict[str, Any]] = []
+    cursor = secciones_previas[0]["inicio"]
+    for previa in secciones_previas:
+        origen = nuevas.get(previa["hoja"], previa)
+        largo = origen["fin"] - origen["inicio"]
+        secciones.append({
+            **previa,
+            "huella": huellas[previa["hoja"]],
+            "inicio": cursor,
+            "fin": cursor + largo,
+        })
+        cursor += largo
+
+    try:
+        datos = reemplazar_parte_zip(previo, PARTE_DOCUMENTO, serialize_part_xml(raiz))
+    except ValueError:
+        # ZIP con características que la copia cruda no contempla
+        return None
+    return datos, {"orden": orden_efectivo, "secciones": secciones}
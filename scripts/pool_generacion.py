@@ -0,0 +1,374 @@
+from __future__ import annotations
+
+"""
+Pool de procesos compartido por todo el servidor para generar dictámenes.
+
+Cuando varios usuarios generan a la vez, cada generación (workbook de openpyxl
++ documento de python-docx) ocupa cientos de MB en el mismo intérprete y el
+servidor acaba muriendo por falta de memoria. `PoolGeneracion`:
+
+- Limita la concurrencia a `max_trabajadores` procesos.
+- Mantiene una cola propia de como mucho `max_en_cola` peticiones, con la
+  posición de cada una para mostrarla al usuario.
+- Rechaza las peticiones que no caben (`ColaLlena`) en lugar de aceptarlas
+  todas y quedarse sin memoria.
+- Aísla la memoria de cada generación en un proceso trabajador que se recicla
+  tras `tareas_por_trabajador` trabajos (`max_tasks_per_child`), de modo que
+  la memoria que no devuelve el intérprete se libera al terminar el proceso.
+- Si un trabajador muere (sin memoria, SIGKILL...), `ProcessPoolExecutor`
+  falla todas las peticiones en curso en ese ejecutor (no se sabe cuál lo
+  provocó); las de la cola pasan a un ejecutor nuevo.
+
+El avance por sección llega desde los trabajadores por una cola común del
+pool; un hilo del proceso principal lo reparte a cada petición.
+
+Donde existe (Linux, macOS), los trabajadores se crean con "forkserver": un
+proceso servidor importa una vez las librerías y compila la plantilla
+(`scripts.precarga_trabajadores`) y cada trabajador es una copia suya que
+empieza en caliente. `calentar()` arranca ese servidor por adelantado.
+"""
+
+import importlib
+import itertools
+import multiprocessing
+import signal
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from multiprocessing.context import BaseContext
+from typing import Any, Callable, Deque, Dict
+
+from scripts.core_secciones import Progreso
+from scripts.trabajos import GeneracionCancelada
+
+# Valores por defecto para un servidor pequeño
+MAX_TRABAJADORES = 2
+MAX_EN_COLA = 8
+TAREAS_POR_TRABAJADOR = 20
+
+# "fork" no sirve (max_tasks_per_child no lo admite); "spawn" donde no hay forkserver (Windows)
+CONTEXTO_PREDETERMINADO = (
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+# Módulo que deja listo un proceso trabajador (librerías + plantilla compilada)
+MODULO_PRECARGA = "scripts.precarga_trabajadores"
+
+# Cola de avance del proceso trabajador (la recibe en `_inicializar_trabajador`)
+_cola_avance_trabajador = None
+
+
+class ColaLlena(RuntimeError):
+    """No caben más peticiones en el pool; conviene reintentar más tarde."""
+
+
+# ------------------------
+# Lado del proceso trabajador
+# ------------------------
+
+def contexto_trabajadores(metodo: str = CONTEXTO_PREDETERMINADO) -> BaseContext:
+    """
+    Contexto de multiprocessing para trabajadores de generación. Con
+    "forkserver", el servidor precarga `MODULO_PRECARGA` (solo tiene efecto si
+    aún no se ha arrancado en este proceso).
+    """
+    contexto = multiprocessing.get_context(metodo)
+    if metodo == "forkserver":
+        contexto.set_forkserver_preload([MODULO_PRECARGA])
+    return contexto
+
+
+def precargar_trabajador() -> None:
+    """Inicializador de un trabajador: ignora Ctrl+C y carga `MODULO_PRECARGA`."""
+    # Ctrl+C lo gestiona el proceso principal, que cierra el pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Con forkserver ya viene importado del servidor; con spawn se carga aquí
+    importlib.import_module(MODULO_PRECARGA)
+
+
+def _inicializar_trabajador(cola_avance: Any) -> None:
+    global _cola_avance_trabajador
+    _cola_avance_trabajador = cola_avance
+    precargar_trabajador()
+
+
+def _generar_en_trabajador(id_peticion: int, parametros: Dict[str, Any]) -> bytes:
+    from scripts.motor_automatizacion import ejecutar_generacion_completa
+
+    def progreso(completadas: int, total: int, hoja: str) -> None:
+        _cola_avance_trabajador.put((id_peticion, completadas, total, hoja))
+
+    buf = ejecutar_generacion_completa(**parametros, progreso=progreso)
+    return buf.getvalue()
+
+
+# ------------------------
+# Lado del proceso principal
+# ------------------------
+
+class _Peticion:
+    def __init__(self, id_peticion: int, parametros: Dict[str, Any], progreso: Progreso | None) -> None:
+        self.id = id_peticion
+        self.parametros = parametros
+        self.progreso = progreso
+        self.futuro: Future = Future()
+        self.cancelada = False
+        # Ejecutor al que se envió (para saber si su rotura ya se atendió)
+        self.ejecutor: ProcessPoolExecutor | None = None
+
+
+class PoolGeneracion:
+    """
+    Pool de procesos con cola acotada para `ejecutar_generacion_completa`.
+
+    Crear el pool no arranca procesos: el ejecutor se crea con la primera
+    petición. Es seguro usarlo desde varios hilos (una sesión de Streamlit
+    por hilo).
+    """
+
+    def __init__(
+        self,
+        max_trabajadores: int = MAX_TRABAJADORES,
+        max_en_cola: int = MAX_EN_COLA,
+        tareas_por_trabajador: int = TAREAS_POR_TRABAJADOR,
+        contexto: str = CONTEXTO_PREDETERMINADO,
+    ) -> None:
+        self.max_trabajadores = max_trabajadores
+        self.max_en_cola = max_en_cola
+        self.tareas_por_trabajador = tareas_por_trabajador
+        self._contexto = contexto_trabajadores(contexto)
+        # Reentrante: si un trabajo ya terminó (p. ej. el ejecutor se rompió)
+        # al registrar su callback en `_despachar`, `_al_terminar` se ejecuta
+        # en el mismo hilo, con el lock tomado
+        self._lock = threading.RLock()
+        self._pendientes: Deque[_Peticion] = deque()
+        self._en_ejecucion: Dict[int, _Peticion] = {}
+        self._ids = itertools.count(1)
+        self._ejecutor: ProcessPoolExecutor | None = None
+        self._cola_avance = None
+        self._hilo_avance: threading.Thread | None = None
+
+    # ----- API pública -----
+
+    def enviar(self, progreso: Progreso | None = None, **parametros: Any) -> "Future[bytes]":
+        """
+        Encola una generación y devuelve un Future con los bytes del DOCX.
+
+        `parametros` son los de `ejecutar_generacion_completa` (sin `progreso`)
+        y deben poder enviarse a otro proceso. Lanza `ColaLlena` si no cabe.
+        """
+        with self._lock:
+            if len(self._pendientes) + len(self._en_ejecucion) >= self.max_trabajadores + self.max_en_cola:
+                raise ColaLlena(
+                    f"Servidor ocupado: hay {len(self._pendientes)} generaciones en cola. "
+                    "Inténtalo de nuevo en unos minutos."
+                )
+            peticion = _Peticion(next(self._ids), parametros, progreso)
+            self._pendientes.append(peticion)
+            self._despachar()
+        return peticion.futuro
+
+    def posicion(self, futuro: Future) -> int:
+        """0 si la petición ya se está ejecutando (o terminó); si no, su puesto en la cola (1 = la siguiente)."""
+        with self._lock:
+            for i, peticion in enumerate(self._pendientes, 1):
+                if peticion.futuro is futuro:
+                    return i
+        return 0
+
+    def cancelar(self, futuro: Future) -> None:
+        """
+        Cancela una petición. Si aún estaba en cola se retira; si ya se está
+        ejecutando, el trabajador termina pero su resultado se descarta.
+        """
+        with self._lock:
+            for peticion in list(self._pendientes):
+                if peticion.futuro is futuro:
+                    self._pendientes.remove(peticion)
+                    peticion.futuro.set_exception(GeneracionCancelada())
+                    return
+            for peticion in self._en_ejecucion.values():
+                if peticion.futuro is futuro:
+                    peticion.cancelada = True
+
+    def generar(
+        self,
+        progreso: Progreso | None = None,
+        posicion: Callable[[int], None] | None = None,
+        **parametros: Any,
+    ) -> BytesIO:
+        """
+        Versión bloqueante de `enviar`, con la misma firma que
+        `ejecutar_generacion_completa`: sirve como objetivo de un
+        `TrabajoGeneracion` (que ejecuta en su propio hilo).
+
+        `posicion` recibe el puesto en la cola (0 = ya en ejecución) cada
+        medio segundo mientras se espera. Si `progreso` o `posicion` lanzan una
+        excepción (p. ej. `GeneracionCancelada`), la petición se cancela y la
+        excepción se propaga.
+        """
+        from scripts.motor_automatizacion import buscar_en_cache
+
+        # Los aciertos de caché no ocupan un trabajador
+        if parametros.get("usar_cache", True):
+            cached = buscar_en_cache(
+                parametros["workbook_path"],
+                parametros["rangos_dinamicos"],
+                parametros.get("orden_hojas"),
+                parametros.get("formatos"),
+                parametros.get("plantilla"),
+                parametros.get("dependencias_extra", ()),
+            )
+            if cached is not None:
+                return cached
+
+        # El avance llega por el hilo de avance: sus excepciones se guardan y
+        # se relanzan en este hilo
+        errores: list[BaseException] = []
+
+        def reenviar(completadas: int, total: int, hoja: str) -> None:
+            if progreso is None or errores:
+                return
+            try:
+                progreso(completadas, total, hoja)
+            except BaseException as exc:
+                errores.append(exc)
+
+        futuro = self.enviar(progreso=reenviar, **parametros)
+        while not errores:
+            try:
+                return BytesIO(futuro.result(timeout=0.5))
+            except TimeoutError:
+                pass
+            if posicion is not None:
+                try:
+                    posicion(self.posicion(futuro))
+                except BaseException as exc:
+                    errores.append(exc)
+
+        self.cancelar(futuro)
+        raise errores[0]
+
+    def calentar(self) -> None:
+        """
+        Arranca ya el proceso forkserver (que importa las librerías y compila la
+        plantilla) para que la primera petición no espere por ello. Con "spawn"
+        no hace nada: cada trabajador se precarga al arrancar.
+        """
+        if self._contexto.get_start_method() == "forkserver":
+            from multiprocessing import forkserver
+
+            forkserver.ensure_running()
+
+    def hay_trabajador_libre(self) -> bool:
+        """Si una petición nueva empezaría sin esperar (útil para no especular con el pool ocupado)."""
+        with self._lock:
+            return not self._pendientes and len(self._en_ejecucion) < self.max_trabajadores
+
+    def estadisticas(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "en_cola": len(self._pendientes),
+                "en_ejecucion": len(self._en_ejecucion),
+                "capacidad": self.max_trabajadores + self.max_en_cola,
+            }
+
+    def cerrar(self) -> None:
+        """
+        Cancela la cola y espera a los trabajos en curso. El pool puede volver
+        a usarse: la siguiente petición crea otro ejecutor y otro hilo de avance.
+        """
+        with self._lock:
+            while self._pendientes:
+                self._pendientes.popleft().futuro.set_exception(GeneracionCancelada())
+            ejecutor, self._ejecutor = self._ejecutor, None
+        if ejecutor is not None:
+            ejecutor.shutdown(wait=True)
+        with self._lock:
+            cola, self._cola_avance = self._cola_avance, None
+            hilo, self._hilo_avance = self._hilo_avance, None
+        if cola is not None:
+            # El avance pendiente se reparte antes de la marca de fin
+            cola.put(None)
+            if hilo is not threading.current_thread():
+                hilo.join()
+
+    # ----- internos -----
+
+    def _asegurar_ejecutor(self) -> ProcessPoolExecutor:
+        if self._ejecutor is None:
+            if self._cola_avance is None:
+                self._cola_avance = self._contexto.SimpleQueue()
+                self._hilo_avance = threading.Thread(
+                    target=self._repartir_avance, args=(self._cola_avance,),
+                    name="pool-generacion-avance", daemon=True,
+                )
+                self._hilo_avance.start()
+            self._ejecutor = ProcessPoolExecutor(
+                max_workers=self.max_trabajadores,
+                mp_context=self._contexto,
+                initializer=_inicializar_trabajador,
+                initargs=(self._cola_avance,),
+                max_tasks_per_child=self.tareas_por_trabajador,
+            )
+        return self._ejecutor
+
+    def _descartar_ejecutor(self) -> None:
+        """
+        Suelta el ejecutor actual (con el lock tomado). Tras morir un
+        trabajador, `ProcessPoolExecutor` ya no acepta trabajos: el siguiente
+        `_asegurar_ejecutor` crea otro.
+        """
+        ejecutor, self._ejecutor = self._ejecutor, None
+        if ejecutor is not None:
+            ejecutor.shutdown(wait=False)
+
+    def _enviar_a_trabajador(self, peticion: _Peticion) -> Future:
+        try:
+            futuro = self._asegurar_ejecutor().submit(_generar_en_trabajador, peticion.id, peticion.parametros)
+        except BrokenProcessPool:
+            # Se rompió antes de recibir la petición: se reintenta con uno nuevo
+            self._descartar_ejecutor()
+            futuro = self._asegurar_ejecutor().submit(_generar_en_trabajador, peticion.id, peticion.parametros)
+        peticion.ejecutor = self._ejecutor
+        return futuro
+
+    def _despachar(self) -> None:
+        """Pasa peticiones de la cola a los trabajadores libres (con el lock tomado)."""
+        while self._pendientes and len(self._en_ejecucion) < self.max_trabajadores:
+            peticion = self._pendientes.popleft()
+            try:
+                futuro = self._enviar_a_trabajador(peticion)
+            except Exception as exc:
+                # No llegó a ningún trabajador: falla solo esta petición y se sigue con la cola
+                peticion.futuro.set_exception(exc)
+                continue
+            self._en_ejecucion[peticion.id] = peticion
+            futuro.add_done_callback(lambda f, p=peticion: self._al_terminar(p, f))
+
+    def _al_terminar(self, peticion: _Peticion, futuro: Future) -> None:
+        with self._lock:
+            self._en_ejecucion.pop(peticion.id, None)
+            if isinstance(futuro.exception(), BrokenProcessPool) and peticion.ejecutor is self._ejecutor:
+                # Murió un trabajador: fallan todas las peticiones en curso en
+                # este ejecutor; las de la cola van a uno nuevo
+                self._descartar_ejecutor()
+            self._despachar()
+        if peticion.cancelada:
+            peticion.futuro.set_exception(GeneracionCancelada())
+        elif futuro.exception() is not None:
+            peticion.futuro.set_exception(futuro.exception())
+        else:
+            peticion.futuro.set_result(futuro.result())
+
+    def _repartir_avance(self, cola: Any) -> None:
+        while True:
+            mensaje = cola.get()
+            if mensaje is None:
+                return
+            id_peticion, completadas, total, hoja = mensaje
+            with self._lock:
+                peticion = self._en_ejecucion.get(id_peticion)
+            if peticion is not None and peticion.progreso is not None:
+                peticion.progreso(completadas, total, hoja)
@@ -0,0 +1,43 @@
+"""
+Precarga de los procesos trabajadores de generación.
+
+`PoolGeneracion` importa este módulo en el proceso "forkserver" (ver
+`multiprocessing.set_forkserver_preload`): allí se importan una sola vez
+pandas, NumPy, openpyxl, python-docx, lxml, docxcompose y el motor (también
+los módulos que este importa de forma perezosa), y se compila la plantilla. Cada trabajador nace como copia (fork) de ese proceso, así que
+empieza con todo cargado y su primer trabajo no paga ese arranque.
+
+Con otros métodos de arranque ("spawn") el inicializador del pool lo importa
+en cada trabajador: el coste se paga una vez por trabajador, no por trabajo.
+"""
+
+from scripts.core_secciones import plantilla_compilada
+from scripts.motor_automatizacion import PLANTILLA_PATH
+
+# Dependencias pesadas que el motor carga de forma perezosa (ver
+# scripts/carga_diferida.py). Este módulo solo lo cargan los trabajadores, así
+# que no cuenta para el presupuesto de arranque de scripts/medir_arranque.py.
+import docx  # noqa: F401
+import docxcompose.composer  # noqa: F401
+import lxml.etree  # noqa: F401
+import numpy  # noqa: F401
+import openpyxl  # noqa: F401
+import openpyxl.reader.excel  # noqa: F401
+import openpyxl.worksheet._reader  # noqa: F401
+import pandas  # noqa: F401
+
+import scripts.formatos_compilados  # noqa: F401
+import scripts.libro_diferido  # noqa: F401
+import scripts.procesador_bloques  # noqa: F401
+
+
+def precargar() -> None:
+    """Compila la plantilla en este proceso (queda en la caché de `plantilla_compilada`)."""
+    try:
+        plantilla_compilada(PLANTILLA_PATH)
+    except OSError:
+        # Sin plantilla no hay nada que adelantar; el trabajo fallará con su propio error
+        pass
+
+
+precargar()
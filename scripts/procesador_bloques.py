@@ -2,36 +2,30 @@ from __future__ import annotations
 
 import copy
 from pathlib import Path
-from typing import Any, Dict, Iterable, List
-
-import pandas as pd
-from openpyxl.workbook.workbook import Workbook
-from docx import Document
-from docx.document import Document as DocumentType
-from docx.enum.text import WD_ALIGN_PARAGRAPH
-from docx.shared import Cm, Pt
-
-
-def _get_paragraph_alignment(name: str | None) -> int | None:
-    if not name:
-        return None
-    name = name.lower()
-    if name == "left":
-        return WD_ALIGN_PARAGRAPH.LEFT
-    if name == "right":
-        return WD_ALIGN_PARAGRAPH.RIGHT
-    if name == "center":
-        return WD_ALIGN_PARAGRAPH.CENTER
-    if name == "justify":
-        return WD_ALIGN_PARAGRAPH.JUSTIFY
-    return None
-
-
-def _leer_rango_celdas(wb: Workbook, sheet_name: str, rango: str):
-    if sheet_name not in wb.sheetnames:
-        raise KeyError(f"La hoja '{sheet_name}' no existe en el libro de Excel.")
-    hoja = wb[sheet_name]
-    return hoja[rango]
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List
+
+from docx.shared import Pt
+
+from scripts.carga_diferida import es_dataframe, es_nulo
+from scripts.formatos_compilados import (
+    MANEJADOR_NUM_NOTAS,
+    MANEJADOR_TABLA,
+    MANEJADOR_TEXTO,
+    MANEJADOR_TITULO,
+    MANEJADOR_VINETAS,
+    FormatoTipo,
+    formato_tipo,
+)
+from scripts.matriz_hoja import leer_valores_rango
+
+if TYPE_CHECKING:
+    from openpyxl.workbook.workbook import Workbook
+    from docx.document import Document as DocumentType
+
+
+def _leer_rango(wb: Workbook, sheet_name: str, rango: str) -> List[List[Any]]:
+    """Valores del rango, fila a fila (corte de la matriz de la hoja, ver `scripts.matriz_hoja`)."""
+    return leer_valores_rango(wb, sheet_name, rango)
 
 
 def procesar_bloque_por_tipo(
@@ -44,18 +38,16 @@ def procesar_bloque_por_tipo(
 ) -> None:
     """
     Aplica el procesamiento adecuado según bloque["tipo"], usando
-    la configuración declarativa en formatos["tipos"].
+    la configuración declarativa en formatos["tipos"] (compilada, ver
+    `scripts.formatos_compilados`).
     Maneja bloques con 'rango' (legacy) y con 'contenido' (automático).
     """
     tipo = bloque.get("tipo", "").strip()
     if not tipo:
         return
 
-    # Extraer configuración de formato para este tipo de bloque
-    config_tipo: Dict[str, Any] = {}
-    if formatos is not None:
-        tipos_cfg = formatos.get("tipos", {}) or {}
-        config_tipo = tipos_cfg.get(tipo, {}) or {}
+    # Configuración de formato ya resuelta para este tipo de bloque
+    formato = formato_tipo(formatos, tipo)
 
     # --- Lógica de bifurcación: por contenido directo o por rango ---
     contenido_directo = bloque.get("contenido")
@@ -63,148 +55,127 @@ def procesar_bloque_por_tipo(
 
     if contenido_directo is not None:
         # --- NUEVO: Procesar bloque con contenido directo ---
-        if tipo.startswith("tabla_"):
-            if isinstance(contenido_directo, pd.DataFrame):
+        if formato.es_tabla:
+            if es_dataframe(contenido_directo):
                 df_rows = contenido_directo.values.tolist()
-                _procesar_tabla_directo(doc, df_rows, config_tipo, model_tables_cache)
+                _procesar_tabla_directo(doc, df_rows, formato, model_tables_cache)
             else:
                 print(f"WARN: Bloque tipo tabla '{tipo}' no contiene un DataFrame. Se ignora.")
         else: # Tratar como cualquier tipo de texto
             texto = str(contenido_directo)
-            _procesar_texto_directo(doc, texto, config_tipo)
+            _procesar_texto_directo(doc, texto, formato)
     elif rango:
         # --- LEGACY: Procesar bloque con rango ---
-        if tipo.startswith("tabla_"):
-            excel_rows = [[c.value for c in row] for row in _leer_rango_celdas(wb, sheet_name, rango)]
-            _procesar_tabla_directo(doc, excel_rows, config_tipo, model_tables_cache)
-        elif tipo.startswith("texto_sangria"):
-            _procesar_texto_rango(wb, sheet_name, rango, doc, config_tipo)
-        elif tipo.startswith("viñetas") or tipo.startswith("vinyetas"):
-            _procesar_viñetas_rango(wb, sheet_name, rango, doc, config_tipo)
-        elif tipo.startswith("titulo_"):
-            _procesar_titulo_rango(wb, sheet_name, rango, doc, config_tipo)
-        elif tipo == "num_notas":
-            _procesar_numero_nota_rango(wb, sheet_name, rango, doc, config_tipo)
-        else: # Fallback: texto normal
-            _procesar_texto_rango(wb, sheet_name, rango, doc, config_tipo)
+        if formato.manejador == MANEJADOR_TABLA:
+            excel_rows = _leer_rango(wb, sheet_name, rango)
+            _procesar_tabla_directo(doc, excel_rows, formato, model_tables_cache)
+        else:
+            _MANEJADORES_RANGO[formato.manejador](wb, sheet_name, rango, doc, formato)
     else:
         # El bloque no tiene ni 'contenido' ni 'rango', no se puede procesar.
         return
 
 
-def _aplicar_parrafo_config(p, config: Dict[str, Any]) -> None:
-    style_name = config.get("style")
-    if style_name:
-        candidates = [s.strip() for s in str(style_name).split(",") if s.strip()]
-        for candidate in candidates:
-            try:
-                p.style = candidate
-                break
-            except Exception:
-                continue
-
-    align_name = config.get("align")
-    align_val = _get_paragraph_alignment(align_name)
-    if align_val is not None:
-        p.alignment = align_val
-
-    first_line_indent = config.get("first_line_indent")
-    if isinstance(first_line_indent, (int, float)):
+def _aplicar_parrafo_config(p, formato: FormatoTipo) -> None:
+    for candidate in formato.estilos:
         try:
-            p.paragraph_format.first_line_indent = Cm(float(first_line_indent))
+            p.style = candidate
+            break
         except Exception:
-            pass
+            continue
+
+    if formato.alineacion is not None:
+        p.alignment = formato.alineacion
+
+    if formato.sangria_primera_linea is not None:
+        p.paragraph_format.first_line_indent = formato.sangria_primera_linea
 
 # --- NUEVAS funciones para procesar contenido directo ---
 
-def _procesar_texto_directo(doc: DocumentType, texto: str, config_tipo: Dict[str, Any]) -> None:
+def _procesar_texto_directo(doc: DocumentType, texto: str, formato: FormatoTipo) -> None:
     """Procesa un bloque de texto simple a partir de un string de contenido."""
     if not texto.strip():
         # Si el contenido es solo espacios en blanco, podría ser intencional
         p = doc.add_paragraph()
-        _aplicar_parrafo_config(p, config_tipo)
+        _aplicar_parrafo_config(p, formato)
         return
 
     # Tratar saltos de línea en el contenido como párrafos separados
     for line in texto.split('\n'):
         p = doc.add_paragraph(line)
-        _aplicar_parrafo_config(p, config_tipo)
+        _aplicar_parrafo_config(p, formato)
 
 
 def _procesar_tabla_directo(
     doc: DocumentType,
     filas_datos: List[List[Any]],
-    config_tipo: Dict[str, Any],
+    formato: FormatoTipo,
     model_tables_cache: Dict[str, Any] | None = None,
 ) -> None:
     """Procesa un bloque de tabla a partir de una lista de listas de datos."""
-    table_model_id = config_tipo.get("table_model_id")
+    table_model_id = formato.modelo_tabla
     if table_model_id and model_tables_cache and table_model_id in model_tables_cache:
         model_data = model_tables_cache[table_model_id]
-        _crear_tabla_clonada(doc, model_data["xml"], model_data["widths"], filas_datos, config_tipo)
+        _crear_tabla_clonada(doc, model_data["xml"], model_data["widths"], filas_datos, formato)
     else:
         # Fallback a un método simple si no hay modelo de tabla
-        _crear_tabla_desde_datos(doc, filas_datos, config_tipo)
+        _crear_tabla_desde_datos(doc, filas_datos, formato)
 
 
 # --- Funciones LEGACY adaptadas (renombradas a _*_rango) ---
 
 def _procesar_texto_rango(
-    wb: Workbook, sheet_name: str, rango: str, doc: DocumentType, config_tipo: Dict[str, Any]
+    wb: Workbook, sheet_name: str, rango: str, doc: DocumentType, formato: FormatoTipo
 ) -> None:
-    celdas = _leer_rango_celdas(wb, sheet_name, rango)
-    for row in celdas:
-        valores = [c.value for c in row]
+    for valores in _leer_rango(wb, sheet_name, rango):
         if all(v is None for v in valores):
             p = doc.add_paragraph()
-            _aplicar_parrafo_config(p, config_tipo)
+            _aplicar_parrafo_config(p, formato)
             continue
         texto = " ".join(str(v) for v in valores if v not in (None, ""))
         if not texto.strip():
             continue
         p = doc.add_paragraph(texto)
-        _aplicar_parrafo_config(p, config_tipo)
+        _aplicar_parrafo_config(p, formato)
 
 
 def _procesar_viñetas_rango(
-    wb: Workbook, sheet_name: str, rango: str, doc: DocumentType, config_tipo: Dict[str, Any]
+    wb: Workbook, sheet_name: str, rango: str, doc: DocumentType, formato: FormatoTipo
 ) -> None:
-    celdas = _leer_rango_celdas(wb, sheet_name, rango)
-    for row in celdas:
-        valores = [c.value for c in row]
+    for valores in _leer_rango(wb, sheet_name, rango):
         texto = " ".join(str(v) for v in valores if v not in (None, ""))
         if not texto.strip(): continue
         p = doc.add_paragraph(texto)
-        _aplicar_parrafo_config(p, config_tipo)
+        _aplicar_parrafo_config(p, formato)
 
 
 def _procesar_titulo_rango(
-    wb: Workbook, sheet_name: str, rango: str, doc: DocumentType, config_tipo: Dict[str, Any]
+    wb: Workbook, sheet_name: str, rango: str, doc: DocumentType, formato: FormatoTipo
 ) -> None:
-    celdas = _leer_rango_celdas(wb, sheet_name, rango)
-    textos = [str(c.value) for row in celdas for c in row if c.value is not None]
+    filas = _leer_rango(wb, sheet_name, rango)
+    textos = [str(v) for fila in filas for v in fila if v is not None]
     texto = " ".join(textos).strip()
     if not texto: return
 
-    if config_tipo.get("page_break_before"):
+    if formato.salto_pagina_antes:
         doc.add_page_break()
     
-    _procesar_texto_directo(doc, texto, config_tipo)
+    _procesar_texto_directo(doc, texto, formato)
 
 
 def _procesar_numero_nota_rango(
-    wb: Workbook, sheet_name: str, rango: str, doc: DocumentType, config_tipo: Dict[str, Any]
+    wb: Workbook, sheet_name: str, rango: str, doc: DocumentType, formato: FormatoTipo
 ) -> None:
-    celdas = _leer_rango_celdas(wb, sheet_name, rango)
-    first_cell_value = celdas[0][0].value
+    filas = _leer_rango(wb, sheet_name, rango)
+    first_cell_value = filas[0][0]
     if first_cell_value is None: return
     
     texto = str(first_cell_value).strip()
     if not texto: return
 
-    style_name = config_tipo.get("style")
+    style_name = formato.estilo
     p = doc.add_paragraph(texto, style=style_name if style_name and style_name in doc.styles else None)
-    _aplicar_parrafo_config(p, config_tipo)
+    _aplicar_parrafo_config(p, formato)
 
 
 def _crear_tabla_clonada(
@@ -212,13 +183,14 @@ def _crear_tabla_clonada(
     model_table_xml: Any,
     column_widths: List[int],
     excel_rows: List[List[Any]],
-    config_tipo: Dict[str, Any],
+    formato: FormatoTipo,
 ) -> None:
     """
     Clona una tabla modelo, la rellena con datos y la inserta en la posición
     actual del documento para mantener el orden de los bloques.
     """
     # Importación local para evitar dependencia a nivel de módulo si no se usa
+    from docx.oxml.ns import qn
     from docx.table import _Cell
 
     # 1. Añadir un párrafo marcador temporal para saber dónde insertar la tabla.
@@ -247,7 +219,7 @@ def _crear_tabla_clonada(
             new_table.columns[i].width = width
 
     # --- Lógica de población ---
-    header_rows_count = max(int(config_tipo.get("header_rows", 1)), 0)
+    header_rows_count = formato.filas_encabezado
 
     # Separar encabezados y datos del Excel
     excel_header_rows = excel_rows[:header_rows_count]
@@ -284,7 +256,7 @@ def _crear_tabla_clonada(
                             p._p.remove(p.runs[k]._r)
 
     # Ajustar filas de datos
-    if config_tipo.get("trim_leading_empty_rows"):
+    if formato.recortar_filas_vacias:
         while excel_rows_data and _fila_vacia(excel_rows_data[0]):
             excel_rows_data = excel_rows_data[1:]
     
@@ -311,7 +283,7 @@ def _crear_tabla_clonada(
             for j, cell_data in enumerate(excel_row_data):
                 if j < len(table_row.cells):
                     cell = table_row.cells[j]
-                    texto = _formatear_celda_tabla(cell_data, table_row_index, j, config_tipo)
+                    texto = _formatear_celda_tabla(cell_data, table_row_index, j, formato)
                     
                     # 0. Asegurar que tenemos el párrafo de la celda actual
                     if not cell.paragraphs:
@@ -338,45 +310,33 @@ def _crear_tabla_clonada(
                             p._p.remove(p.runs[k]._r)
                     
                     # 3. Forzar fuente (JSON > Plantilla > Trebuchet MS)
-                    font_name_cfg = config_tipo.get("font_name")
-                    f_name = font_name_cfg or template_font or "Trebuchet MS"
+                    f_name = formato.fuente or template_font or "Trebuchet MS"
 
                     if f_name:
                         new_run.font.name = f_name
-                        from docx.oxml.ns import qn
                         rPr = new_run._element.get_or_add_rPr()
                         rFonts = rPr.get_or_add_rFonts()
                         rFonts.set(qn('w:ascii'), f_name)
                         rFonts.set(qn('w:hAnsi'), f_name)
                         rFonts.set(qn('w:cs'), f_name)
 
-                    # 4. Forzar tamaño (JSON > Plantilla > 10.0)
-                    column_font_sizes = config_tipo.get("column_font_size", {})
-                    col_size = None
-                    if isinstance(column_font_sizes, list) and j < len(column_font_sizes):
-                        col_size = column_font_sizes[j]
-                    elif isinstance(column_font_sizes, dict):
-                        col_size = column_font_sizes.get(j) or column_font_sizes.get(j + 1)
-                    
-                    f_size = col_size or config_tipo.get("font_size") or template_size or 10.0
-                    
-                    try:
-                        new_run.font.size = Pt(float(f_size))
-                    except: pass
+                    # 4. Forzar tamaño (JSON por columna > JSON > Plantilla > 10.0)
+                    f_size = formato.tamano_columna(j) or template_size or 10.0
+                    new_run.font.size = Pt(f_size)
 
 
 def _formatear_celda_tabla(
     cell_data: Any,
     row_index: int,
     col_index: int,
-    config_tipo: Dict[str, Any],
+    formato: FormatoTipo,
 ) -> str:
     """
     Formatea el valor de una celda para su inserción en la tabla Word,
     manejando NaNs y aplicando formatos numéricos contextuales.
     """
     # 1. Manejar valores nulos o NaN de pandas
-    if cell_data is None or pd.isna(cell_data):
+    if es_nulo(cell_data):
         return ""
 
     # 2. Manejar valores numéricos (int y float)
@@ -386,7 +346,7 @@ def _formatear_celda_tabla(
             return "-"
 
         # Revisar si hay una regla de formato específica en la configuración
-        number_format_type = _resolver_formato_numerico(config_tipo, col_index)
+        number_format_type = formato.formato_columna(col_index)
 
         # --- NUEVA LÓGICA DE PORCENTAJE ---
         if number_format_type == "percentage":
@@ -412,28 +372,6 @@ def _formatear_celda_tabla(
     return str(cell_data)
 
 
-def _resolver_formato_numerico(config_tipo: Dict[str, Any], col_index: int) -> Any:
-    """
-    Devuelve el formato numérico efectivo para una columna dada:
-    - column_number_format puede ser lista o dict (0 o 1-based)
-    - fallback a number_format global
-    """
-    col_cfg = config_tipo.get("column_number_format")
-    if isinstance(col_cfg, list):
-        if col_index < len(col_cfg):
-            fmt = col_cfg[col_index]
-            if fmt is not None:
-                return fmt
-    elif isinstance(col_cfg, dict):
-        fmt = col_cfg.get(col_index)
-        if fmt is None:
-            fmt = col_cfg.get(col_index + 1)
-        if fmt is not None:
-            return fmt
-
-    return config_tipo.get("number_format")
-
-
 def _fila_vacia(row: List[Any]) -> bool:
     """Devuelve True si toda la fila es None o cadena vacia."""
     return all(cell is None or (isinstance(cell, str) and not cell.strip()) for cell in row)
@@ -442,16 +380,25 @@ def _fila_vacia(row: List[Any]) -> bool:
 def _crear_tabla_desde_datos(
     doc: DocumentType,
     filas_datos: List[List[Any]],
-    config_tipo: Dict[str, Any],
+    formato: FormatoTipo,
 ) -> None:
     """Crea una tabla simple en Word a partir de una lista de listas (sin leer de Excel)."""
     if not filas_datos: return
 
     num_cols = len(filas_datos[0])
     table = doc.add_table(rows=0, cols=num_cols)
-    table.style = config_tipo.get("table_style", "Table Grid")
+    table.style = formato.estilo_tabla
 
     for fila in filas_datos:
         row_cells = table.add_row().cells
         for j, cell_val in enumerate(fila):
             row_cells[j].text = str(cell_val) if cell_val is not None else ""
+
+
+# Bloques legacy (con 'rango') que no son tablas, por manejador resuelto al compilar los formatos
+_MANEJADORES_RANGO = {
+    MANEJADOR_TEXTO: _procesar_texto_rango,
+    MANEJADOR_VINETAS: _procesar_viñetas_rango,
+    MANEJADOR_TITULO: _procesar_titulo_rango,
+    MANEJADOR_NUM_NOTAS: _procesar_numero_nota_rango,
+}
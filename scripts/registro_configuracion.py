@@ -0,0 +1,254 @@
+from __future__ import annotations
+
+"""
+Registro de la configuración vigente (formatos y plantilla) para procesos de
+larga vida: Streamlit, el servicio HTTP, la vigilancia de carpetas y la app
+de escritorio.
+
+`RegistroConfiguracion.actual()` devuelve una `Instantanea` con
+`formatos_hojas.json` compilado y la plantilla (compilada al primer uso).
+Comprobar si cambiaron cuesta un `stat` por archivo, y como mucho uno cada
+`intervalo_s` segundos. Si cambiaron, una recarga en segundo plano lee los
+archivos, los hashea y, solo si el contenido es distinto, compila la nueva
+versión y la sustituye de golpe. Mientras tanto se sigue sirviendo la
+instantánea anterior.
+
+Una instantánea no cambia nunca. Un trabajo que tomó la suya la conserva
+hasta terminar aunque se editen los archivos; los trabajos nuevos reciben la
+nueva. Las claves de caché salen de las huellas de la instantánea (ver
+`motor_automatizacion.clave_generacion`), no del archivo en disco, y la
+plantilla viaja a los procesos trabajadores con sus bytes (ver
+`core_secciones.PlantillaCompilada`).
+
+Si la recarga falla (JSON a medio guardar, formato inválido...), se avisa y
+se mantiene la configuración anterior hasta que el archivo vuelva a cambiar.
+"""
+
+import hashlib
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from scripts.core_secciones import PlantillaCompilada, compilar_formatos
+from scripts.formatos_compilados import FormatosCompilados
+from scripts.motor_automatizacion import FORMATOS_PATH, PLANTILLA_PATH
+
+# Tiempo mínimo entre dos comprobaciones de los archivos en disco
+INTERVALO_COMPROBACION_S = 1.0
+
+# (mtime_ns, tamaño) de un archivo, o None si no existe
+Firma = Optional[Tuple[int, int]]
+
+
+def _firma(ruta: Path) -> Firma:
+    try:
+        st = ruta.stat()
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+class Instantanea:
+    """
+    Formatos y plantilla tal como estaban en un momento dado.
+
+    - `formatos`: `FormatosCompilados`, o None si no existe el JSON.
+    - `plantilla`: `PlantillaCompilada`; se compila la primera vez que se pide
+      (así abrir la app no importa python-docx). Lanza `FileNotFoundError`
+      si no había plantilla.
+    - `version`: número creciente; cambia solo si cambió el contenido.
+    """
+
+    def __init__(
+        self,
+        formatos: FormatosCompilados | None,
+        plantilla_path: Path,
+        datos_plantilla: bytes | None,
+        version: int,
+        plantilla: PlantillaCompilada | None = None,
+    ) -> None:
+        self.formatos = formatos
+        self.plantilla_path = plantilla_path
+        self.huella_plantilla = (
+            hashlib.sha256(datos_plantilla).hexdigest() if datos_plantilla is not None else "ausente"
+        )
+        self.version = version
+        self._datos_plantilla = datos_plantilla
+        self._plantilla = plantilla
+        self._lock_plantilla = threading.Lock()
+        self._derivados: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def huella_formatos(self) -> str:
+        """Identifica el contenido de los formatos (para usarlo en claves)."""
+        return self.formatos.huella if self.formatos is not None else "ausente"
+
+    @property
+    def plantilla(self) -> PlantillaCompilada:
+        with self._lock_plantilla:
+            if self._plantilla is None:
+                if self._datos_plantilla is None:
+                    raise FileNotFoundError(f"No se encontró la plantilla de Word: {self.plantilla_path}")
+                self._plantilla = PlantillaCompilada(self.plantilla_path, self._datos_plantilla)
+            return self._plantilla
+
+    def derivado(self, nombre: str, construir: Callable[[Instantanea], Any]) -> Any:
+        """
+        Objeto calculado a partir de esta configuración (p. ej. los estilos de
+        la vista HTML), construido la primera vez que se pide.
+        """
+        with self._lock:
+            if nombre not in self._derivados:
+                self._derivados[nombre] = construir(self)
+            return self._derivados[nombre]
+
+
+class RegistroConfiguracion:
+    """
+    Mantiene la `Instantanea` vigente de `formatos_path` y `plantilla_path`.
+
+    Es seguro usarlo desde varios hilos. La primera llamada a `actual()` carga
+    la configuración en el momento (y propaga sus errores); las siguientes
+    nunca esperan a una recarga.
+    """
+
+    def __init__(
+        self,
+        formatos_path: Path = FORMATOS_PATH,
+        plantilla_path: Path = PLANTILLA_PATH,
+        intervalo_s: float = INTERVALO_COMPROBACION_S,
+    ) -> None:
+        self.formatos_path = Path(formatos_path)
+        self.plantilla_path = Path(plantilla_path)
+        self.intervalo_s = intervalo_s
+        self.ultimo_error: Exception | None = None
+        self._instantanea: Instantanea | None = None
+        # Firmas de los archivos que dieron la instantánea vigente (o de la
+        # última recarga fallida, para no reintentarla hasta otro cambio)
+        self._firmas: Tuple[Firma, Firma] | None = None
+        self._comprobado = 0.0
+        self._lock_recarga = threading.Lock()
+        self._lock_hilo = threading.Lock()
+        self._hilo: threading.Thread | None = None
+
+    def _firmas_disco(self) -> Tuple[Firma, Firma]:
+        return (_firma(self.formatos_path), _firma(self.plantilla_path))
+
+    def actual(self) -> Instantanea:
+        """Instantánea vigente; si los archivos cambiaron, lanza su recarga."""
+        instantanea = self._instantanea
+        if instantanea is None:
+            return self.recargar()
+        ahora = time.monotonic()
+        if ahora - self._comprobado >= self.intervalo_s:
+            self._comprobado = ahora
+            if self._firmas_disco() != self._firmas:
+                self._recargar_en_segundo_plano()
+        return instantanea
+
+    def recargar(self) -> Instantanea:
+        """Recarga ahora lo que haya cambiado en disco y devuelve la instantánea vigente."""
+        with self._lock_recarga:
+            return self._recargar()
+
+    def esperar_recarga(self, timeout: float | None = None) -> None:
+        """Espera a que termine la recarga en segundo plano en curso, si la hay."""
+        hilo = self._hilo
+        if hilo is not None:
+            hilo.join(timeout)
+
+    def _recargar_en_segundo_plano(self) -> None:
+        with self._lock_hilo:
+            if self._hilo is not None and self._hilo.is_alive():
+                return
+            self._hilo = threading.Thread(
+                target=self._recargar_sin_errores, name="recarga-configuracion", daemon=True
+            )
+            self._hilo.start()
+
+    def _recargar_sin_errores(self) -> None:
+        try:
+            self.recargar()
+        except Exception as exc:
+            self.ultimo_error = exc
+
+    def _recargar(self) -> Instantanea:
+        previa = self._instantanea
+        firmas = self._firmas_disco()
+        if previa is not None and firmas == self._firmas:
+            return previa
+
+        try:
+            nueva = self._cargar(previa)
+        except Exception as exc:
+            if previa is None:
+                raise
+            self.ultimo_error = exc
+            self._firmas = firmas
+            print(f"[ADVERTENCIA] No se pudo recargar la configuración ({exc}); se mantiene la anterior.")
+            return previa
+
+        self.ultimo_error = None
+        self._firmas = firmas
+        if nueva is not None:
+            # Una sola asignación: quien lea a la vez obtiene la anterior o la nueva
+            self._instantanea = nueva
+        return self._instantanea
+
+    def _cargar(self, previa: Instantanea | None) -> Instantanea | None:
+        """Nueva instantánea a partir del disco, o None si el contenido no cambió."""
+        try:
+            datos_formatos = self.formatos_path.read_bytes()
+        except FileNotFoundError:
+            datos_formatos = None
+        try:
+            datos_plantilla = self.plantilla_path.read_bytes()
+        except FileNotFoundError:
+            datos_plantilla = None
+
+        huella_formatos = hashlib.sha256(datos_formatos).hexdigest() if datos_formatos is not None else "ausente"
+        huella_plantilla = hashlib.sha256(datos_plantilla).hexdigest() if datos_plantilla is not None else "ausente"
+        if previa is None:
+            formatos = compilar_formatos(datos_formatos) if datos_formatos is not None else None
+            return Instantanea(formatos, self.plantilla_path, datos_plantilla, 1)
+
+        misma_plantilla = huella_plantilla == previa.huella_plantilla
+        if huella_formatos == previa.huella_formatos and misma_plantilla:
+            return None  # Solo cambió la fecha de los archivos
+
+        if huella_formatos == previa.huella_formatos:
+            formatos = previa.formatos
+        else:
+            formatos = compilar_formatos(datos_formatos) if datos_formatos is not None else None
+        nueva = Instantanea(
+            formatos,
+            self.plantilla_path,
+            datos_plantilla,
+            previa.version + 1,
+            plantilla=previa._plantilla if misma_plantilla else None,
+        )
+        if not misma_plantilla and previa._plantilla is not None:
+            # La plantilla anterior estaba en uso: se compila ya, fuera de los
+            # trabajos, y si no es válida se mantiene la anterior
+            nueva.plantilla
+        return nueva
+
+
+_registro: RegistroConfiguracion | None = None
+_registro_lock = threading.Lock()
+
+
+def registro_configuracion() -> RegistroConfiguracion:
+    """Registro de la configuración del proyecto, compartido por todo el proceso."""
+    global _registro
+    with _registro_lock:
+        if _registro is None:
+            _registro = RegistroConfiguracion()
+        return _registro
+
+
+def configuracion_vigente() -> Instantanea:
+    """Atajo para `registro_configuracion().actual()`."""
+    return registro_configuracion().actual()
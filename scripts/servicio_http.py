@@ -0,0 +1,422 @@
+from __future__ import annotations
+
+"""
+Servicio HTTP local de generación de dictámenes (solo biblioteca estándar).
+
+Permite que otras herramientas generen dictámenes sin pasar por la interfaz
+de Streamlit. Corre sobre asyncio; el análisis de libros se hace en hilos y la
+generación en el pool de procesos compartido (`scripts.pool_generacion`), con
+las mismas cachés que la app (análisis por hash del libro, caché de salidas).
+
+Uso (desde la raíz del proyecto):
+
+    python -m scripts.servicio_http --puerto 8765
+
+Endpoints (respuestas en JSON salvo la descarga):
+
+    POST   /libros?nombre=UNC.xlsx        cuerpo: bytes del .xlsx -> 201 {"libro": id, ...}
+    GET    /libros/{id}                   resumen del análisis (hojas y bloques)
+    POST   /libros/{id}/generaciones      cuerpo opcional: {"orden": [hojas]} -> 202 {"trabajo": id}
+    GET    /trabajos/{id}                 estado, avance, posición en cola
+    GET    /trabajos/{id}/docx            descarga del DOCX (cuando el estado es "completado")
+    DELETE /trabajos/{id}                 cancela el trabajo
+    GET    /estadisticas                  configuración, cachés y pool del motor
+
+Si el pool está lleno, `POST .../generaciones` responde 503 con `Retry-After`.
+El servicio no tiene autenticación: está pensado para escuchar en 127.0.0.1.
+"""
+
+import argparse
+import asyncio
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from http import HTTPStatus
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, List, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from scripts.almacen_sesiones import AlmacenSesiones, ArtefactoSesion
+from scripts.carga_diferida import es_dataframe
+from scripts.ingesta import LibroSubido
+from scripts.motor_automatizacion import MotorDictamen
+from scripts.pool_generacion import ColaLlena
+from scripts.registro_configuracion import Instantanea
+from scripts.trabajos import COMPLETADO, ERROR, TrabajoGeneracion
+
+HOST = "127.0.0.1"
+PUERTO = 8765
+# Tamaño máximo de un libro subido
+MAX_SUBIDA_BYTES = 200 * 1024 * 1024
+# Libros subidos que se conservan (los más antiguos se olvidan)
+MAX_LIBROS = 32
+# Documentos generados: memoria máxima antes de volcar a disco e inactividad
+# tras la que se borran (igual que las sesiones de Streamlit)
+ALMACEN_DIR = Path("cache/servicio")
+PRESUPUESTO_MEMORIA = 128 * 1024 * 1024
+INACTIVIDAD_MAX_S = 2 * 60 * 60
+TAMANO_TROZO = 64 * 1024
+
+MIME_DOCX = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+
+class ErrorHTTP(Exception):
+    def __init__(self, estado: HTTPStatus, mensaje: str, cabeceras: Dict[str, str] | None = None) -> None:
+        super().__init__(mensaje)
+        self.estado = estado
+        self.mensaje = mensaje
+        self.cabeceras = cabeceras or {}
+
+
+def resumen_rangos(rangos: Dict[str, list]) -> List[Dict[str, Any]]:
+    """Resumen serializable del análisis: bloques por tipo y filas de tabla de cada hoja."""
+    resumen = []
+    for hoja, bloques in rangos.items():
+        tipos: Dict[str, int] = {}
+        filas = 0
+        for bloque in bloques:
+            tipos[bloque["tipo"]] = tipos.get(bloque["tipo"], 0) + 1
+            if es_dataframe(bloque.get("contenido")):
+                filas += len(bloque["contenido"])
+        resumen.append({"hoja": hoja, "bloques": len(bloques), "tipos": tipos, "filas_tabla": filas})
+    return resumen
+
+
+class ServicioGeneracion:
+    """
+    Estado del servicio: libros subidos, trabajos y documentos. La
+    configuración, el análisis (cacheado) y el pool son los del motor.
+
+    No sabe nada de HTTP; los métodos lanzan `ErrorHTTP` para que la capa de
+    red elija la respuesta. Los métodos lentos (análisis) son síncronos y se
+    llaman desde un hilo.
+    """
+
+    def __init__(self, motor: MotorDictamen, almacen: AlmacenSesiones) -> None:
+        self.motor = motor
+        self.almacen = almacen
+        self._lock = threading.Lock()
+        self._libros: "OrderedDict[str, LibroSubido]" = OrderedDict()
+        self._trabajos: Dict[str, TrabajoGeneracion] = {}
+        self._accesos: Dict[str, float] = {}
+        self._documentos: Dict[str, ArtefactoSesion] = {}
+
+    # ----- libros -----
+
+    def configuracion(self) -> Instantanea:
+        """Formatos y plantilla vigentes (se recargan si cambian, sin reiniciar el servicio)."""
+        return self.motor.configuracion()
+
+    def subir_libro(self, datos: bytes, nombre: str) -> Dict[str, Any]:
+        libro = LibroSubido(datos, nombre)
+        with self._lock:
+            self._libros[libro.hash] = libro
+            self._libros.move_to_end(libro.hash)
+            while len(self._libros) > MAX_LIBROS:
+                # Un trabajo en curso conserva su propia referencia al libro
+                self._libros.popitem(last=False)
+        rangos, _ = self.analizar(libro.hash)
+        return {"libro": libro.hash, "nombre": nombre, "hojas_con_bloques": len(rangos)}
+
+    def _libro(self, libro_id: str) -> LibroSubido:
+        with self._lock:
+            libro = self._libros.get(libro_id)
+        if libro is None:
+            raise ErrorHTTP(HTTPStatus.NOT_FOUND, f"No existe el libro '{libro_id}'.")
+        return libro
+
+    def analizar(
+        self, libro_id: str, config: Instantanea | None = None
+    ) -> Tuple[Dict[str, list], List[str]]:
+        """Bloques descubiertos y orden de hojas del libro (cacheado por hash y huella de formatos)."""
+        return self.motor.descubrir(self._libro(libro_id), config=config)
+
+    def resumen_libro(self, libro_id: str) -> Dict[str, Any]:
+        libro = self._libro(libro_id)
+        rangos, hojas = self.analizar(libro_id)
+        return {
+            "libro": libro_id,
+            "nombre": libro.nombre,
+            "hojas": hojas,
+            "secciones": resumen_rangos(rangos),
+        }
+
+    # ----- trabajos -----
+
+    def lanzar(self, libro_id: str, orden: List[str] | None = None) -> Dict[str, Any]:
+        libro = self._libro(libro_id)
+        # Análisis y generación usan la misma configuración aunque cambie entretanto
+        config = self.configuracion()
+        rangos, hojas = self.analizar(libro_id, config)
+        if orden is None:
+            orden = [h for h in hojas if h in rangos]
+        desconocidas = [h for h in orden if h not in rangos]
+        if desconocidas:
+            raise ErrorHTTP(HTTPStatus.BAD_REQUEST, f"Hojas sin bloques o inexistentes: {desconocidas}")
+        if not orden:
+            raise ErrorHTTP(HTTPStatus.UNPROCESSABLE_ENTITY, "El libro no tiene hojas procesables.")
+        ocupacion = self.motor.pool.estadisticas() if self.motor.pool is not None else None
+        if ocupacion and ocupacion["en_cola"] + ocupacion["en_ejecucion"] >= ocupacion["capacidad"]:
+            # Se rechaza aquí para responder 503 en lugar de crear un trabajo fallido
+            raise ErrorHTTP(
+                HTTPStatus.SERVICE_UNAVAILABLE, "Servidor ocupado; reintenta más tarde.", {"Retry-After": "30"}
+            )
+
+        trabajo = TrabajoGeneracion(
+            self.motor.generar_final,
+            firma=(libro_id, tuple(orden)),
+            en_cola=True,
+            workbook_path=libro,
+            rangos_dinamicos=rangos,
+            orden_hojas=orden,
+            id_incremental=libro.nombre,
+            config=config,
+        ).iniciar()
+        trabajo_id = uuid.uuid4().hex
+        with self._lock:
+            self._trabajos[trabajo_id] = trabajo
+            self._accesos[trabajo_id] = time.monotonic()
+        return self.estado(trabajo_id)
+
+    def _trabajo(self, trabajo_id: str) -> TrabajoGeneracion:
+        with self._lock:
+            trabajo = self._trabajos.get(trabajo_id)
+            if trabajo is None:
+                raise ErrorHTTP(HTTPStatus.NOT_FOUND, f"No existe el trabajo '{trabajo_id}'.")
+            self._accesos[trabajo_id] = time.monotonic()
+            if trabajo.estado == COMPLETADO and trabajo.resultado is not None:
+                # El documento pasa al almacén (memoria o disco); el trabajo lo
+                # suelta. Con el lock tomado: dos consultas a la vez lo moverían dos veces
+                self._documentos[trabajo_id] = self.almacen.guardar(
+                    trabajo_id, "docx", trabajo.resultado.getvalue()
+                )
+                trabajo.resultado = None
+        self.almacen.tocar(trabajo_id)
+        return trabajo
+
+    def estado(self, trabajo_id: str) -> Dict[str, Any]:
+        trabajo = self._trabajo(trabajo_id)
+        eta = trabajo.eta_segundos()
+        estado = {
+            "trabajo": trabajo_id,
+            "estado": trabajo.estado,
+            "completadas": trabajo.completadas,
+            "total": trabajo.total,
+            "hoja_actual": trabajo.hoja_actual,
+            "posicion_cola": trabajo.posicion_cola,
+            "transcurrido_s": round(trabajo.transcurrido, 3),
+            "restante_estimado_s": round(eta, 1) if eta is not None else None,
+        }
+        if trabajo.estado == ERROR:
+            estado["error"] = str(trabajo.error)
+            estado["reintentar"] = isinstance(trabajo.error, ColaLlena)
+        return estado
+
+    def documento(self, trabajo_id: str) -> BinaryIO:
+        """Archivo abierto con el DOCX del trabajo (lo cierra quien lo lee)."""
+        trabajo = self._trabajo(trabajo_id)
+        if trabajo.estado != COMPLETADO:
+            raise ErrorHTTP(HTTPStatus.CONFLICT, f"El trabajo está '{trabajo.estado}', no completado.")
+        with self._lock:
+            artefacto = self._documentos.get(trabajo_id)
+        if artefacto is None or not artefacto.disponible:
+            raise ErrorHTTP(HTTPStatus.GONE, "El documento caducó por inactividad; vuelve a generarlo.")
+        return artefacto.abrir()
+
+    def cancelar(self, trabajo_id: str) -> Dict[str, Any]:
+        self._trabajo(trabajo_id).cancelar()
+        return self.estado(trabajo_id)
+
+    def estadisticas(self) -> Dict[str, Any]:
+        with self._lock:
+            servicio = {"libros": len(self._libros), "trabajos": len(self._trabajos)}
+        return {"servicio": servicio, **self.motor.estadisticas()}
+
+    def purgar(self) -> None:
+        """Olvida los trabajos terminados sin consultas desde hace `INACTIVIDAD_MAX_S`."""
+        limite = time.monotonic() - INACTIVIDAD_MAX_S
+        with self._lock:
+            caducados = [
+                t for t, trabajo in self._trabajos.items()
+                if trabajo.terminado and self._accesos[t] < limite
+            ]
+            for trabajo_id in caducados:
+                del self._trabajos[trabajo_id]
+                del self._accesos[trabajo_id]
+                self._documentos.pop(trabajo_id, None)
+        for trabajo_id in caducados:
+            self.almacen.eliminar_sesion(trabajo_id)
+        self.almacen.purgar_inactivas()
+
+
+# ------------------------
+# Capa HTTP (asyncio)
+# ------------------------
+
+async def _leer_peticion(
+    reader: asyncio.StreamReader,
+) -> Tuple[str, List[str], Dict[str, List[str]], Dict[str, str], bytes]:
+    """Lee una petición HTTP/1.1: (método, segmentos de la ruta, query, cabeceras, cuerpo)."""
+    linea = await reader.readline()
+    try:
+        metodo, objetivo, _ = linea.decode("latin-1").split(" ", 2)
+    except ValueError:
+        raise ErrorHTTP(HTTPStatus.BAD_REQUEST, "Línea de petición no válida.")
+
+    cabeceras: Dict[str, str] = {}
+    while True:
+        linea = await reader.readline()
+        if linea in (b"\r\n", b"\n", b""):
+            break
+        nombre, _, valor = linea.decode("latin-1").partition(":")
+        cabeceras[nombre.strip().lower()] = valor.strip()
+
+    try:
+        longitud = int(cabeceras.get("content-length", "0"))
+    except ValueError:
+        raise ErrorHTTP(HTTPStatus.BAD_REQUEST, "Content-Length no válido.")
+    if longitud > MAX_SUBIDA_BYTES:
+        raise ErrorHTTP(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, f"El cuerpo supera {MAX_SUBIDA_BYTES} bytes.")
+    cuerpo = await reader.readexactly(longitud) if longitud else b""
+
+    partes = urlsplit(objetivo)
+    segmentos = [unquote(s) for s in partes.path.split("/") if s]
+    return metodo.upper(), segmentos, parse_qs(partes.query), cabeceras, cuerpo
+
+
+async def _responder(
+    writer: asyncio.StreamWriter,
+    estado: HTTPStatus,
+    cuerpo: Any,
+    cabeceras: Dict[str, str] | None = None,
+) -> None:
+    datos = json.dumps(cuerpo, ensure_ascii=False).encode("utf-8")
+    lineas = [
+        f"HTTP/1.1 {estado.value} {estado.phrase}",
+        "Content-Type: application/json; charset=utf-8",
+        f"Content-Length: {len(datos)}",
+        "Connection: close",
+    ]
+    lineas += [f"{k}: {v}" for k, v in (cabeceras or {}).items()]
+    writer.write(("\r\n".join(lineas) + "\r\n\r\n").encode("latin-1") + datos)
+    await writer.drain()
+
+
+async def _enviar_documento(writer: asyncio.StreamWriter, archivo: BinaryIO, nombre: str) -> None:
+    """Envía el DOCX por trozos, sin cargarlo entero en el bucle de eventos."""
+    with archivo:
+        archivo.seek(0, 2)
+        tamano = archivo.tell()
+        archivo.seek(0)
+        cabecera = (
+            "HTTP/1.1 200 OK\r\n"
+            f"Content-Type: {MIME_DOCX}\r\n"
+            f"Content-Length: {tamano}\r\n"
+            f'Content-Disposition: attachment; filename="{nombre}"\r\n'
+            "Connection: close\r\n\r\n"
+        )
+        writer.write(cabecera.encode("latin-1"))
+        while True:
+            trozo = archivo.read(TAMANO_TROZO)
+            if not trozo:
+                break
+            writer.write(trozo)
+            await writer.drain()
+
+
+def _cuerpo_json(cuerpo: bytes) -> Dict[str, Any]:
+    if not cuerpo.strip():
+        return {}
+    try:
+        datos = json.loads(cuerpo)
+    except ValueError:
+        raise ErrorHTTP(HTTPStatus.BAD_REQUEST, "El cuerpo no es JSON válido.")
+    if not isinstance(datos, dict):
+        raise ErrorHTTP(HTTPStatus.BAD_REQUEST, "El cuerpo debe ser un objeto JSON.")
+    return datos
+
+
+async def _atender(servicio: ServicioGeneracion, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    # El análisis de libros es lento: se ejecuta en hilos para no bloquear el bucle
+    en_hilo = asyncio.to_thread
+    try:
+        try:
+            metodo, ruta, query, _, cuerpo = await _leer_peticion(reader)
+
+            if metodo == "POST" and ruta == ["libros"]:
+                if not cuerpo:
+                    raise ErrorHTTP(HTTPStatus.BAD_REQUEST, "Envía el .xlsx como cuerpo de la petición.")
+                nombre = query.get("nombre", ["libro.xlsx"])[0]
+                await _responder(writer, HTTPStatus.CREATED, await en_hilo(servicio.subir_libro, cuerpo, nombre))
+
+            elif metodo == "GET" and len(ruta) == 2 and ruta[0] == "libros":
+                await _responder(writer, HTTPStatus.OK, await en_hilo(servicio.resumen_libro, ruta[1]))
+
+            elif metodo == "POST" and len(ruta) == 3 and ruta[0] == "libros" and ruta[2] == "generaciones":
+                orden = _cuerpo_json(cuerpo).get("orden")
+                if orden is not None and not (isinstance(orden, list) and all(isinstance(h, str) for h in orden)):
+                    raise ErrorHTTP(HTTPStatus.BAD_REQUEST, "'orden' debe ser una lista de nombres de hoja.")
+                await _responder(writer, HTTPStatus.ACCEPTED, await en_hilo(servicio.lanzar, ruta[1], orden))
+
+            elif metodo == "GET" and len(ruta) == 2 and ruta[0] == "trabajos":
+                await _responder(writer, HTTPStatus.OK, await en_hilo(servicio.estado, ruta[1]))
+
+            elif metodo == "GET" and len(ruta) == 3 and ruta[0] == "trabajos" and ruta[2] == "docx":
+                archivo = await en_hilo(servicio.documento, ruta[1])
+                await _enviar_documento(writer, archivo, "DICTAMEN_FINAL.docx")
+
+            elif metodo == "DELETE" and len(ruta) == 2 and ruta[0] == "trabajos":
+                await _responder(writer, HTTPStatus.OK, await en_hilo(servicio.cancelar, ruta[1]))
+
+            elif metodo == "GET" and ruta == ["estadisticas"]:
+                await _responder(writer, HTTPStatus.OK, await en_hilo(servicio.estadisticas))
+
+            else:
+                raise ErrorHTTP(HTTPStatus.NOT_FOUND, f"Ruta no encontrada: {metodo} /{'/'.join(ruta)}")
+
+        except ErrorHTTP as exc:
+            await _responder(writer, exc.estado, {"error": exc.mensaje}, exc.cabeceras)
+        except asyncio.IncompleteReadError:
+            pass
+        except Exception as exc:  # p. ej. un .xlsx corrupto al analizarlo
+            await _responder(writer, HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(exc)})
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def servir(servicio: ServicioGeneracion, host: str = HOST, puerto: int = PUERTO) -> None:
+    """Atiende peticiones hasta que se cancela la tarea (Ctrl+C)."""
+    servidor = await asyncio.start_server(
+        lambda r, w: _atender(servicio, r, w), host, puerto, limit=1024 * 1024
+    )
+    print(f"[INFO] Servicio de generación escuchando en http://{host}:{puerto}")
+    async with servidor:
+        while True:
+            await asyncio.sleep(60)
+            servicio.purgar()
+
+
+def main(argv: List[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Servicio HTTP local de generación de dictámenes.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--puerto", type=int, default=PUERTO)
+    parser.add_argument("--trabajadores", type=int, default=2, help="Generaciones simultáneas.")
+    parser.add_argument("--max-en-cola", type=int, default=8, help="Peticiones en espera antes de rechazar.")
+    args = parser.parse_args(argv)
+
+    motor = MotorDictamen(args.trabajadores, args.max_en_cola).iniciar()
+    servicio = ServicioGeneracion(motor, AlmacenSesiones(ALMACEN_DIR, PRESUPUESTO_MEMORIA, INACTIVIDAD_MAX_S))
+    try:
+        asyncio.run(servir(servicio, args.host, args.puerto))
+    except KeyboardInterrupt:
+        print("\n[FIN] Servicio detenido.")
+    finally:
+        motor.cerrar()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+"""
+Trabajos de generación en segundo plano.
+
+La generación del dictamen tarda varios segundos; si se ejecuta dentro del
+script de Streamlit, la sesión queda bloqueada hasta que termina. Un
+`TrabajoGeneracion` la lanza en un hilo propio y publica su avance (secciones
+completadas, hoja en curso, tiempo restante estimado), de modo que la interfaz
+puede consultarlo en cada rerun, seguir navegando por la previsualización y
+recoger el resultado cuando esté listo.
+
+El hilo nunca llama a Streamlit: solo actualiza atributos de este objeto, que
+la sesión lee. Este módulo no depende de Streamlit.
+"""
+
+import threading
+import time
+from typing import Any, Callable
+
+# Estados posibles de un trabajo
+PENDIENTE = "pendiente"
+EN_CURSO = "en_curso"
+COMPLETADO = "completado"
+CANCELADO = "cancelado"
+ERROR = "error"
+
+# Trabajos especulativos (lanzados sin que nadie los pida) simultáneos por
+# proceso. Si no hay hueco, simplemente no se especula.
+MAX_TRABAJOS_ESPECULATIVOS = 1
+_ranuras_especulativas = threading.BoundedSemaphore(MAX_TRABAJOS_ESPECULATIVOS)
+
+
+class GeneracionCancelada(Exception):
+    """Se lanza desde el callback de progreso para interrumpir la generación."""
+
+
+class TrabajoGeneracion:
+    """
+    Ejecuta `objetivo(**kwargs, progreso=...)` en un hilo en segundo plano.
+
+    `objetivo` debe aceptar el parámetro `progreso` (ver
+    `core_secciones.Progreso`), por ejemplo `ejecutar_generacion_completa`.
+    La cancelación es cooperativa: se comprueba al empezar cada sección, así
+    que la sección en curso termina antes de que el trabajo se detenga.
+
+    `firma` identifica las entradas del trabajo (p. ej. hash del libro y orden
+    de hojas) para saber si un resultado adelantado sigue sirviendo.
+
+    Con `en_cola=True`, `objetivo` también recibe `posicion` (ver
+    `PoolGeneracion.generar`) y el trabajo publica su puesto en la cola del
+    pool en `posicion_cola`; mientras espera en ella se puede cancelar.
+    """
+
+    def __init__(
+        self, objetivo: Callable[..., Any], *, firma: Any = None, en_cola: bool = False, **kwargs: Any
+    ) -> None:
+        self.firma = firma
+        self._objetivo = objetivo
+        self._kwargs = kwargs
+        if en_cola:
+            self._kwargs["posicion"] = self._posicion
+        self._cancelar = threading.Event()
+        self._lock = threading.Lock()
+        self._hilo = threading.Thread(target=self._ejecutar, name="generacion-dictamen", daemon=True)
+
+        self.estado = PENDIENTE
+        self.completadas = 0
+        self.total = 0
+        self.hoja_actual = ""
+        self.posicion_cola = 0
+        self.resultado: Any = None
+        self.error: BaseException | None = None
+        self._inicio: float | None = None
+        self._inicio_secciones: float | None = None
+        self._fin: float | None = None
+        self._ranura: threading.BoundedSemaphore | None = None
+
+    @classmethod
+    def especulativo(
+        cls, objetivo: Callable[..., Any], firma: Any, **kwargs: Any
+    ) -> "TrabajoGeneracion | None":
+        """
+        Lanza un trabajo adelantado si queda hueco para ello (ver
+        `MAX_TRABAJOS_ESPECULATIVOS`); si no, devuelve None.
+        """
+        if not _ranuras_especulativas.acquire(blocking=False):
+            return None
+        trabajo = cls(objetivo, firma=firma, **kwargs)
+        trabajo._ranura = _ranuras_especulativas
+        return trabajo.iniciar()
+
+    # ----- ciclo de vida -----
+
+    def iniciar(self) -> "TrabajoGeneracion":
+        with self._lock:
+            if self.estado == PENDIENTE:
+                self.estado = EN_CURSO
+                self._inicio = time.monotonic()
+                self._hilo.start()
+        return self
+
+    def cancelar(self) -> None:
+        """Pide la cancelación; el trabajo se detiene al empezar la siguiente sección."""
+        self._cancelar.set()
+
+    def esperar(self, timeout: float | None = None) -> bool:
+        """Bloquea hasta que el trabajo termina (o vence `timeout`). Devuelve si terminó."""
+        if self._hilo.is_alive():
+            self._hilo.join(timeout)
+        return self.terminado
+
+    def _progreso(self, completadas: int, total: int, hoja: str) -> None:
+        if self._cancelar.is_set():
+            raise GeneracionCancelada()
+        with self._lock:
+            if self._inicio_secciones is None:
+                # El tiempo previo (carga del libro) no cuenta para estimar el ritmo
+                self._inicio_secciones = time.monotonic()
+            self.completadas = completadas
+            self.total = total
+            self.hoja_actual = hoja
+
+    def _posicion(self, posicion: int) -> None:
+        if self._cancelar.is_set():
+            raise GeneracionCancelada()
+        self.posicion_cola = posicion
+
+    def _ejecutar(self) -> None:
+        try:
+            try:
+                resultado = self._objetivo(**self._kwargs, progreso=self._progreso)
+            except GeneracionCancelada:
+                estado, resultado, error = CANCELADO, None, None
+            except Exception as exc:  # se entrega a la interfaz, que decide cómo mostrarlo
+                estado, resultado, error = ERROR, None, exc
+            else:
+                estado, error = COMPLETADO, None
+            with self._lock:
+                self.resultado = resultado
+                self.error = error
+                self.estado = estado
+                self._fin = time.monotonic()
+        finally:
+            if self._ranura is not None:
+                self._ranura.release()
+
+    # ----- consulta -----
+
+    @property
+    def terminado(self) -> bool:
+        return self.estado in (COMPLETADO, CANCELADO, ERROR)
+
+    @property
+    def cancelacion_pedida(self) -> bool:
+        return self._cancelar.is_set()
+
+    @property
+    def fraccion(self) -> float:
+        """Avance entre 0 y 1 (1 también si terminó sin secciones, p. ej. desde caché)."""
+        if self.estado == COMPLETADO:
+            return 1.0
+        with self._lock:
+            return self.completadas / self.total if self.total else 0.0
+
+    @property
+    def transcurrido(self) -> float:
+        if self._inicio is None:
+            return 0.0
+        fin = self._fin if self._fin is not None else time.monotonic()
+        return fin - self._inicio
+
+    def eta_segundos(self) -> float | None:
+        """Segundos restantes estimados con el ritmo medio por sección, o None si aún no hay datos."""
+        with self._lock:
+            if self.terminado or not self.completadas or self._inicio_secciones is None:
+                return None
+            ritmo = (time.monotonic() - self._inicio_secciones) / self.completadas
+            return ritmo * (self.total - self.completadas)
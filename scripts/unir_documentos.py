@@ -2,19 +2,26 @@
 # CLI que genera el dictamen final
 # a partir del Excel y los rangos,
 # reutilizando la lógica de core_secciones.
+#
+# Uso (desde la raíz del proyecto):
+#
+#     python -m scripts.unir_documentos
+#
+# Genera con el mismo motor que las apps (`MotorDictamen`): la misma caché de
+# salidas y el mismo parcheo incremental cuando solo cambiaron algunas hojas.
+
+from __future__ import annotations
 
 from pathlib import Path
 
 from docx import Document
 from docx.oxml import OxmlElement
 from docx.oxml.ns import qn
+from openpyxl import load_workbook
 
-from core_secciones import (
-    cargar_rangos,
-    cargar_workbook,
-    cargar_formatos,
-    generar_docx_final_a_archivo,
-)
+from scripts.core_secciones import cargar_rangos
+from scripts.motor_automatizacion import MotorDictamen
+from scripts.registro_configuracion import RegistroConfiguracion
 
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -104,15 +111,20 @@ def ajustar_numeracion_paginas(orden_efectivo: list[str]) -> None:
 def main() -> None:
     FINAL_DIR.mkdir(parents=True, exist_ok=True)
 
-    wb = cargar_workbook(EXCEL_PATH)
     rangos = cargar_rangos(CONFIG_PATH)
+
+    # Para conocer las hojas basta el modo solo lectura, que no parsea
+    # las hojas; el libro completo solo se carga si la caché no acierta.
+    if not EXCEL_PATH.exists():
+        raise FileNotFoundError(f"No se encontró el archivo de Excel: {EXCEL_PATH}")
+    wb_ro = load_workbook(EXCEL_PATH, read_only=True)
     try:
-        formatos = cargar_formatos(FORMATOS_PATH)
-    except FileNotFoundError:
-        formatos = None
+        nombres_hojas = list(wb_ro.sheetnames)
+    finally:
+        wb_ro.close()
 
     # Orden efectivo de las hojas que realmente existen y tienen rango
-    orden_efectivo = [h for h in ORDER_SHEETS if h in rangos and h in wb.sheetnames]
+    orden_efectivo = [h for h in ORDER_SHEETS if h in rangos and h in nombres_hojas]
 
     print("[INFO] Hojas a incluir en el dictamen final (en orden):")
     for name in orden_efectivo:
@@ -121,14 +133,22 @@ def main() -> None:
     if not orden_efectivo:
         raise RuntimeError("No hay hojas válidas para generar el dictamen final.")
 
-    generar_docx_final_a_archivo(
-        wb=wb,
-        rangos=rangos,
-        plantilla_path=PLANTILLA_PATH,
-        destino=FINAL_DOC,
-        orden=orden_efectivo,
-        formatos=formatos,
-    )
+    # Los rangos salen de rangos_hojas.json: también entra en la clave de caché
+    with MotorDictamen(registro=RegistroConfiguracion(FORMATOS_PATH, PLANTILLA_PATH)) as motor:
+        aciertos = motor.estadisticas()["salidas"]["aciertos"]
+        buffer = motor.generar_final(
+            EXCEL_PATH,
+            rangos,
+            orden_hojas=orden_efectivo,
+            id_incremental=EXCEL_PATH.name,
+            dependencias_extra=[CONFIG_PATH],
+        )
+        if motor.estadisticas()["salidas"]["aciertos"] > aciertos:
+            print("[INFO] Entradas sin cambios: se reutiliza el documento de la caché.")
+    datos = buffer.getvalue()
+
+    with FINAL_DOC.open("wb") as f:
+        f.write(datos)
 
     print(f"[OK] Documento combinado guardado en: {FINAL_DOC}")
 
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+# Modo vigilancia: regenera el dictamen cada vez que se guarda una versión
+# nueva de un libro en una carpeta compartida.
+#
+# Uso (desde la raíz del proyecto):
+#
+#     python -m scripts.vigilar_carpeta excel/ --salida output/FINAL
+#
+# La carpeta se revisa cada `--intervalo` segundos. Un libro nuevo o
+# modificado se procesa cuando lleva `--espera` segundos sin cambiar de tamaño
+# ni de fecha (Excel y las carpetas de red escriben en varios pasos) y se puede
+# abrir como .xlsx completo; si no, se reintenta en la siguiente pasada.
+#
+# Las versiones de un mismo libro ("UNC Lomas Verdes v01.xlsx", "... v02.xlsx")
+# forman una serie. Al llegar una versión nueva:
+# - Solo se vuelven a analizar las hojas cuya firma cambió respecto a la
+#   versión anterior (ver scripts/firmas_libro.py); el resto reutiliza sus bloques.
+# - Solo se vuelven a dibujar las secciones que cambiaron: el DOCX anterior
+#   de la serie se parchea (ver scripts/parcheo_incremental.py).
+# El DOCX se escribe de forma atómica en la carpeta de salida con el nombre
+# del libro. Los cambios en formatos_hojas.json o en la plantilla se recogen
+# sin reiniciar (ver scripts/registro_configuracion.py).
+
+from __future__ import annotations
+
+import argparse
+import re
+import time
+import zipfile
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from scripts.firmas_libro import firmas_hojas
+from scripts.generar_lote import EXTENSIONES, escribir_atomico
+from scripts.motor_automatizacion import (
+    cargar_libro,
+    discover_and_load_blocks,
+    ejecutar_generacion_completa,
+)
+from scripts.registro_configuracion import configuracion_vigente
+
+SALIDA_DIR = Path("output") / "FINAL"
+INTERVALO_S = 1.0
+ESPERA_ESTABLE_S = 2.0
+# Un libro estable que sigue sin poder abrirse tras tantas esperas se da por dañado
+INTENTOS_ZIP_INCOMPLETO = 5
+
+# Sufijo de versión al final del nombre: " v01", "_v2", "-V10"...
+_RE_VERSION = re.compile(r"[\s_-]*v\d+$", re.IGNORECASE)
+
+
+def serie_de(ruta: Path) -> str:
+    """Nombre de la serie de versiones de un libro (su nombre sin el sufijo de versión)."""
+    return _RE_VERSION.sub("", ruta.stem) or ruta.stem
+
+
+class _EstadoSerie:
+    """Última versión procesada de una serie: firmas y bloques de cada hoja."""
+
+    def __init__(self, firmas: Dict[str, str], bloques: Dict[str, list], version_formatos: str) -> None:
+        self.firmas = firmas
+        self.bloques = bloques
+        self.version_formatos = version_formatos
+
+
+class VigilanteCarpeta:
+    """Revisa una carpeta por sondeo y regenera los libros nuevos o modificados."""
+
+    def __init__(
+        self,
+        carpeta: Path,
+        salida: Path = SALIDA_DIR,
+        espera_s: float = ESPERA_ESTABLE_S,
+    ) -> None:
+        self.carpeta = carpeta
+        self.salida = salida
+        self.espera_s = espera_s
+        # ruta -> ((mtime_ns, tamaño), momento en que se vio así por primera vez)
+        self._vistos: Dict[Path, Tuple[Tuple[int, int], float]] = {}
+        # ruta -> (mtime_ns, tamaño) de la última versión procesada (o fallida)
+        self._procesados: Dict[Path, Tuple[int, int]] = {}
+        self._series: Dict[str, _EstadoSerie] = {}
+
+    def _escanear(self) -> Dict[Path, Tuple[int, int]]:
+        encontrados = {}
+        for ruta in self.carpeta.iterdir():
+            # "~$libro.xlsx" es el archivo de bloqueo que deja Excel abierto
+            if ruta.suffix.lower() not in EXTENSIONES or ruta.name.startswith("~$"):
+                continue
+            try:
+                st = ruta.stat()
+            except FileNotFoundError:
+                continue
+            encontrados[ruta] = (st.st_mtime_ns, st.st_size)
+        return encontrados
+
+    def marcar_existentes(self) -> None:
+        """Da por procesados los libros que ya están en la carpeta."""
+        self._procesados.update(self._escanear())
+
+    def pasada(self) -> List[Path]:
+        """Una revisión de la carpeta. Devuelve los DOCX generados."""
+        ahora = time.monotonic()
+        generados = []
+        encontrados = self._escanear()
+        for ruta in list(self._vistos):
+            if ruta not in encontrados:
+                del self._vistos[ruta]
+
+        # Los más antiguos primero: si llegan v02 y v03 juntos, v03 parte de v02
+        for ruta, firma_stat in sorted(encontrados.items(), key=lambda e: e[1][0]):
+            visto = self._vistos.get(ruta)
+            if visto is None or visto[0] != firma_stat:
+                self._vistos[ruta] = (firma_stat, ahora)
+                continue
+            if self._procesados.get(ruta) == firma_stat or ahora - visto[1] < self.espera_s:
+                continue
+            try:
+                generados.append(self.procesar(ruta))
+            except zipfile.BadZipFile as exc:
+                if ahora - visto[1] < self.espera_s * INTENTOS_ZIP_INCOMPLETO:
+                    # Probablemente aún se está copiando: se reintenta en la siguiente pasada
+                    continue
+                print(f"[ERROR] {ruta.name}: no es un .xlsx válido ({exc}).", flush=True)
+            except Exception as exc:
+                print(f"[ERROR] {ruta.name}: {type(exc).__name__}: {exc}", flush=True)
+            # Procesado (o fallido): no se repite hasta que vuelva a cambiar
+            self._procesados[ruta] = firma_stat
+        return generados
+
+    def procesar(self, ruta: Path) -> Path:
+        """Analiza y genera un libro, reutilizando lo que no cambió desde la versión anterior de su serie."""
+        inicio = time.perf_counter()
+        serie = serie_de(ruta)
+        firmas = firmas_hojas(ruta)
+        config = configuracion_vigente()
+        formatos = config.formatos
+        version_formatos = config.huella_formatos
+
+        previo = self._series.get(serie)
+        conocidos: Dict[str, list] = {}
+        if previo is not None and previo.version_formatos == version_formatos:
+            conocidos = {
+                hoja: previo.bloques[hoja]
+                for hoja, firma in firmas.items()
+                if previo.firmas.get(hoja) == firma and hoja in previo.bloques
+            }
+
+        wb = cargar_libro(ruta)
+        rangos = discover_and_load_blocks(wb, {}, formatos, bloques_conocidos=conocidos)
+        if not rangos:
+            raise ValueError("No se encontraron hojas con bloques [[...]].")
+
+        buf = ejecutar_generacion_completa(
+            workbook_path=ruta,
+            rangos_dinamicos=rangos,
+            formatos=formatos,
+            orden_hojas=list(rangos.keys()),
+            id_incremental=serie,
+            plantilla=config.plantilla,
+            wb=wb,
+        )
+        destino = self.salida / f"{ruta.stem}.docx"
+        escribir_atomico(destino, buf.getvalue())
+
+        self._series[serie] = _EstadoSerie(
+            firmas, {hoja: rangos.get(hoja, []) for hoja in wb.sheetnames}, version_formatos
+        )
+        analizadas = len(wb.sheetnames) - len(conocidos)
+        print(
+            f"[OK] {ruta.name} -> {destino} en {time.perf_counter() - inicio:.1f} s "
+            f"({analizadas} hoja(s) analizadas, {len(conocidos)} sin cambios)",
+            flush=True,
+        )
+        return destino
+
+    def ejecutar(self, intervalo_s: float = INTERVALO_S) -> None:
+        while True:
+            self.pasada()
+            time.sleep(intervalo_s)
+
+
+def main(argv: List[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Regenera el dictamen al guardar versiones nuevas de un libro.")
+    parser.add_argument("carpeta", type=Path, help="Carpeta donde se guardan los libros.")
+    parser.add_argument("--salida", type=Path, default=SALIDA_DIR, help="Carpeta de los DOCX generados.")
+    parser.add_argument("--intervalo", type=float, default=INTERVALO_S, help="Segundos entre revisiones.")
+    parser.add_argument("--espera", type=float, default=ESPERA_ESTABLE_S, help="Segundos sin cambios antes de procesar un libro.")
+    parser.add_argument("--procesar-existentes", action="store_true", help="Generar también los libros que ya estaban al arrancar.")
+    args = parser.parse_args(argv)
+
+    vigilante = VigilanteCarpeta(args.carpeta, args.salida, args.espera)
+    if not args.procesar_existentes:
+        vigilante.marcar_existentes()
+    print(f"[INFO] Vigilando {args.carpeta} (salida: {args.salida}). Ctrl+C para terminar.", flush=True)
+    try:
+        vigilante.ejecutar(args.intervalo)
+    except KeyboardInterrupt:
+        print("\n[FIN] Vigilancia detenida.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+from __future__ import annotations
+
+"""
+Vista previa HTML de una sección del dictamen.
+
+Genera, a partir de los mismos bloques y de los mismos `tipos` de
+`formatos_hojas.json` que usa `procesador_bloques`, un HTML que se parece al
+DOCX final lo suficiente como para revisar el formato:
+
+- Cada estilo de párrafo se convierte en una clase CSS (`estilo-<nombre>`),
+  con fuente, tamaño, negrita, alineación y sangrías leídas de la plantilla.
+- Las tablas separan las `header_rows` del tipo y formatean las celdas con
+  las mismas reglas que el DOCX (`_formatear_celda_tabla`,
+  `trim_leading_empty_rows`...).
+
+Renderizar una sección lleva milisegundos, así que la ruta lenta (componer el
+DOCX con docxcompose) solo se usa para la exportación final. Es una
+aproximación: no reproduce la numeración, los bordes de las tablas modelo ni
+la paginación de Word.
+"""
+
+import html
+import re
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List
+
+from scripts.carga_diferida import es_dataframe, es_nulo
+from scripts.formatos_compilados import (
+    MANEJADOR_NUM_NOTAS,
+    MANEJADOR_TABLA,
+    MANEJADOR_TITULO,
+    MANEJADOR_VINETAS,
+    FormatoTipo,
+    formato_tipo,
+)
+from scripts.procesador_bloques import (
+    _fila_vacia,
+    _formatear_celda_tabla,
+    _leer_rango,
+)
+
+if TYPE_CHECKING:
+    from openpyxl.workbook.workbook import Workbook
+    from docx.document import Document as DocumentType
+
+# EMU (unidad interna de Word) por punto tipográfico
+_EMU_POR_PUNTO = 12700
+
+_ALINEACIONES_CSS = {"left": "left", "right": "right", "center": "center", "justify": "justify"}
+
+# Reglas comunes; todo va bajo `.dictamen-vista` para no afectar a la página
+# que contiene la vista (Streamlit inserta el HTML sin aislarlo).
+_CSS_BASE = """
+.dictamen-vista { font-family: "Trebuchet MS", sans-serif; font-size: 10pt; color: #000;
+  background: #fff; padding: 1.5em 2em; max-width: 17cm; }
+.dictamen-vista p { margin: 0 0 0.4em 0; }
+.dictamen-vista table { border-collapse: collapse; margin: 0.5em 0 1em 0; width: 100%; }
+.dictamen-vista th, .dictamen-vista td { border-bottom: 1px solid #bbb; padding: 2px 6px;
+  font-size: 9pt; vertical-align: top; }
+.dictamen-vista th { font-weight: bold; text-align: center; border-bottom: 1px solid #000; }
+.dictamen-vista td.num { text-align: right; white-space: nowrap; }
+.dictamen-vista table.simple td { border: 1px solid #000; }
+.dictamen-vista .salto-pagina { border: 0; border-top: 1px dashed #999; margin: 1.5em 0; }
+.dictamen-vista .aviso { color: #a00; font-style: italic; }
+"""
+
+
+def clase_estilo(nombre: str) -> str:
+    """Nombre de la clase CSS de un estilo de párrafo de Word."""
+    slug = re.sub(r"[^0-9a-zA-Z_-]+", "-", nombre.strip().lower()).strip("-")
+    return f"estilo-{slug or 'sin-nombre'}"
+
+
+def _reglas_estilo(estilo: Any) -> Dict[str, str]:
+    """Propiedades CSS de un estilo de Word, incluidas las heredadas de sus estilos base."""
+    cadena = []
+    actual = estilo
+    while actual is not None and actual not in cadena:
+        cadena.append(actual)
+        actual = actual.base_style
+
+    reglas: Dict[str, str] = {}
+    # Del más general al más concreto, para que el propio estilo tenga la última palabra
+    for s in reversed(cadena):
+        fuente = s.font
+        formato = s.paragraph_format
+        if fuente.name:
+            reglas["font-family"] = f'"{fuente.name}", sans-serif'
+        if fuente.size is not None:
+            reglas["font-size"] = f"{fuente.size.pt:g}pt"
+        if fuente.bold is not None:
+            reglas["font-weight"] = "bold" if fuente.bold else "normal"
+        if fuente.italic is not None:
+            reglas["font-style"] = "italic" if fuente.italic else "normal"
+        if fuente.underline is not None:
+            reglas["text-decoration"] = "underline" if fuente.underline else "none"
+        if fuente.all_caps:
+            reglas["text-transform"] = "uppercase"
+        if formato.alignment is not None:
+            alineacion = _ALINEACIONES_CSS.get(formato.alignment.name.lower())
+            if alineacion:
+                reglas["text-align"] = alineacion
+        if formato.left_indent is not None:
+            reglas["margin-left"] = f"{formato.left_indent / _EMU_POR_PUNTO:g}pt"
+        if formato.first_line_indent is not None:
+            reglas["text-indent"] = f"{formato.first_line_indent / _EMU_POR_PUNTO:g}pt"
+        if formato.space_before is not None:
+            reglas["margin-top"] = f"{formato.space_before / _EMU_POR_PUNTO:g}pt"
+        if formato.space_after is not None:
+            reglas["margin-bottom"] = f"{formato.space_after / _EMU_POR_PUNTO:g}pt"
+    return reglas
+
+
+class EstilosHTML:
+    """
+    Hoja de estilos derivada de los estilos de párrafo de la plantilla.
+
+    Se calcula una vez por plantilla (p. ej. con
+    `EstilosHTML(PlantillaCompilada(...).nuevo_documento())`) y se reutiliza en
+    cada renderizado. Sin documento, solo se aplican las reglas base.
+    """
+
+    def __init__(self, documento: DocumentType | None = None) -> None:
+        from docx.enum.style import WD_STYLE_TYPE
+
+        self.nombres: set[str] = set()
+        reglas_css: List[str] = []
+        if documento is not None:
+            for estilo in documento.styles:
+                if estilo.type != WD_STYLE_TYPE.PARAGRAPH or not estilo.name:
+                    continue
+                self.nombres.add(estilo.name)
+                reglas = _reglas_estilo(estilo)
+                if reglas:
+                    cuerpo = "; ".join(f"{k}: {v}" for k, v in reglas.items())
+                    reglas_css.append(f".dictamen-vista p.{clase_estilo(estilo.name)} {{ {cuerpo}; }}")
+        self.css = _CSS_BASE + "\n".join(reglas_css)
+
+    def clase_para(self, formato: FormatoTipo) -> str | None:
+        """
+        Clase del primer estilo candidato que existe (como `_aplicar_parrafo_config`,
+        `style` puede ser una lista separada por comas).
+        """
+        for candidato in formato.estilos:
+            if not self.nombres or candidato in self.nombres:
+                return clase_estilo(candidato)
+        return None
+
+
+# ------------------------
+# Bloques
+# ------------------------
+
+def _parrafo(texto: str, formato: FormatoTipo, estilos: EstilosHTML) -> str:
+    atributos = []
+    clase = estilos.clase_para(formato)
+    if clase:
+        atributos.append(f'class="{clase}"')
+
+    en_linea = []
+    alineacion = _ALINEACIONES_CSS.get(formato.alineacion_nombre or "")
+    if alineacion:
+        en_linea.append(f"text-align: {alineacion}")
+    if formato.sangria_cm is not None:
+        en_linea.append(f"text-indent: {formato.sangria_cm:g}cm")
+    if en_linea:
+        atributos.append(f'style="{"; ".join(en_linea)}"')
+
+    contenido = html.escape(texto) if texto.strip() else "&nbsp;"
+    return f"<p {' '.join(atributos)}>{contenido}</p>" if atributos else f"<p>{contenido}</p>"
+
+
+def _texto(texto: str, formato: FormatoTipo, estilos: EstilosHTML) -> List[str]:
+    """Igual que `_procesar_texto_directo`: un párrafo por línea."""
+    if not texto.strip():
+        return [_parrafo("", formato, estilos)]
+    return [_parrafo(linea, formato, estilos) for linea in texto.split("\n")]
+
+
+def _texto_encabezado(valor: Any) -> str:
+    # Mismo criterio que los encabezados de `_crear_tabla_clonada` (años sin ".0")
+    if isinstance(valor, float) and valor.is_integer():
+        return str(int(valor))
+    return str(valor) if valor is not None else ""
+
+
+def _es_numero(valor: Any) -> bool:
+    return isinstance(valor, (int, float)) and not isinstance(valor, bool) and not es_nulo(valor)
+
+
+def _tabla(filas: List[List[Any]], formato: FormatoTipo) -> List[str]:
+    if not filas:
+        return []
+
+    if not formato.modelo_tabla:
+        # Como `_crear_tabla_desde_datos`: rejilla simple con el valor tal cual
+        cuerpo = "".join(
+            "<tr>" + "".join(
+                f"<td>{html.escape(str(v) if v is not None else '')}</td>" for v in fila
+            ) + "</tr>"
+            for fila in filas
+        )
+        return [f'<table class="simple"><tbody>{cuerpo}</tbody></table>']
+
+    n_encabezado = formato.filas_encabezado
+    encabezados = filas[:n_encabezado]
+    datos = filas[n_encabezado:]
+    if formato.recortar_filas_vacias:
+        while datos and _fila_vacia(datos[0]):
+            datos = datos[1:]
+
+    partes = ["<table>"]
+    if encabezados:
+        partes.append("<thead>")
+        for fila in encabezados:
+            celdas = "".join(f"<th>{html.escape(_texto_encabezado(v))}</th>" for v in fila)
+            partes.append(f"<tr>{celdas}</tr>")
+        partes.append("</thead>")
+    partes.append("<tbody>")
+    for i, fila in enumerate(datos):
+        celdas = []
+        for j, valor in enumerate(fila):
+            texto = _formatear_celda_tabla(valor, i + n_encabezado, j, formato)
+            clase = ' class="num"' if _es_numero(valor) else ""
+            celdas.append(f"<td{clase}>{html.escape(texto)}</td>")
+        partes.append(f"<tr>{''.join(celdas)}</tr>")
+    partes.append("</tbody></table>")
+    return ["".join(partes)]
+
+
+def _bloque_por_rango(
+    wb: Workbook, sheet_name: str, rango: str,
+    formato: FormatoTipo, estilos: EstilosHTML,
+) -> List[str]:
+    """Bloques legacy (con `rango`): mismas ramas que `procesar_bloque_por_tipo`."""
+    filas = _leer_rango(wb, sheet_name, rango)
+
+    if formato.manejador == MANEJADOR_TABLA:
+        return _tabla(filas, formato)
+    if formato.manejador == MANEJADOR_TITULO:
+        texto = " ".join(str(v) for fila in filas for v in fila if v is not None).strip()
+        if not texto:
+            return []
+        salto = ['<hr class="salto-pagina">'] if formato.salto_pagina_antes else []
+        return salto + _texto(texto, formato, estilos)
+    if formato.manejador == MANEJADOR_NUM_NOTAS:
+        primero = filas[0][0] if filas and filas[0] else None
+        texto = str(primero).strip() if primero is not None else ""
+        return [_parrafo(texto, formato, estilos)] if texto else []
+
+    vinetas = formato.manejador == MANEJADOR_VINETAS
+    salida = []
+    for valores in filas:
+        if not vinetas and all(v is None for v in valores):
+            salida.append(_parrafo("", formato, estilos))
+            continue
+        texto = " ".join(str(v) for v in valores if v not in (None, ""))
+        if texto.strip():
+            salida.append(_parrafo(texto, formato, estilos))
+    return salida
+
+
+def render_bloques_html(
+    bloques: Iterable[Dict[str, Any]],
+    formatos: Dict[str, Any] | None,
+    estilos: EstilosHTML | None = None,
+    wb: Workbook | None = None,
+    sheet_name: str | None = None,
+) -> str:
+    """
+    Devuelve el HTML (sin hoja de estilos) de una lista de bloques.
+
+    Los bloques legacy con `rango` necesitan `wb` y `sheet_name`; sin ellos se
+    muestra un aviso en su lugar.
+    """
+    estilos = estilos or EstilosHTML()
+    salida: List[str] = []
+
+    for bloque in bloques:
+        tipo = str(bloque.get("tipo", "")).strip()
+        if not tipo:
+            continue
+        formato = formato_tipo(formatos, tipo)
+        contenido = bloque.get("contenido")
+        rango = str(bloque.get("rango", "") or "").strip()
+
+        if contenido is not None:
+            if formato.es_tabla:
+                if es_dataframe(contenido):
+                    salida.extend(_tabla(contenido.values.tolist(), formato))
+                else:
+                    salida.append(f'<p class="aviso">Bloque {html.escape(tipo)} sin tabla: se ignora.</p>')
+            else:
+                salida.extend(_texto(str(contenido), formato, estilos))
+        elif rango:
+            if wb is None or sheet_name is None:
+                salida.append(f'<p class="aviso">Bloque {html.escape(tipo)} ({html.escape(rango)}): requiere el libro.</p>')
+            else:
+                salida.extend(_bloque_por_rango(wb, sheet_name, rango, formato, estilos))
+
+    return "\n".join(salida)
+
+
+def render_seccion_html(
+    bloques: Iterable[Dict[str, Any]],
+    formatos: Dict[str, Any] | None,
+    estilos: EstilosHTML | None = None,
+    wb: Workbook | None = None,
+    sheet_name: str | None = None,
+) -> str:
+    """Fragmento HTML autocontenido (estilos + cuerpo) de una sección."""
+    estilos = estilos or EstilosHTML()
+    cuerpo = render_bloques_html(bloques, formatos, estilos, wb=wb, sheet_name=sheet_name)
+    return f'<style>{estilos.css}</style>\n<div class="dictamen-vista">\n{cuerpo}\n</div>'
+
+
+def pagina_html(seccion_html: str, titulo: str) -> str:
+    """Envuelve una sección en un documento HTML completo (para abrirlo en el navegador)."""
+    return (
+        "<!DOCTYPE html>\n<html lang=\"es\"><head><meta charset=\"utf-8\">"
+        f"<title>{html.escape(titulo)}</title></head>\n<body>\n{seccion_html}\n</body></html>\n"
+    )